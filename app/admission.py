@@ -0,0 +1,259 @@
+"""
+This module sheds load on the ingestion endpoints.
+
+Every POST under /receipts/process passes through AdmissionMiddleware
+before its body is read. It is rejected right away, instead of queueing
+for the handler threadpool, when:
+
+- the number of ingestion requests in flight has reached a cap (503),
+- the client has used up its token bucket (429), or
+- the store holds the maximum number of receipts (503).
+
+Rejections carry a Retry-After header telling the client when to try
+again, and are labelled with the matched route so that they show up in
+the request metrics. Every limit is off when set to 0.
+
+The store check only sees a request, not how many receipts it carries,
+so the handlers also reserve room for every receipt they store; a batch,
+stream or WebSocket stops storing receipts once the store is full.
+
+Dependencies:
+- starlette: The response sent to rejected requests.
+- metrics: The rejection counter.
+
+Classes:
+- TokenBuckets: Per-client token buckets.
+- AdmissionController: The limits and the in-flight count.
+- AdmissionMiddleware: ASGI middleware applying an AdmissionController.
+
+"""
+
+import math
+import threading
+import time
+
+from collections import OrderedDict
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+from starlette.routing import Match
+
+from .metrics import ADMISSION_REJECTED
+
+
+class TokenBuckets:
+    """
+    Represents a token bucket per client.
+
+    Each bucket holds up to burst tokens and refills at rate tokens per
+    second; a request takes one token. Only the most recently seen
+    max_clients buckets are kept, and a forgotten client starts again with
+    a full bucket.
+
+    Attributes:
+    - rate (float): The tokens added per second.
+    - burst (int): The bucket capacity.
+    - max_clients (int): The number of buckets kept.
+    """
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+
+    def take(self, client):
+        """
+        Takes a token from a client's bucket.
+
+        Parameters:
+        - client (str): The client key, e.g. its address.
+
+        Returns:
+        - float: 0 if a token was taken, otherwise the seconds until one is
+          available.
+        """
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[client] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class AdmissionController:
+    """
+    Decides whether an ingestion request is admitted.
+
+    Attributes:
+    - max_in_flight (int): The most ingestion requests handled at once.
+    - buckets (TokenBuckets or None): The per-client rate limits.
+    - max_entries (int): The most receipts the store may hold.
+    - size (callable): Returns the number of stored (or queued) receipts.
+    - size_interval (float): How long a store size is reused, in seconds.
+    - in_flight (int): The ingestion requests being handled.
+
+    Receipts reserved but not stored yet, and, when the size is reused,
+    receipts stored since it was counted, are added to the store size.
+    """
+
+    IN_FLIGHT_RETRY_AFTER = 1
+    STORE_FULL_RETRY_AFTER = 60
+
+    def __init__(self, max_in_flight=0, client_rate=0.0, client_burst=20,
+                 max_entries=0, size=None, size_interval=1.0):
+        self.max_in_flight = max_in_flight
+        self.buckets = None
+        if client_rate > 0:
+            self.buckets = TokenBuckets(client_rate, client_burst)
+        self.max_entries = max_entries
+        self.size = size
+        self.size_interval = size_interval
+        self.in_flight = 0
+        self._size = 0
+        self._size_checked = -math.inf
+        self._reserved = 0
+        self._stored = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.max_in_flight or self.buckets or self.max_entries)
+
+    async def _store_full(self):
+        """
+        Returns whether the store has reached max_entries, counting it at
+        most once per size_interval. A size_interval of 0 means counting is
+        cheap, so it is done inline on every call.
+        """
+        if self.size_interval:
+            now = time.monotonic()
+            if now - self._size_checked >= self.size_interval:
+                self._size_checked = now
+                size = await run_in_threadpool(self.size)
+                with self._lock:
+                    self._size, self._stored = size, 0
+        return self._current_size() >= self.max_entries
+
+    def _current_size(self):
+        """
+        Returns the store size including the receipts not counted in it
+        yet.
+        """
+        if not self.size_interval:
+            return self.size() + self._reserved
+        return self._size + self._stored + self._reserved
+
+    def reserve(self, count):
+        """
+        Reserves room in the store for up to count receipts. Every call
+        must be followed by a call to settle.
+
+        Parameters:
+        - count (int): The number of receipts to be stored.
+
+        Returns:
+        - int: The number of receipts that may be stored, from 0 to count.
+        """
+        if not self.max_entries:
+            return count
+        with self._lock:
+            granted = max(0, min(count,
+                                 self.max_entries - self._current_size()))
+            self._reserved += granted
+        if granted < count:
+            ADMISSION_REJECTED.inc("store_full")
+        return granted
+
+    def settle(self, granted, stored):
+        """
+        Releases a reservation once its receipts are stored.
+
+        Parameters:
+        - granted (int): The number of receipts reserve returned.
+        - stored (int): The number of those receipts that were stored.
+        """
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._reserved -= granted
+            if self.size_interval:
+                self._stored += stored
+
+    async def admit(self, client):
+        """
+        Admits a request, counting it as in flight, or rejects it.
+
+        Parameters:
+        - client (str): The client key.
+
+        Returns:
+        - tuple or None: None if admitted, otherwise the status code,
+          message and Retry-After seconds of the rejection.
+        """
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            ADMISSION_REJECTED.inc("in_flight")
+            return (503, "Too many requests in flight.",
+                    self.IN_FLIGHT_RETRY_AFTER)
+        self.in_flight += 1
+        rejection = None
+        if self.buckets is not None:
+            wait = self.buckets.take(client)
+            if wait:
+                ADMISSION_REJECTED.inc("rate")
+                rejection = 429, "Rate limit exceeded.", math.ceil(wait)
+        if (rejection is None and self.max_entries
+                and await self._store_full()):
+            ADMISSION_REJECTED.inc("store_full")
+            rejection = (503, "Receipt store is full.",
+                         self.STORE_FULL_RETRY_AFTER)
+        if rejection is not None:
+            self.in_flight -= 1
+        return rejection
+
+    def release(self):
+        """
+        Marks an admitted request as finished.
+        """
+        self.in_flight -= 1
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying an AdmissionController to POST requests under
+    a path prefix.
+    """
+
+    def __init__(self, app, controller, prefix="/receipts/process"):
+        self.app = app
+        self.controller = controller
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] != "POST"
+                or not scope["path"].startswith(self.prefix)):
+            await self.app(scope, receive, send)
+            return
+        client = scope["client"][0] if scope.get("client") else ""
+        rejection = await self.controller.admit(client)
+        if rejection is not None:
+            status, detail, retry_after = rejection
+            for route in scope["app"].routes:
+                match, child = route.matches(scope)
+                if match == Match.FULL:
+                    scope.update(child)
+                    break
+            response = JSONResponse({"detail": detail}, status_code=status,
+                                    headers={"Retry-After": str(retry_after)})
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release()
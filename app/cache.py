@@ -0,0 +1,128 @@
+"""
+This module provides a bounded cache of scoring results keyed by a
+canonical hash of the receipt, so that replayed receipts are not scored
+again.
+
+Dependencies:
+- hashlib: Provides the BLAKE2 hash used for receipt keys.
+- collections: Provides the OrderedDict behind the LRU order.
+
+Classes:
+- ScoreCache: A thread-safe LRU cache with a time-to-live, counting hits,
+  misses and evictions.
+
+Functions:
+- receipt_key(receipt): Returns the canonical hash of a receipt.
+
+"""
+
+import hashlib
+import threading
+import time
+
+from collections import OrderedDict
+
+
+def receipt_key(receipt):
+    """
+    Returns the canonical hash of a receipt.
+
+    The hash covers the parsed field values in model order, so two receipts
+    with the same content always get the same key whatever the key order or
+    whitespace of the JSON they were parsed from. Strings are hashed by
+    their repr, which quotes and escapes them, so field boundaries cannot
+    be forged.
+
+    Parameters:
+    - receipt (Receipt): The receipt to hash.
+
+    Returns:
+    - bytes: A 16-byte BLAKE2b digest.
+    """
+    parts = [repr(receipt.retailer), receipt.purchaseDate.isoformat(),
+             receipt.purchaseTime.isoformat(), str(receipt.total)]
+    for item in receipt.items:
+        parts.append(repr(item.shortDescription))
+        parts.append(str(item.price))
+    return hashlib.blake2b(" ".join(parts).encode(),
+                           digest_size=16).digest()
+
+
+class ScoreCache:
+    """
+    Represents a thread-safe LRU cache of scored records with a time-to-live.
+
+    Attributes:
+    - maxsize (int): The maximum number of cached records. 0 disables the
+      cache.
+    - ttl (float): The number of seconds a record stays cached.
+    - hits (int): The number of lookups answered from the cache.
+    - misses (int): The number of lookups that had to score the receipt.
+    - evictions (int): The number of records dropped because the cache was
+      full or their time-to-live expired.
+    """
+
+    def __init__(self, maxsize=10000, ttl=3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_create(self, key, factory):
+        """
+        Returns the cached value for a key, calling factory() to create and
+        cache it on a miss.
+
+        Parameters:
+        - key (bytes): The cache key, see receipt_key.
+        - factory (callable): Creates the value on a miss.
+
+        Returns:
+        - The cached or newly created value.
+        """
+        if not self.maxsize:
+            return factory()
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                value, expires = cached
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+        value = factory()
+        with self._lock:
+            self._entries[key] = (value, now + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+        - dict: The size, hits, misses and evictions of the cache.
+        """
+        return {"size": len(self._entries), "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+    def clear(self):
+        """
+        Drops every cached value and resets the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
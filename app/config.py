@@ -0,0 +1,142 @@
+"""
+This module defines the runtime settings of the API.
+
+Every setting can be overridden with an environment variable of the same
+name prefixed with RECEIPT_, e.g. RECEIPT_STORE_URL=sqlite:///receipts.db,
+except web_concurrency, which is read from WEB_CONCURRENCY like uvicorn's
+worker count.
+
+Dependencies:
+- pydantic: Maps web_concurrency to its unprefixed variable.
+- pydantic_settings: Loads settings from the environment.
+
+Classes:
+- Settings (BaseSettings): The runtime settings.
+  - web_concurrency (int): The number of uvicorn worker processes. The
+    in-memory store is refused with more than one.
+  - store_url (str): The receipt store URL, "memory" or "sqlite:///path".
+  - store_batch_size (int): The number of writes grouped into one commit.
+  - store_commit_interval (float): The longest time, in seconds, a write
+    may wait for its group commit.
+  - store_sync_commit (bool): Whether a POST waits for its receipt to be
+    committed. Required when several worker processes share an SQLite
+    store, so that every worker can read the receipt once its ID is
+    returned.
+  - snapshot_path (str): The snapshot file of the in-memory store (see
+    db.snapshot). When set, the store is loaded from it at startup and
+    written to it periodically and on shutdown. Empty disables snapshots.
+  - snapshot_interval (float): The seconds between snapshots. 0 only
+    writes one on shutdown.
+  - retention_ttl (float): The seconds a receipt is kept in the in-memory
+    store. 0 for no limit.
+  - retention_max_entries (int): The most receipts kept in the in-memory
+    store. 0 for no limit.
+  - retention_max_bytes (int): The estimated memory the receipts in the
+    in-memory store may use. 0 for no limit.
+  - retention_cold_path (str): The SQLite file receipts evicted from the
+    in-memory store are moved to, compressed. Empty drops them.
+  - score_cache_size (int): The number of scoring results cached by receipt
+    content. 0 disables the cache.
+  - score_cache_ttl (float): The number of seconds a scoring result stays
+    cached.
+  - time_ordered_ids (bool): Whether receipt IDs are version 7 UUIDs,
+    which sort by creation time and can be listed by GET /receipts,
+    instead of random version 4 UUIDs.
+  - idempotency_keys (int): The number of Idempotency-Key headers
+    remembered with the receipt ID returned for them. 0 ignores the header.
+  - idempotency_ttl (float): The number of seconds an Idempotency-Key is
+    remembered.
+  - stream_max_line_bytes (int): The longest NDJSON line accepted by the
+    streaming endpoint.
+  - ws_window (int): The most receipts a WebSocket client may have sent
+    without getting their acknowledgements back.
+  - metrics_enabled (bool): Whether to collect the metrics exported on
+    /metrics.
+  - fast_io (bool): Whether to parse request bodies with orjson, answer
+    with ORJSONResponse and keep each receipt's points response
+    pre-serialized.
+  - pipeline_enabled (bool): Whether POST /receipts/process queues receipts
+    for background scoring instead of scoring them before it returns.
+  - pipeline_queue_size (int): The most receipts waiting to be scored.
+  - pipeline_workers (int): The number of background scoring threads.
+  - pipeline_batch_size (int): The most receipts scored and stored at once
+    by a background thread.
+  - admission_max_in_flight (int): The most ingestion requests handled at
+    once. 0 disables the cap.
+  - admission_client_rate (float): The ingestion requests per second
+    allowed per client address. 0 disables the per-client limit.
+  - admission_client_burst (int): The ingestion requests a client may make
+    at once before its rate applies.
+  - store_max_entries (int): The most receipts accepted into the store.
+    0 disables the limit.
+  - rules_path (str): A JSON rule set file (see app.rules) to score with
+    instead of the built-in rules. Empty for the built-in rules.
+  - rules_admin_enabled (bool): Whether the /admin/rules endpoints, which
+    replace the rule set while the API runs, are served.
+  - rescore_chunk_size (int): The most stored receipts re-scored at once
+    after the rule set changes.
+  - rescore_rate (float): The most stored receipts scanned per second by
+    re-scoring. 0 disables the throttle.
+  - profiling_enabled (bool): Whether the request handlers can be profiled
+    and the /admin/profile endpoints are served.
+  - profile_dir (str): The directory profiles are written to.
+  - profile_seconds (float): The length of a profiling session started at
+    startup. 0 starts none.
+  - profile_rate (float): The fraction of requests covered by the session
+    started at startup.
+
+Global Variables:
+- settings: The settings loaded at import time.
+
+"""
+
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class Settings(BaseSettings):
+    """
+    Represents the runtime settings of the API.
+    """
+    model_config = SettingsConfigDict(env_prefix="RECEIPT_")
+
+    web_concurrency: int = Field(default=1,
+                                 validation_alias="WEB_CONCURRENCY")
+    store_url: str = "memory"
+    store_batch_size: int = 256
+    store_commit_interval: float = 0.05
+    store_sync_commit: bool = False
+    snapshot_path: str = ""
+    snapshot_interval: float = 300.0
+    retention_ttl: float = 0.0
+    retention_max_entries: int = 0
+    retention_max_bytes: int = 0
+    retention_cold_path: str = ""
+    score_cache_size: int = 10000
+    score_cache_ttl: float = 3600.0
+    time_ordered_ids: bool = False
+    idempotency_keys: int = 100000
+    idempotency_ttl: float = 86400.0
+    stream_max_line_bytes: int = 1048576
+    ws_window: int = 64
+    metrics_enabled: bool = True
+    fast_io: bool = False
+    pipeline_enabled: bool = False
+    pipeline_queue_size: int = 10000
+    pipeline_workers: int = 2
+    pipeline_batch_size: int = 64
+    admission_max_in_flight: int = 0
+    admission_client_rate: float = 0.0
+    admission_client_burst: int = 20
+    store_max_entries: int = 0
+    rules_path: str = ""
+    rules_admin_enabled: bool = False
+    rescore_chunk_size: int = 500
+    rescore_rate: float = 20000.0
+    profiling_enabled: bool = False
+    profile_dir: str = "profiles"
+    profile_seconds: float = 0.0
+    profile_rate: float = 1.0
+
+
+settings = Settings()
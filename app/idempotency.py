@@ -0,0 +1,159 @@
+"""
+This module makes retried ingestion requests idempotent.
+
+A client that retries POST /receipts/process after a timeout can send the
+same Idempotency-Key header with every attempt. The first request with a
+key scores and stores the receipt, and the response is kept under the key
+for a time-to-live; a repeated request gets that response back without any
+scoring or storing. Requests with the same key that arrive while the first
+one is still being handled wait for it and share its response, so only one
+of them does the work. A key reused with a different receipt is rejected.
+
+Waiting blocks the calling thread, which is safe because the handlers run
+on the threadpool, or inline on the event loop only when they never yield
+(the in-memory store), in which case no other request with the key can be
+in progress.
+
+Dependencies:
+- collections: Provides the OrderedDict behind the expiry order.
+- threading: Lets requests with the same key wait for the first one.
+
+Classes:
+- IdempotencyKeys: A bounded, thread-safe table of keys and responses with
+  a time-to-live.
+
+Global Variables:
+- MAX_KEY_LENGTH: The longest Idempotency-Key accepted.
+
+"""
+
+import threading
+import time
+
+from collections import OrderedDict
+
+
+MAX_KEY_LENGTH = 255
+
+
+class _Entry:
+    """
+    Represents a key's request fingerprint and response, once there is one.
+    """
+    __slots__ = ("fingerprint", "expires", "done", "result")
+
+    def __init__(self, fingerprint, expires):
+        self.fingerprint = fingerprint
+        self.expires = expires
+        self.done = False
+        self.result = None
+
+
+class IdempotencyKeys:
+    """
+    Represents a thread-safe table of idempotency keys with a time-to-live.
+
+    Keys are kept in the order they were first seen, which is also the
+    order they expire in, so expired keys are dropped from the front as new
+    ones are added. When the table is full the oldest key is dropped, even
+    if it has not expired.
+
+    Attributes:
+    - maxsize (int): The maximum number of keys. 0 disables the table.
+    - ttl (float): The number of seconds a key is remembered.
+    - replays (int): The number of requests answered with the response of
+      an earlier request, including those that waited for it.
+    - evictions (int): The number of keys dropped because the table was
+      full or their time-to-live expired.
+    """
+
+    def __init__(self, maxsize=100000, ttl=86400.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.replays = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_create(self, key, fingerprint, factory):
+        """
+        Returns the response stored for a key, calling factory() to create
+        and store it if the key is new. If factory raises, nothing is
+        stored and a request waiting for the key tries again itself.
+
+        Parameters:
+        - key (str): The Idempotency-Key header.
+        - fingerprint (bytes): Identifies the request content, see
+          receipt_key.
+        - factory (callable): Handles the request.
+
+        Returns:
+        - The stored or newly created response.
+
+        Raises:
+        - ValueError: If the key was used with a different fingerprint.
+        """
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                entry = self._entries.get(key)
+                if entry is not None and entry.done and entry.expires <= now:
+                    del self._entries[key]
+                    self.evictions += 1
+                    entry = None
+                if entry is None:
+                    entry = _Entry(fingerprint, now + self.ttl)
+                    self._entries[key] = entry
+                    self._evict(now)
+                    break
+                if entry.fingerprint != fingerprint:
+                    raise ValueError(
+                        "Idempotency-Key was used with a different receipt.")
+                self._done.wait_for(lambda: entry.done)
+                if entry.result is not None:
+                    self.replays += 1
+                    return entry.result
+        try:
+            result = factory()
+        except BaseException:
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+                entry.done = True
+                self._done.notify_all()
+            raise
+        with self._lock:
+            entry.result = result
+            entry.done = True
+            self._done.notify_all()
+        return result
+
+    def _evict(self, now):
+        """
+        Drops expired keys from the front, then the oldest keys while the
+        table is over maxsize. Called with the lock held.
+        """
+        entries = self._entries
+        while entries:
+            entry = next(iter(entries.values()))
+            if not (entry.done and entry.expires <= now):
+                break
+            entries.popitem(last=False)
+            self.evictions += 1
+        while len(entries) > self.maxsize:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Returns the table counters.
+
+        Returns:
+        - dict: The size, replays and evictions of the table.
+        """
+        return {"size": len(self._entries), "replays": self.replays,
+                "evictions": self.evictions}
@@ -3,69 +3,1319 @@ This module defines an API using FastAPI for processing receipts
 and calculating points.
 
 Endpoints:
-- POST /receipts/process: Generates a receipt ID for a given receipt.
+- POST /receipts/process: Generates a receipt ID for a given receipt. With
+  RECEIPT_PIPELINE_ENABLED set, the receipt is scored in the background.
+  A retried request with the same Idempotency-Key header gets the original
+  ID back without the receipt being scored or stored again.
+  Every POST under /receipts/process may be rejected with 429 or 503 and a
+  Retry-After header when admission limits are configured.
+- POST /receipts/process/batch: Generates receipt IDs for a list of receipts,
+  reporting per-item validation errors without failing the whole batch.
+- POST /receipts/process/stream: Generates receipt IDs for an NDJSON stream
+  of receipts, streaming back one NDJSON result line per receipt.
+- WebSocket /receipts/ws: Generates receipt IDs for receipts sent as
+  frames over a long-lived connection, acknowledging each frame with its
+  sequence number and ID or error, within a window of unacknowledged
+  frames.
 - GET /receipts/{id}/points: Retrieves the points and breakdown
-  for a given receipt ID.
+  for a given receipt ID. The optional "fields" query parameter selects
+  which of the two to return, e.g. ?fields=points skips rendering the
+  breakdown. The response also holds the version of the rule set that
+  scored the receipt. Returns 202 while a receipt is still queued for
+  scoring. Responses carry an ETag and a Cache-Control header, and a
+  matching If-None-Match is answered with 304.
+- GET /receipts: Lists the receipts created in a time window (the
+  "since" and "until" query parameters), in ID order, with "limit"
+  receipts per page and the "cursor" of the next page. Only receipts with
+  time-ordered IDs (RECEIPT_TIME_ORDERED_IDS) are listed.
+- GET /metrics: Exports request, scoring, store and cache metrics in the
+  Prometheus text format.
+- POST /admin/profile: Starts a profiling session over the process and
+  points handlers. Only served when RECEIPT_PROFILING_ENABLED is set.
+- GET /admin/profile: Describes the running session and lists the written
+  profiles.
+- GET /admin/profile/{name}: Downloads a written profile.
+- GET /admin/rules: Describes the active rule set and the re-scoring job.
+  Only served, like the endpoints below, when RECEIPT_RULES_ADMIN_ENABLED
+  is set.
+- PUT /admin/rules: Activates a rule set and starts re-scoring the stored
+  receipts with it in the background.
+- POST /admin/rules/reload: Activates the rule set file again.
+- POST /admin/rules/rescore/{action}: Pauses or resumes re-scoring.
+
+With RECEIPT_FAST_IO set, every route answers through ORJSONResponse, the
+process, batch and points endpoints are served by async handlers that
+parse the raw body with orjson, and the full points response of each
+receipt is serialized once, when it is scored, and served as stored.
+
+POST /receipts/process also accepts a MessagePack body (Content-Type
+application/msgpack), and both it and GET /receipts/{id}/points answer in
+MessagePack when the Accept header prefers it.
 
 Dependencies:
 - fastapi: The FastAPI framework for building APIs.
 - models: Contains the Item and Receipt models used in the API.
 - utils: Provides helper functions for generating receipt IDs
   and calculating points.
+- config: Provides the runtime settings, including the receipt store URL.
+- cache: Provides the cache of scoring results keyed by receipt content.
+- idempotency: Remembers the responses to requests with an Idempotency-Key.
+- metrics: Collects request, scoring and store metrics.
+- admission: Rejects ingestion requests over the configured limits.
+- profiling: Profiles live requests on demand.
+- pipeline: Scores queued receipts in the background.
+- rules: Compiles, loads and activates versioned rule sets.
+- rescoring: Re-scores stored receipts when the rule set changes.
+- negotiation: Decodes and encodes MessagePack bodies.
 
 Global Variables:
-- db.uuid_dict: A dictionary to store receipt IDs and their corresponding
-  Receipt objects.
+- db.store: The receipt store mapping receipt IDs to compact ReceiptRecord
+  objects holding the receipt and its score. Defaults to the in-memory
+  db.uuid_dict.
+- score_cache: The ScoreCache reused for receipts identical to one already
+  scored.
+- idempotency_keys: The IdempotencyKeys table of Idempotency-Key headers
+  and the receipt IDs returned for them.
+- admission: The AdmissionController limiting in-flight ingestion requests,
+  per-client request rates and the store size.
+- profiler: The Profiler wrapping get_receipt_id and get_points.
+- pipeline: The ScoringPipeline used by get_receipt_id, or None when
+  receipts are scored before the ID is returned.
+- rescorer: The Rescorer bringing stored records up to the active rule
+  set.
+- snapshotter: The Snapshotter writing snapshots of the in-memory store
+  (RECEIPT_SNAPSHOT_PATH), or None.
+- retention: The RetentionPolicy bounding the in-memory store, or None.
+- cold_store: The compressed SQLiteStore receipts evicted from the
+  in-memory store are moved to (RECEIPT_RETENTION_COLD_PATH), or None.
+- CACHE_CONTROL: The Cache-Control header of points responses.
 
 Functions:
-- get_receipt_id(receipt: Receipt): Generates a receipt ID for a given receipt
-  and stores it in db.uuid_dict.
-- get_points(id: str): Retrieves the points and breakdown for a given
-  receipt ID from db.uuid_dict.
+- finish_record(record: ReceiptRecord): Computes the entity tag and, in
+  the fast I/O mode, the serialized response of a scored record.
+- new_record(receipt: Receipt, rule_set: RuleSet): Scores a receipt into a
+  new ReceiptRecord.
+- rescore_record(record: ReceiptRecord): Scores a copy of a record with the
+  active rule set, unless it is up to date.
+- build_record(receipt: Receipt): Scores a receipt into a ReceiptRecord,
+  reusing the record of an identical receipt when it is cached.
+- save_records(entries: dict): Writes scored records to db.store.
+- load_record(id: str): Reads a record from db.store.
+- store_chunks(size: int): Yields every stored record, including those in
+  cold_store, for re-scoring.
+- store_receipt(receipt: Receipt): Generates a receipt ID for a given
+  receipt and stores it in db.store.
+- get_receipt_id(receipt: Receipt, idempotency_key: str): Calls
+  store_receipt once per Idempotency-Key.
+- get_receipt_ids(receipts: list): Validates, scores and stores a batch of
+  receipts, returning one result per input in the same order.
+- process_ndjson_lines(lines: list): Validates, scores and stores a chunk of
+  numbered NDJSON lines.
+- get_receipt_ids_stream(request: Request): Streams NDJSON results for an
+  NDJSON request body without buffering either of them.
+- process_ws_frame(seq: int, frame: str | bytes): Validates, scores and
+  stores the receipt in one WebSocket frame.
+- receive_receipts_ws(websocket: WebSocket): Acknowledges the receipt
+  frames of a WebSocket connection.
+- etag_matches(if_none_match: str, etag: str): Checks an If-None-Match
+  header against an entity tag.
+- get_points(id: str, fields: str, if_none_match: str, accept: str):
+  Retrieves the points and/or breakdown for a given receipt ID from
+  db.store, as JSON or MessagePack, or 304 if the client's copy is
+  current.
+- list_receipts(since: datetime, until: datetime, cursor: str, limit: int):
+  Lists the receipts created in a time window, a page at a time.
+- parse_body(body: bytes, model: type, content_type: str): Parses a raw
+  JSON or MessagePack request body.
+- get_receipt_id_fast(request: Request, idempotency_key: str),
+  get_receipt_ids_fast(request: Request), get_points_fast(id: str,
+  fields: str, if_none_match: str, accept: str): The fast I/O variants of
+  the handlers above.
+- get_metrics(): Renders the metrics in the Prometheus text format.
+- describe_rules(), swap_rules(rule_set: RuleSet): Describe and activate
+  rule sets, for get_rules, put_rules, reload_rules and
+  control_rescoring.
+- start_profile(seconds: float, rate: float, mode: str): Starts a profiling
+  session.
+- get_profile_status(): Describes the profiling session and profiles.
+- get_profile(name: str): Returns a written profile file.
+- close_store(): Scores queued receipts and stops re-scoring, then writes
+  a final snapshot, if enabled, and flushes and closes the receipt store on
+  shutdown.
 
 """
 
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+from datetime import datetime
+from typing import Annotated, Any, List, Literal, Optional
+
 from db import db
-from fastapi import FastAPI, HTTPException
+from db.records import ReceiptRecord
+from db.retention import RetentionPolicy
+from db.snapshot import Snapshot, Snapshotter
+from db.stores import SQLiteStore
+import msgpack
+import orjson
+
+from fastapi import (Body, FastAPI, Header, HTTPException, Query, Request,
+                     WebSocket)
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import (FileResponse, JSONResponse, ORJSONResponse,
+                               PlainTextResponse, Response)
+from starlette.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from .admission import AdmissionController, AdmissionMiddleware
+from .cache import ScoreCache, receipt_key
+from .config import settings
+from .idempotency import MAX_KEY_LENGTH, IdempotencyKeys
+from .metrics import (SCORE_SECONDS, STORE_SECONDS, WS_FRAMES,
+                      MetricsMiddleware,
+                      process_memory_bytes, render, rule_metrics)
 from .models import Receipt
-from .utils import generate_receipt_id, calculate_points
+from .negotiation import (MSGPACK_MEDIA_TYPE, MsgPackResponse, MsgPackRoute,
+                          accepts_msgpack, is_msgpack, unpack_body)
+from .pipeline import ScoringPipeline
+from .profiling import Profiler
+from .rescoring import Rescorer
+from .responses import DuplexStreamingResponse
+from .rules import (RuleSet, RuleSetConfig, activate, get_rule_set,
+                    load_rule_set)
+from .utils import (compute_etag, generate_receipt_id, receipt_id_bound,
+                    receipt_id_time, render_breakdown, score_record)
+from .validation import format_validation_error
+
+
+logger = logging.getLogger(__name__)
+
+POINTS_FIELDS = ("points", "breakdown")
+MAX_PAGE_SIZE = 1000
+
+response_class = ORJSONResponse if settings.fast_io else JSONResponse
+app = FastAPI(default_response_class=response_class)
+if settings.rules_path:
+    activate(load_rule_set(settings.rules_path))
+# Points only change when the rule set does, so responses may be cached
+# for good unless another rule set can be loaded.
+if settings.rules_path or settings.rules_admin_enabled:
+    CACHE_CONTROL = "no-cache"
+else:
+    CACHE_CONTROL = "max-age=31536000, immutable"
+if settings.web_concurrency > 1 and settings.store_url == "memory":
+    # Each worker would have its own store, so a receipt posted to one
+    # worker would be missing from the others.
+    raise RuntimeError(
+        f"WEB_CONCURRENCY={settings.web_concurrency} needs a shared "
+        f"store; set RECEIPT_STORE_URL=sqlite:///path and "
+        f"RECEIPT_STORE_SYNC_COMMIT=1")
+db.configure(settings.store_url,
+             batch_size=settings.store_batch_size,
+             commit_interval=settings.store_commit_interval,
+             sync_commit=settings.store_sync_commit)
+retention = RetentionPolicy(settings.retention_ttl,
+                            settings.retention_max_entries,
+                            settings.retention_max_bytes)
+if not retention.enabled or settings.store_url != "memory":
+    retention = None
+cold_store = None
+if retention is not None:
+    if settings.retention_cold_path:
+        # Evictions only queue writes, which the store's background thread
+        # commits, and never wait for a commit themselves.
+        cold_store = SQLiteStore(
+            settings.retention_cold_path, batch_size=sys.maxsize,
+            commit_interval=settings.store_commit_interval, compress=True)
+    db.store.set_retention(retention, cold_store)
+snapshotter = None
+if settings.snapshot_path and settings.store_url == "memory":
+    # Reads are served from the snapshot while it loads in the background.
+    if os.path.exists(settings.snapshot_path):
+        db.store.load_snapshot(Snapshot(settings.snapshot_path))
+    snapshotter = Snapshotter(db.store, settings.snapshot_path,
+                              settings.snapshot_interval)
+score_cache = ScoreCache(settings.score_cache_size, settings.score_cache_ttl)
+idempotency_keys = IdempotencyKeys(settings.idempotency_keys,
+                                   settings.idempotency_ttl)
+admission = AdmissionController(
+    max_in_flight=settings.admission_max_in_flight,
+    client_rate=settings.admission_client_rate,
+    client_burst=settings.admission_client_burst,
+    max_entries=settings.store_max_entries,
+    size=lambda: len(db.store) + (pipeline.pending() if pipeline else 0),
+    size_interval=0.0 if settings.store_url == "memory" else 1.0)
+if admission.enabled:
+    app.add_middleware(AdmissionMiddleware, controller=admission)
+rule_metrics.enabled = settings.metrics_enabled
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+profiler = Profiler(settings.profiling_enabled, settings.profile_dir)
+if settings.profiling_enabled and settings.profile_seconds > 0:
+    profiler.start(settings.profile_seconds, settings.profile_rate)
+
+
+@app.on_event("shutdown")
+def close_store():
+    """
+    Scores the queued receipts, then writes a final snapshot of the
+    in-memory store, if enabled, and flushes pending writes and closes the
+    receipt store.
+    """
+    if pipeline is not None:
+        pipeline.close()
+    rescorer.close()
+    if snapshotter is not None:
+        snapshotter.close()
+    db.store.close()
+
+
+def finish_record(record):
+    """
+    Computes the entity tag of a scored record's points response and, in
+    the fast I/O mode, serializes the full points response into the
+    record's body, so that get_points can serve it as is.
+
+    Parameters:
+    - record (ReceiptRecord): The scored record.
+
+    Returns:
+    - ReceiptRecord: The same record.
+    """
+    record.etag = compute_etag(record)
+    if settings.fast_io:
+        record.body = orjson.dumps({"points": record.points,
+                                    "breakdown": render_breakdown(record),
+                                    "version": record.version})
+    return record
+
+
+def new_record(receipt, rule_set=None):
+    """
+    Scores a receipt into a new ReceiptRecord.
+
+    Parameters:
+    - receipt (Receipt): The receipt to score.
+    - rule_set (RuleSet): The rules to score it with. Defaults to the
+      active rule set.
+
+    Returns:
+    - ReceiptRecord: The scored record.
+    """
+    return finish_record(score_record(ReceiptRecord.from_receipt(receipt),
+                                      rule_set))
+
+
+def rescore_record(record):
+    """
+    Scores a copy of a record with the active rule set, unless the record
+    was scored by it already. The record itself is left as it is, since
+    requests may be reading it.
+
+    Parameters:
+    - record (ReceiptRecord): The record.
+
+    Returns:
+    - ReceiptRecord or None: The new record, or None if the record is up
+      to date.
+    """
+    rule_set = get_rule_set()
+    if record.version == rule_set.version:
+        return None
+    return finish_record(score_record(record.copy(), rule_set))
+
+
+def build_record(receipt):
+    """
+    Scores a receipt into a ReceiptRecord.
+
+    Records are never modified once scored, so a receipt identical to one
+    in score_cache, and scored by the same rule set, shares that receipt's
+    record instead of being scored and stored again.
+
+    Parameters:
+    - receipt (Receipt): The receipt to score.
+
+    Returns:
+    - ReceiptRecord: The scored record.
+    """
+    start = time.perf_counter()
+    rule_set = get_rule_set()
+    if not score_cache.maxsize:
+        record = new_record(receipt, rule_set)
+    else:
+        record = score_cache.get_or_create(
+            (rule_set.version, receipt_key(receipt)),
+            lambda: new_record(receipt, rule_set))
+    if settings.metrics_enabled:
+        SCORE_SECONDS.observe(time.perf_counter() - start)
+    return record
+
+
+def save_records(entries):
+    """
+    Writes scored records to db.store.
+
+    Parameters:
+    - entries (dict): The records, keyed by receipt ID.
+    """
+    start = time.perf_counter()
+    db.store.put_many(entries)
+    if settings.metrics_enabled:
+        STORE_SECONDS.observe(time.perf_counter() - start, "put")
+
+
+def load_record(id):
+    """
+    Reads a record from db.store.
+
+    Parameters:
+    - id (str): The receipt ID.
+
+    Returns:
+    - ReceiptRecord or None: The record, or None if the ID is unknown.
+    """
+    start = time.perf_counter()
+    record = db.store.get(id)
+    if settings.metrics_enabled:
+        operation = "get"
+        if (cold_store is not None and record is not None
+                and id not in db.uuid_dict):
+            operation = "get_cold"
+        STORE_SECONDS.observe(time.perf_counter() - start, operation)
+    return record
 
 
-app = FastAPI()
+def store_chunks(size):
+    """
+    Yields every stored record, in lists of up to size (receipt_id, record)
+    pairs, including the records moved to cold_store. Re-scored records are
+    saved to db.store, so those from cold_store move back into memory until
+    they are evicted again.
+
+    Parameters:
+    - size (int): The chunk size.
+    """
+    yield from db.store.chunks(size)
+    if cold_store is not None:
+        yield from cold_store.chunks(size)
 
 
-@app.post("/receipts/process")
-def get_receipt_id(receipt: Receipt):
+rescorer = Rescorer(store_chunks, rescore_record,
+                    save_records, chunk_size=settings.rescore_chunk_size,
+                    rate=settings.rescore_rate)
+if settings.rules_path:
+    # Records stored by an earlier run may have been scored by other rules.
+    rescorer.start(get_rule_set().version)
+
+pipeline = None
+if settings.pipeline_enabled:
+    pipeline = ScoringPipeline(build_record, save_records,
+                               maxsize=settings.pipeline_queue_size,
+                               workers=settings.pipeline_workers,
+                               batch_size=settings.pipeline_batch_size)
+
+
+def store_receipt(receipt):
     """
-    Generates a receipt ID for a given receipt and stores it in db.uuid_dict.
+    Generates a receipt ID for a given receipt and stores it in db.store.
+
+    When the scoring pipeline is enabled, the receipt is queued and scored
+    in the background instead, and the ID is returned right away.
 
     Parameters:
     - receipt (Receipt): The receipt object containing the receipt information.
 
     Returns:
     - dict: A dictionary containing the generated receipt ID.
+
+    Raises:
+    - HTTPException: 503 if the scoring queue is full.
     """
-    id = generate_receipt_id()
-    db.uuid_dict[id] = [receipt]
-    points, breakdown = calculate_points(id, db.uuid_dict)
-    db.uuid_dict[id].append((points, breakdown))
+    id = generate_receipt_id(settings.time_ordered_ids)
+    if pipeline is None:
+        save_records({id: build_record(receipt)})
+    elif not pipeline.submit(id, receipt):
+        raise HTTPException(status_code=503,
+                            detail="Scoring queue is full.",
+                            headers={"Retry-After": "1"})
     return {"id": id}
 
 
-@app.get("/receipts/{id}/points")
-def get_points(id: str):
+@profiler.wrap
+def get_receipt_id(
+        receipt: Receipt,
+        idempotency_key: Annotated[Optional[str], Header()] = None):
+    """
+    Generates a receipt ID for a given receipt and stores it in db.store.
+
+    A request with an Idempotency-Key header already seen with the same
+    receipt gets the original ID back without the receipt being scored or
+    stored again, and concurrent requests with the same key are handled
+    once.
+
+    Parameters:
+    - receipt (Receipt): The receipt object containing the receipt information.
+    - idempotency_key (str): The Idempotency-Key request header.
+
+    Returns:
+    - dict: A dictionary containing the receipt ID.
+
+    Raises:
+    - HTTPException: 400 if the key is too long, 422 if it was used with a
+      different receipt, 503 if the scoring queue is full.
+    """
+    if idempotency_key is None or not idempotency_keys.maxsize:
+        return store_receipt(receipt)
+    if len(idempotency_key) > MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Idempotency-Key must be at most {MAX_KEY_LENGTH} "
+                   "characters.")
+    try:
+        return idempotency_keys.get_or_create(
+            idempotency_key, receipt_key(receipt),
+            lambda: store_receipt(receipt))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+def get_receipt_ids(receipts: List[Any] = Body(...)):
+    """
+    Validates, scores and stores a batch of receipts in one request.
+
+    Each element is validated on its own, so an invalid receipt produces an
+    error entry in its slot instead of rejecting the whole batch. All valid
+    receipts are written to db.store in a single save_records call. Room is
+    reserved for the whole batch up front; once it is used up, the
+    remaining receipts get an error entry saying the store is full.
+
+    Parameters:
+    - receipts (list): The raw receipt objects to process.
+
+    Returns:
+    - list: One dictionary per input receipt, in the same order, holding
+            either the generated "id" or an "error" message.
+    """
+    results = []
+    entries = {}
+    granted = admission.reserve(len(receipts))
+    stored = 0
+    try:
+        for data in receipts:
+            try:
+                receipt = Receipt.model_validate(data)
+            except ValidationError as e:
+                results.append({"error": format_validation_error(e)})
+                continue
+            if len(entries) == granted:
+                results.append({"error": "Receipt store is full."})
+                continue
+            id = generate_receipt_id(settings.time_ordered_ids)
+            entries[id] = build_record(receipt)
+            results.append({"id": id})
+        save_records(entries)
+        stored = len(entries)
+    finally:
+        admission.settle(granted, stored)
+    return results
+
+
+def process_ndjson_lines(lines):
+    """
+    Validates, scores and stores a chunk of NDJSON lines.
+
+    Parameters:
+    - lines (list): (line number, raw bytes) pairs, without the newlines.
+      The bytes are None for a line that was too long to keep. Room is
+      reserved for every line, as for a batch.
+
+    Returns:
+    - bytes: One NDJSON result line per input line, holding the line number
+             and either the generated "id" or an "error" message.
+    """
+    too_long = ("Line is longer than the maximum of "
+                f"{settings.stream_max_line_bytes} bytes.")
+    results = []
+    entries = {}
+    granted = admission.reserve(len(lines))
+    stored = 0
+    try:
+        for number, line in lines:
+            if line is None:
+                results.append({"line": number, "error": too_long})
+                continue
+            try:
+                receipt = Receipt.model_validate_json(line)
+            except ValidationError as e:
+                results.append({"line": number,
+                                "error": format_validation_error(e)})
+                continue
+            if len(entries) == granted:
+                results.append({"line": number,
+                                "error": "Receipt store is full."})
+                continue
+            id = generate_receipt_id(settings.time_ordered_ids)
+            entries[id] = build_record(receipt)
+            results.append({"line": number, "id": id})
+        save_records(entries)
+        stored = len(entries)
+    finally:
+        admission.settle(granted, stored)
+    return b"".join(json.dumps(result).encode() + b"\n"
+                    for result in results)
+
+
+@app.post("/receipts/process/stream")
+async def get_receipt_ids_stream(request: Request):
+    """
+    Generates receipt IDs for an NDJSON stream of receipts.
+
+    The body is read chunk by chunk and every complete line in a chunk is
+    processed before the next chunk is read, so only one chunk and one
+    partial line are ever held in memory. Results are streamed back as
+    NDJSON as each chunk is processed. Blank lines are skipped, and a line
+    longer than settings.stream_max_line_bytes is reported as an error.
+    Clients must read the results while they upload; one that only reads
+    after sending the whole body stalls once the socket buffers are full.
+
+    Parameters:
+    - request (Request): The request whose body is the NDJSON stream.
+
+    Returns:
+    - DuplexStreamingResponse: The NDJSON results, one line per receipt.
+    """
+    max_line = settings.stream_max_line_bytes
+
+    async def results():
+        partial = b""
+        number = 0
+        skipping = False
+        async for chunk in request.stream():
+            *complete, rest = (partial + chunk).split(b"\n")
+            lines = []
+            for line in complete:
+                number += 1
+                if skipping or len(line) > max_line:
+                    skipping = False
+                    lines.append((number, None))
+                elif line.strip():
+                    lines.append((number, line))
+            partial = rest
+            if len(partial) > max_line:
+                partial = b""
+                skipping = True
+            if lines:
+                yield await run_in_threadpool(process_ndjson_lines, lines)
+        if partial.strip() or skipping:
+            number += 1
+            yield await run_in_threadpool(
+                process_ndjson_lines,
+                [(number, None if skipping else partial)])
+
+    return DuplexStreamingResponse(results(),
+                                   media_type="application/x-ndjson")
+
+
+def process_ws_frame(seq, frame):
+    """
+    Validates, scores and stores the receipt in one WebSocket frame.
+
+    Parameters:
+    - seq (int): The sequence number of the frame.
+    - frame (str or bytes): A JSON text frame or a MessagePack binary
+      frame holding one receipt.
+
+    Returns:
+    - dict: The sequence number and either the generated "id" or an
+            "error" message.
+    """
+    try:
+        if isinstance(frame, str):
+            receipt = Receipt.model_validate_json(frame)
+        else:
+            receipt = Receipt.model_validate(unpack_body(frame))
+        result = store_receipt(receipt)
+    except ValidationError as e:
+        return {"seq": seq, "error": format_validation_error(e)}
+    except HTTPException as e:
+        return {"seq": seq, "error": e.detail}
+    return {"seq": seq, "id": result["id"]}
+
+
+@app.websocket("/receipts/ws")
+async def receive_receipts_ws(websocket: WebSocket):
+    """
+    Acknowledges the receipt frames of a WebSocket connection.
+
+    Once connected, the server sends {"window": n}. Every frame after that
+    holds one receipt, as JSON in a text frame or as MessagePack in a
+    binary frame, and is numbered from 1 in the order it arrives. Each
+    frame is answered with {"seq": n, "id": ...} or {"seq": n,
+    "error": ...}, in a frame of the same kind, as soon as it is stored;
+    acknowledgements may come back out of order. The admission limits of
+    POST /receipts/process apply to every frame, and a rejected frame is
+    answered with the reason and a "retry_after" in seconds.
+
+    At most n frames are processed at once. While they are, no further
+    frames are read, so a client that sends more than n frames without
+    waiting for acknowledgements is slowed down by TCP flow control
+    instead of growing the server's buffers. Clients should wait for the
+    acknowledgements of the frames they sent before closing the
+    connection; a receipt whose acknowledgement could not be sent is
+    still stored.
+
+    Parameters:
+    - websocket (WebSocket): The connection.
+    """
+    window = settings.ws_window
+    client = websocket.client.host if websocket.client else ""
+    slots = asyncio.Semaphore(window)
+    tasks = set()
+
+    async def acknowledge(seq, frame):
+        try:
+            rejection = None
+            if admission.enabled:
+                rejection = await admission.admit(client)
+            if rejection is not None:
+                _, message, retry_after = rejection
+                ack = {"seq": seq, "error": message,
+                       "retry_after": retry_after}
+            else:
+                try:
+                    ack = await call_handler(process_ws_frame, seq, frame)
+                except Exception:
+                    logger.exception("Processing WebSocket frame %d failed",
+                                     seq)
+                    ack = {"seq": seq, "error": "Internal Server Error"}
+                finally:
+                    if admission.enabled:
+                        admission.release()
+            if settings.metrics_enabled:
+                WS_FRAMES.inc("error" if "error" in ack else "accepted")
+            try:
+                if isinstance(frame, str):
+                    await websocket.send_text(orjson.dumps(ack).decode())
+                else:
+                    await websocket.send_bytes(msgpack.packb(ack))
+            except Exception:
+                # The client is gone; the receipt was stored regardless.
+                pass
+        finally:
+            slots.release()
+
+    await websocket.accept()
+    await websocket.send_text(json.dumps({"window": window}))
+    seq = 0
+    try:
+        while True:
+            await slots.acquire()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            seq += 1
+            frame = message.get("text")
+            if frame is None:
+                frame = message.get("bytes") or b""
+            task = asyncio.create_task(acknowledge(seq, frame))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def etag_matches(if_none_match, etag):
     """
-    Retrieves the points and breakdown for a given receipt ID from db.uuid_dict.
+    Checks an If-None-Match header against an entity tag, using the weak
+    comparison RFC 9110 prescribes for it.
+
+    Parameters:
+    - if_none_match (str): The header value, e.g. '"a1", W/"b2"' or "*".
+    - etag (str): The quoted entity tag of the current response.
+
+    Returns:
+    - bool: True if the client's copy is current.
+    """
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+@profiler.wrap
+def get_points(id: str, fields: Optional[str] = None,
+               if_none_match: Annotated[Optional[str], Header()] = None,
+               accept: Annotated[Optional[str], Header()] = None):
+    """
+    Retrieves the points and breakdown for a given receipt ID from db.store.
+
+    The breakdown is rendered from the stored rule codes only when it is
+    requested, so ?fields=points answers without building any strings. In
+    the fast I/O mode, a request for both fields is answered with the
+    response serialized when the receipt was scored.
+
+    The response also holds the version of the rule set that scored the
+    receipt, always the active one: a receipt the rescorer has not reached
+    yet is re-scored for the response. A receipt's points only change when
+    it is re-scored by another rule set, so responses carry a strong ETag,
+    computed when the receipt was scored, and a Cache-Control header that
+    is immutable unless the rule set can change. A request whose
+    If-None-Match matches the ETag is answered with 304 and no body.
+
+    The response is MessagePack instead of JSON when the Accept header
+    prefers it. The two have different ETags, and every response carries
+    Vary: Accept so that caches keep them apart.
 
     Parameters:
     - id (str): The receipt ID for which to retrieve the points.
+    - fields (str): A comma-separated subset of "points" and "breakdown".
+      Both are returned when omitted.
+    - if_none_match (str): The If-None-Match request header.
+    - accept (str): The Accept request header.
 
     Returns:
-    - dict: A dictionary containing the points and breakdown information
-            for the receipt ID.
+    - Response: The points and breakdown information for the receipt ID
+      and the rule set version, a 304 response, or a 202 response with
+      status "pending" while the receipt waits to be scored.
+
+    Raises:
+    - HTTPException: 400 for unknown fields, 404 if the receipt ID is not
+      found, or 500 if the scoring pipeline failed to score the receipt.
     """
-    if id not in db.uuid_dict:
+    if fields is None:
+        selected = POINTS_FIELDS
+    else:
+        selected = [field.strip() for field in fields.split(",")]
+        unknown = set(selected).difference(POINTS_FIELDS)
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown fields: {', '.join(sorted(unknown))}.")
+    packed = accepts_msgpack(accept)
+    if pipeline is not None and pipeline.is_pending(id):
+        pending_class = MsgPackResponse if packed else JSONResponse
+        return pending_class(status_code=202, content={"status": "pending"},
+                             headers={"Retry-After": "1", "Vary": "Accept"})
+    record = load_record(id)
+    if record is None:
+        if pipeline is not None and pipeline.has_failed(id):
+            raise HTTPException(status_code=500,
+                                detail="The receipt could not be scored.")
         raise HTTPException(status_code=404, detail="Receipt ID not found.")
-    points = db.uuid_dict[id][1][0]
-    breakdown = db.uuid_dict[id][1][1]
-    return {"points": points, "breakdown": breakdown}
+    if record.version != get_rule_set().version:
+        # Scored by another rule set, in this run or an earlier one; the
+        # rescorer has not reached it yet, so it is scored here and the
+        # rescorer stores the result when it does.
+        record = rescore_record(record)
+    etag = record.etag
+    if etag is None:
+        etag = compute_etag(record)
+    variant = "".join(field[0] for field in POINTS_FIELDS
+                      if field in selected)
+    if packed:
+        variant += "m"
+    headers = {"ETag": f'"{etag:016x}-{variant}"',
+               "Cache-Control": CACHE_CONTROL, "Vary": "Accept"}
+    if if_none_match is not None and etag_matches(if_none_match,
+                                                  headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    if (record.body is not None and selected is POINTS_FIELDS
+            and not packed):
+        return Response(record.body, media_type="application/json",
+                        headers=headers)
+    response = {}
+    if "points" in selected:
+        response["points"] = record.points
+    if "breakdown" in selected:
+        response["breakdown"] = render_breakdown(record)
+    response["version"] = record.version
+    if packed:
+        return MsgPackResponse(response, headers=headers)
+    return response_class(response, headers=headers)
+
+
+@app.get("/receipts")
+def list_receipts(since: Optional[datetime] = None,
+                  until: Optional[datetime] = None,
+                  cursor: Optional[str] = None,
+                  limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE)):
+    """
+    Lists the receipts created in a time window, in ID order, a page at a
+    time.
+
+    Only receipts with time-ordered IDs (RECEIPT_TIME_ORDERED_IDS) are
+    listed. Their IDs sort by creation time, so the window is a range of
+    the store's ordered ID index and nothing outside it is read. A receipt
+    still being written when a page covering its time is read, e.g. one
+    queued for background scoring, may be missed by that page.
+
+    Parameters:
+    - since (datetime): Only receipts created at or after this time are
+      listed. Naive times are UTC.
+    - until (datetime): Only receipts created before this time are listed.
+    - cursor (str): The next_cursor of the previous page.
+    - limit (int): The most receipts returned in the page.
+
+    Returns:
+    - dict: The page of receipts, each with its ID, creation time and
+      points, and the cursor of the next page, or None after the last one.
+
+    Raises:
+    - HTTPException: 400 if the cursor is not a time-ordered receipt ID.
+    """
+    after = "" if since is None else receipt_id_bound(since)
+    # "~" sorts after every hexadecimal digit and "-".
+    before = "~" if until is None else receipt_id_bound(until)
+    if cursor is not None:
+        if receipt_id_time(cursor) is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
+        after = max(after, cursor)
+    start = time.perf_counter()
+    entries = db.store.scan(after, before, limit + 1)
+    if settings.metrics_enabled:
+        STORE_SECONDS.observe(time.perf_counter() - start, "scan")
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = entries[-1][0]
+    receipts = [{"id": id,
+                 "created": receipt_id_time(id).isoformat(
+                     timespec="milliseconds"),
+                 "points": record.points}
+                for id, record in entries]
+    return {"receipts": receipts, "next_cursor": next_cursor}
+
+
+def parse_body(body, model=None, content_type=None):
+    """
+    Parses a raw request body with orjson, or with msgpack if its content
+    type is MessagePack, validating it against a model if one is given.
+
+    Errors are raised as RequestValidationError with the types and
+    locations FastAPI uses, so they are answered with the same 422
+    responses. As with FastAPI, an empty or null body is missing.
+
+    Parameters:
+    - body (bytes): The request body.
+    - model (type): The Pydantic model to validate against, if any.
+    - content_type (str): The Content-Type request header.
+
+    Returns:
+    - object: The model instance, or the parsed value.
+
+    Raises:
+    - HTTPException: 400 if a MessagePack body cannot be decoded.
+    """
+    try:
+        if not body:
+            data = None
+        elif is_msgpack(content_type):
+            data = unpack_body(body)
+        else:
+            data = orjson.loads(body)
+        if data is None:
+            raise RequestValidationError([{
+                "type": "missing", "loc": ("body",),
+                "msg": "Field required", "input": None}])
+        if model is not None:
+            return model.model_validate(data)
+        return data
+    except orjson.JSONDecodeError as e:
+        raise RequestValidationError([{
+            "type": "json_invalid", "loc": ("body", e.pos),
+            "msg": "JSON decode error", "input": {},
+            "ctx": {"error": e.msg}}])
+    except ValidationError as e:
+        raise RequestValidationError([
+            {**error, "loc": ("body", *error["loc"])}
+            for error in e.errors()])
+
+
+async def call_handler(handler, *args):
+    """
+    Calls a synchronous handler from an async one: inline when the store
+    is in memory and never blocks, otherwise on the threadpool.
+    """
+    if settings.store_url == "memory":
+        return handler(*args)
+    return await run_in_threadpool(handler, *args)
+
+
+def inline_schema(model):
+    """
+    Returns the JSON schema of a model with its $defs references inlined,
+    for describing a body the handler reads itself.
+    """
+    schema = model.model_json_schema()
+    defs = schema.pop("$defs", {})
+
+    def resolve(node):
+        if isinstance(node, dict):
+            ref = node.get("$ref", "")
+            if ref.startswith("#/$defs/"):
+                return resolve(defs[ref[len("#/$defs/"):]])
+            return {key: resolve(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [resolve(value) for value in node]
+        return node
+
+    return resolve(schema)
+
+
+async def get_receipt_id_fast(
+        request: Request,
+        idempotency_key: Annotated[Optional[str], Header()] = None):
+    """
+    Parses the receipt with orjson, or msgpack, and calls get_receipt_id.
+
+    Parameters:
+    - request (Request): The request whose body is the receipt.
+    - idempotency_key (str): The Idempotency-Key request header.
+
+    Returns:
+    - Response: The receipt ID, in MessagePack if the Accept header
+      prefers it and in JSON otherwise.
+    """
+    headers = request.headers
+    receipt = parse_body(await request.body(), Receipt,
+                         headers.get("content-type"))
+    result = await call_handler(get_receipt_id, receipt, idempotency_key)
+    if accepts_msgpack(headers.get("accept")):
+        return MsgPackResponse(result)
+    return ORJSONResponse(result)
+
+
+async def get_receipt_ids_fast(request: Request):
+    """
+    Parses the batch with orjson and calls get_receipt_ids.
+
+    Parameters:
+    - request (Request): The request whose body is the array of receipts.
+
+    Returns:
+    - ORJSONResponse: One result per input receipt.
+    """
+    receipts = parse_body(await request.body())
+    if not isinstance(receipts, list):
+        raise RequestValidationError([{
+            "type": "list_type", "loc": ("body",),
+            "msg": "Input should be a valid list", "input": receipts}])
+    return ORJSONResponse(await call_handler(get_receipt_ids, receipts))
+
+
+async def get_points_fast(
+        id: str, fields: Optional[str] = None,
+        if_none_match: Annotated[Optional[str], Header()] = None,
+        accept: Annotated[Optional[str], Header()] = None):
+    """
+    Calls get_points without a threadpool hop for the in-memory store.
+
+    Parameters:
+    - id (str): The receipt ID for which to retrieve the points.
+    - fields (str): A comma-separated subset of "points" and "breakdown".
+    - if_none_match (str): The If-None-Match request header.
+    - accept (str): The Accept request header.
+
+    Returns:
+    - Response: The points and/or breakdown.
+    """
+    return await call_handler(get_points, id, fields, if_none_match, accept)
+
+
+# Documents the MessagePack representations next to the JSON ones.
+msgpack_response = {"responses": {"200": {"content": {
+    MSGPACK_MEDIA_TYPE: {"schema": {}}}}}}
+if settings.fast_io:
+    receipt_schema = inline_schema(Receipt)
+    receipt_body = {"requestBody": {"required": True, "content": {
+        "application/json": {"schema": receipt_schema},
+        MSGPACK_MEDIA_TYPE: {"schema": receipt_schema}}},
+        **msgpack_response}
+    batch_body = {"requestBody": {"required": True, "content": {
+        "application/json": {"schema": {
+            "type": "array", "items": receipt_schema}}}}}
+    app.post("/receipts/process",
+             openapi_extra=receipt_body)(get_receipt_id_fast)
+    app.post("/receipts/process/batch",
+             openapi_extra=batch_body)(get_receipt_ids_fast)
+    app.get("/receipts/{id}/points",
+            openapi_extra=msgpack_response)(get_points_fast)
+else:
+    receipt_body = {"requestBody": {"content": {MSGPACK_MEDIA_TYPE: {
+        "schema": {"$ref": "#/components/schemas/Receipt"}}}},
+        **msgpack_response}
+    app.router.add_api_route("/receipts/process", get_receipt_id,
+                             methods=["POST"], openapi_extra=receipt_body,
+                             route_class_override=MsgPackRoute)
+    app.post("/receipts/process/batch")(get_receipt_ids)
+    app.get("/receipts/{id}/points",
+            openapi_extra=msgpack_response)(get_points)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Renders the metrics in the Prometheus text exposition format.
+
+    Besides the collected metrics, this reports the number of stored
+    receipts, the size of the db.uuid_dict hash table, the resident memory
+    of the process, the score cache counters, the idempotency key counters,
+    the active rule set version, the progress of re-scoring, the last
+    snapshot and the receipts kept in memory and evicted.
+
+    Returns:
+    - PlainTextResponse: The metrics text.
+    """
+    cache = score_cache.stats()
+    gauges = [
+        ("receipt_store_entries", "Number of stored receipts.",
+         len(db.store)),
+        ("receipt_store_dict_bytes",
+         "Size of the db.uuid_dict hash table, excluding the records.",
+         sys.getsizeof(db.uuid_dict)),
+        ("process_resident_memory_bytes", "Resident memory of the process.",
+         process_memory_bytes()),
+        ("receipt_score_cache_entries", "Number of cached scores.",
+         cache["size"]),
+    ]
+    counters = [
+        ("receipt_score_cache_hits_total", "Score cache hits.",
+         cache["hits"]),
+        ("receipt_score_cache_misses_total", "Score cache misses.",
+         cache["misses"]),
+        ("receipt_score_cache_evictions_total", "Score cache evictions.",
+         cache["evictions"]),
+    ]
+    gauges.append(("receipt_rules_version",
+                   "Version of the active rule set.",
+                   get_rule_set().version))
+    rescoring = rescorer.status()
+    if rescoring is not None:
+        # These restart from 0 with every job, which Prometheus treats
+        # as a counter reset.
+        counters += [
+            ("receipt_rescore_scanned_total",
+             "Records scanned by the current re-scoring job.",
+             rescoring["scanned"]),
+            ("receipt_rescore_rescored_total",
+             "Records re-scored by the current re-scoring job.",
+             rescoring["rescored"]),
+        ]
+    if idempotency_keys.maxsize:
+        keys = idempotency_keys.stats()
+        gauges.append(("receipt_idempotency_keys",
+                       "Number of idempotency keys kept.", keys["size"]))
+        counters += [
+            ("receipt_idempotency_replays_total",
+             "Requests answered with the response to an earlier request "
+             "with the same Idempotency-Key.", keys["replays"]),
+            ("receipt_idempotency_evictions_total",
+             "Idempotency key evictions.", keys["evictions"]),
+        ]
+    if admission.enabled:
+        gauges.append(("receipt_admission_in_flight",
+                       "Ingestion requests being handled.",
+                       admission.in_flight))
+    if retention is not None:
+        gauges.append(("receipt_store_memory_entries",
+                       "Number of receipts kept in memory.",
+                       len(db.uuid_dict)))
+        counters.append(("receipt_store_evicted_total",
+                         "Receipts evicted from memory by the retention "
+                         "policy.", db.store.evicted))
+    if snapshotter is not None and snapshotter.last is not None:
+        gauges += [
+            ("receipt_snapshot_entries",
+             "Receipts in the last snapshot written.",
+             snapshotter.last["entries"]),
+            ("receipt_snapshot_write_seconds",
+             "Time taken to write the last snapshot.",
+             snapshotter.last["seconds"]),
+            ("receipt_snapshot_age_seconds",
+             "Time since the last snapshot was written.",
+             time.time() - snapshotter.last["finished"]),
+        ]
+    if pipeline is not None:
+        gauges += [
+            ("receipt_pipeline_queue_depth",
+             "Number of receipts waiting in the scoring queue.",
+             pipeline.depth()),
+            ("receipt_pipeline_pending",
+             "Number of receipts queued or being scored.",
+             pipeline.pending()),
+        ]
+    return PlainTextResponse(render(gauges, counters),
+                             media_type="text/plain; version=0.0.4")
+
+
+def describe_rules():
+    """
+    Describes the active rule set and the re-scoring job.
+
+    Returns:
+    - dict: The version and rules of the active rule set, and the status
+      of the re-scoring job.
+    """
+    rule_set = get_rule_set()
+    return {"version": rule_set.version,
+            "rules": rule_set.config.model_dump(mode="json")["rules"],
+            "rescoring": rescorer.status()}
+
+
+def swap_rules(rule_set):
+    """
+    Activates a rule set and starts re-scoring the store with it.
+
+    Parameters:
+    - rule_set (RuleSet): The rule set.
+
+    Returns:
+    - dict: See describe_rules.
+
+    Raises:
+    - HTTPException: 409 if a different rule set with the same version is
+      loaded.
+    """
+    if rule_set.version != get_rule_set().version:
+        try:
+            activate(rule_set)
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        score_cache.clear()
+        rescorer.start(rule_set.version)
+    elif rule_set.config != get_rule_set().config:
+        raise HTTPException(
+            status_code=409,
+            detail=f"A different rule set with version {rule_set.version} "
+                   "is already loaded.")
+    return describe_rules()
+
+
+if settings.rules_admin_enabled:
+    @app.get("/admin/rules")
+    def get_rules():
+        """
+        Describes the active rule set and the re-scoring job.
+
+        Returns:
+        - dict: See describe_rules.
+        """
+        return describe_rules()
+
+    @app.put("/admin/rules")
+    def put_rules(config: RuleSetConfig):
+        """
+        Activates a rule set and starts re-scoring the store with it.
+
+        Parameters:
+        - config (RuleSetConfig): The rule set.
+
+        Returns:
+        - dict: See describe_rules.
+        """
+        return swap_rules(RuleSet(config))
+
+    @app.post("/admin/rules/reload")
+    def reload_rules():
+        """
+        Loads the rule set file (RECEIPT_RULES_PATH) again and, if its
+        version changed, activates it and starts re-scoring the store.
+
+        Returns:
+        - dict: See describe_rules.
+
+        Raises:
+        - HTTPException: 400 if no file is configured or it cannot be read,
+          422 if it is not a valid rule set.
+        """
+        if not settings.rules_path:
+            raise HTTPException(status_code=400,
+                                detail="No rule set file is configured.")
+        try:
+            rule_set = load_rule_set(settings.rules_path)
+        except OSError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except ValidationError as e:
+            raise HTTPException(status_code=422,
+                                detail=format_validation_error(e))
+        return swap_rules(rule_set)
+
+    @app.post("/admin/rules/rescore/{action}")
+    def control_rescoring(action: Literal["pause", "resume"]):
+        """
+        Pauses the re-scoring job or resumes it where it stopped.
+
+        Parameters:
+        - action (str): "pause" or "resume".
+
+        Returns:
+        - dict: See describe_rules.
+        """
+        if action == "pause":
+            rescorer.pause()
+        else:
+            rescorer.resume()
+        return describe_rules()
+
+
+if settings.profiling_enabled:
+    @app.post("/admin/profile")
+    def start_profile(seconds: float = 10.0, rate: float = 1.0,
+                      mode: str = "sample"):
+        """
+        Starts a profiling session over get_receipt_id and get_points.
+
+        Parameters:
+        - seconds (float): How long the session runs.
+        - rate (float): The fraction of requests profiled, in (0, 1].
+        - mode (str): "sample" for collapsed stacks or "cprofile" for a
+          .prof file.
+
+        Returns:
+        - dict: The name of the profile written when the session ends.
+
+        Raises:
+        - HTTPException: 400 for invalid parameters, 409 if a session is
+          already running.
+        """
+        try:
+            path = profiler.start(seconds, rate, mode)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        return {"profile": os.path.basename(path), "seconds": seconds}
+
+    @app.get("/admin/profile")
+    def get_profile_status():
+        """
+        Describes the running profiling session and the written profiles.
+
+        Returns:
+        - dict: The session, or None, and the profile names.
+        """
+        return profiler.status()
+
+    @app.get("/admin/profile/{name}")
+    def get_profile(name: str):
+        """
+        Returns a written profile file.
+
+        Parameters:
+        - name (str): The profile name, as listed by GET /admin/profile.
+
+        Returns:
+        - FileResponse: The profile.
+
+        Raises:
+        - HTTPException: 404 if there is no such profile.
+        """
+        if name not in profiler.status()["profiles"]:
+            raise HTTPException(status_code=404, detail="Profile not found")
+        return FileResponse(os.path.join(profiler.directory, name))
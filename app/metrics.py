@@ -0,0 +1,297 @@
+"""
+This module collects runtime metrics and renders them in the Prometheus
+text exposition format.
+
+Metrics are kept in plain Python objects guarded by a lock and cost a few
+hundred nanoseconds per update, so they can stay on in production. They
+can be turned off with RECEIPT_METRICS_ENABLED=0.
+
+Classes:
+- Counter: A monotonically increasing value per label set.
+- Histogram: Observations counted into fixed buckets per label set.
+- RuleMetrics: The time spent in, and the number of hits of, each scoring
+  rule.
+- MetricsMiddleware: ASGI middleware counting requests and timing them per
+  route.
+
+Functions:
+- render(extra, counters): Renders every metric, plus extra gauges and
+  counters, as text.
+- process_memory_bytes(): Returns the resident memory of the process.
+
+Global Variables:
+- REQUESTS, REQUEST_SECONDS, SCORE_SECONDS, STORE_SECONDS,
+  PIPELINE_WAIT_SECONDS, ADMISSION_REJECTED, WS_FRAMES: The request,
+  scoring, store, scoring queue, admission control and WebSocket metrics.
+- rule_metrics: The per-rule metrics updated by score_record.
+
+"""
+
+import bisect
+import os
+import threading
+import time
+
+from db.records import RULE_BITS
+
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names, values):
+    """
+    Formats a label set, e.g. {route="/receipts/process",method="POST"}.
+    """
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in
+                     zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """
+    Represents a monotonically increasing value per label set.
+
+    Attributes:
+    - name (str): The metric name.
+    - help (str): The metric description.
+    - labelnames (tuple): The label names.
+    """
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        """
+        Adds amount to the value of a label set.
+        """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(
+                f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Represents observations counted into fixed buckets per label set.
+
+    Attributes:
+    - name (str): The metric name.
+    - help (str): The metric description.
+    - labelnames (tuple): The label names.
+    - buckets (tuple): The upper bounds of the buckets, in seconds.
+    """
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        """
+        Records one observation for a label set.
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [
+                    [0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket
+                lines.append(f"{self.name}_bucket"
+                             f"{_labels(names, labels + (bound,))} "
+                             f"{cumulative}")
+            label_text = _labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class RuleMetrics:
+    """
+    Represents the time spent in, and the number of hits of, each scoring
+    rule, by its number in the active rule set. The seven rules of the
+    built-in set are always reported, others once they are evaluated.
+
+    Attributes:
+    - enabled (bool): Whether score_record should time its rules.
+    """
+
+    RULES = tuple(range(1, 8))
+
+    def __init__(self):
+        self.enabled = True
+        self._seconds = [0.0] * (1 << RULE_BITS)
+        self._evaluations = [0] * (1 << RULE_BITS)
+        self._fired = [0] * (1 << RULE_BITS)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, marks, rules):
+        """
+        Records one scored receipt.
+
+        Parameters:
+        - marks (list): perf_counter_ns() readings taken before rule 1 and
+          after each rule that was evaluated.
+        - rules (list): The codes of the rules that fired; the rule number
+          is in the low RULE_BITS bits.
+        """
+        mask = (1 << RULE_BITS) - 1
+        with self._lock:
+            for rule in range(1, len(marks)):
+                self._seconds[rule] += (marks[rule] - marks[rule - 1]) / 1e9
+                self._evaluations[rule] += 1
+            for code in rules:
+                self._fired[code & mask] += 1
+
+    def render(self):
+        lines = []
+        for name, kind, help, values in (
+                ("receipt_rule_seconds_total", "counter",
+                 "Time spent evaluating each scoring rule.", self._seconds),
+                ("receipt_rule_evaluations_total", "counter",
+                 "Number of times each scoring rule was evaluated.",
+                 self._evaluations),
+                ("receipt_rule_fired_total", "counter",
+                 "Number of times each scoring rule awarded points.",
+                 self._fired)):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for rule in range(1, len(values)):
+                if rule not in self.RULES and not self._evaluations[rule]:
+                    continue
+                lines.append(f'{name}{{rule="{rule}"}} {values[rule]}')
+        return lines
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests and timing them per route.
+
+    Requests are labelled with the path template of the matched route
+    (e.g. /receipts/{id}/points), so receipt IDs do not create new series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._paths = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = self._route(scope)
+            REQUESTS.inc(scope["method"], route, str(status[0]))
+            REQUEST_SECONDS.observe(elapsed, scope["method"], route)
+
+    def _route(self, scope):
+        if self._paths is None:
+            self._paths = {getattr(route, "endpoint", None): route.path
+                           for route in scope["app"].routes}
+        return self._paths.get(scope.get("endpoint"), "unmatched")
+
+
+def process_memory_bytes():
+    """
+    Returns the resident memory of the process, in bytes, or 0 if it
+    cannot be read (it is read from /proc on Linux).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def render(extra=(), counters=()):
+    """
+    Renders every metric in the Prometheus text exposition format.
+
+    Parameters:
+    - extra (iterable): (name, help, value) gauges computed at scrape
+      time, e.g. the store size.
+    - counters (iterable): (name, help, value) counters read at scrape
+      time, e.g. the score cache hits. Their names end in _total.
+
+    Returns:
+    - str: The metrics text.
+    """
+    lines = []
+    for kind, metrics in (("gauge", extra), ("counter", counters)):
+        for name, help, value in metrics:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}",
+                      f"{name} {value}"]
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = []
+
+REQUESTS = Counter("http_requests_total", "Number of HTTP requests.",
+                   ("method", "route", "status"))
+REQUEST_SECONDS = Histogram("http_request_duration_seconds",
+                            "HTTP request latency, including parsing.",
+                            ("method", "route"))
+SCORE_SECONDS = Histogram("receipt_score_duration_seconds",
+                          "Time spent scoring a receipt.")
+STORE_SECONDS = Histogram("receipt_store_duration_seconds",
+                          "Time spent in receipt store calls.",
+                          ("operation",))
+PIPELINE_WAIT_SECONDS = Histogram("receipt_pipeline_wait_seconds",
+                                  "Time receipts wait in the scoring queue.")
+ADMISSION_REJECTED = Counter("receipt_admission_rejected_total",
+                             "Ingestion requests rejected by admission "
+                             "control.", ("reason",))
+WS_FRAMES = Counter("receipt_ws_frames_total",
+                    "Receipt frames received on /receipts/ws, by whether "
+                    "they were accepted.", ("result",))
+rule_metrics = RuleMetrics()
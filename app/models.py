@@ -1,28 +1,102 @@
 """
 This module defines the Item and Receipt models using Pydantic.
 
+Receipts are parsed once, when they are validated: money strings become
+integer cents and the purchase date and time strings become date and time
+objects, so the scorer never parses a string again. Only strings are
+accepted for these fields, never JSON numbers.
+
 Dependencies:
 - typing: Provides type hints.
+- datetime: Provides the date and time types.
 - pydantic: A library for data validation and serialization.
 
+Types:
+- Cents: A money string such as "6.49", validated against the pattern
+  \\d+\\.\\d{2} and parsed into an int number of cents (649). It is
+  serialized back to the same string.
+- IsoDate: A date string "YYYY-MM-DD", parsed into a date.
+- IsoTime: A time string "HH:MM", optionally with seconds, parsed into a
+  time. It is serialized as "HH:MM:SS".
+
 Models:
 - Item (BaseModel): Represents an item in a receipt.
   - shortDescription (str): The short description of the item.
-  - price (str): The price of the item.
+  - price (Cents): The price of the item in cents.
 
 - Receipt (BaseModel): Represents a receipt.
   - retailer (str): The retailer name.
-  - purchaseDate (str): The purchase date.
-  - purchaseTime (str): The purchase time.
-  - total (str): The total amount of the receipt.
+  - purchaseDate (IsoDate): The purchase date, "YYYY-MM-DD".
+  - purchaseTime (IsoTime): The purchase time, "HH:MM".
+  - total (Cents): The total amount of the receipt in cents.
   - items (List[Item]): A list of Item objects representing the items
     in the receipt.
 
 """
 
 
-from typing import List
-from pydantic import BaseModel
+from datetime import date, time
+from typing import Annotated, List
+from pydantic import AfterValidator, BaseModel, PlainSerializer, constr
+
+
+def parse_cents(value):
+    """
+    Converts a money string already matched against MONEY_PATTERN, e.g.
+    "6.49", to cents (649).
+    """
+    return int(value.replace(".", "", 1))
+
+
+def parse_date(value):
+    """
+    Converts a date string already matched against DATE_PATTERN, e.g.
+    "2022-01-01", to a date.
+
+    Raises:
+    - ValueError: If the date does not exist, e.g. "2023-02-30".
+    """
+    return date.fromisoformat(value)
+
+
+def parse_time(value):
+    """
+    Converts a time string already matched against TIME_PATTERN, e.g.
+    "13:01", to a time.
+
+    Raises:
+    - ValueError: If the time does not exist, e.g. "24:00".
+    """
+    return time.fromisoformat(value)
+
+
+def format_iso(value):
+    """
+    Converts a date or time back to a string, e.g. "2022-01-01" or
+    "13:01:00".
+    """
+    return value.isoformat()
+
+
+def format_cents(cents):
+    """
+    Converts cents back to a money string, e.g. 649 to "6.49".
+    """
+    return f"{cents // 100}.{cents % 100:02d}"
+
+
+MONEY_PATTERN = r"^\d+\.\d{2}$"
+
+Cents = Annotated[constr(pattern=MONEY_PATTERN), AfterValidator(parse_cents),
+                  PlainSerializer(format_cents, return_type=str)]
+
+DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+TIME_PATTERN = r"^\d{2}:\d{2}(:\d{2}(\.\d{1,6})?)?$"
+
+IsoDate = Annotated[constr(pattern=DATE_PATTERN), AfterValidator(parse_date),
+                    PlainSerializer(format_iso, return_type=str)]
+IsoTime = Annotated[constr(pattern=TIME_PATTERN), AfterValidator(parse_time),
+                    PlainSerializer(format_iso, return_type=str)]
 
 
 class Item(BaseModel):
@@ -31,10 +105,10 @@ class Item(BaseModel):
 
     Attributes:
     - shortDescription (str): The short description of the item.
-    - price (str): The price of the item.
+    - price (int): The price of the item in cents.
     """
     shortDescription: str
-    price: str
+    price: Cents
 
 
 class Receipt(BaseModel):
@@ -43,14 +117,14 @@ class Receipt(BaseModel):
 
     Attributes:
     - retailer (str): The retailer name.
-    - purchaseDate (str): The purchase date.
-    - purchaseTime (str): The purchase time.
-    - total (str): The total amount of the receipt.
+    - purchaseDate (date): The purchase date.
+    - purchaseTime (time): The purchase time.
+    - total (int): The total amount of the receipt in cents.
     - items (List[Item]): A list of Item objects representing the items
       in the receipt.
     """
     retailer: str
-    purchaseDate: str
-    purchaseTime: str
-    total: str
+    purchaseDate: IsoDate
+    purchaseTime: IsoTime
+    total: Cents
     items: List[Item]
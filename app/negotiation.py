@@ -0,0 +1,182 @@
+"""
+This module lets clients exchange MessagePack instead of JSON with the API.
+
+A request whose Content-Type is a MessagePack media type has its body
+decoded with msgpack straight into the value the endpoint validates, and
+a request whose Accept header prefers MessagePack to JSON gets a
+MessagePack response. JSON stays the default in both directions, and
+errors are always answered in JSON.
+
+Dependencies:
+- msgpack: Encodes and decodes MessagePack.
+- fastapi: The route class the negotiation hooks into.
+
+Classes:
+- MsgPackResponse (Response): A response rendered as MessagePack.
+- MsgPackRequest (Request): A request whose MessagePack body FastAPI
+  decodes as if it were JSON.
+- MsgPackRoute (APIRoute): A route that negotiates MessagePack for
+  endpoints returning plain values.
+
+Functions:
+- is_msgpack(content_type): Checks whether a Content-Type header is a
+  MessagePack media type.
+- accepts_msgpack(accept): Checks whether an Accept header prefers
+  MessagePack to JSON.
+- unpack_body(body): Decodes a MessagePack request body.
+
+Global Variables:
+- MSGPACK_MEDIA_TYPE: The media type of MessagePack responses.
+
+"""
+
+import msgpack
+
+from fastapi import HTTPException, Request
+from fastapi.routing import APIRoute
+from starlette.responses import Response
+
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+# The registered type, and the ones clients used before it was.
+MSGPACK_MEDIA_TYPES = frozenset((MSGPACK_MEDIA_TYPE, "application/x-msgpack",
+                                 "application/vnd.msgpack"))
+JSON_WILDCARDS = frozenset(("*/*", "application/*"))
+
+
+def is_msgpack(content_type):
+    """
+    Checks whether a Content-Type header is a MessagePack media type.
+
+    Parameters:
+    - content_type (str): The header value, or None.
+
+    Returns:
+    - bool: True for a MessagePack body.
+    """
+    if content_type is None or "msgpack" not in content_type:
+        return False
+    media_type = content_type.partition(";")[0].strip().lower()
+    return media_type in MSGPACK_MEDIA_TYPES
+
+
+def accepts_msgpack(accept):
+    """
+    Checks whether an Accept header prefers MessagePack to JSON.
+
+    MessagePack is chosen when the client ranks a MessagePack media type
+    above application/json, or, if it does not name application/json, at
+    least as high as the wildcards that also cover JSON. Anything else,
+    including no Accept header, gets JSON.
+
+    Parameters:
+    - accept (str): The header value, or None.
+
+    Returns:
+    - bool: True if the response should be MessagePack.
+    """
+    if accept is None or "msgpack" not in accept:
+        return False
+    msgpack_q = json_q = wildcard_q = 0.0
+    for media_range in accept.split(","):
+        media_type, _, params = media_range.partition(";")
+        media_type = media_type.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media_type in MSGPACK_MEDIA_TYPES:
+            msgpack_q = max(msgpack_q, q)
+        elif media_type == "application/json":
+            json_q = max(json_q, q)
+        elif media_type in JSON_WILDCARDS:
+            wildcard_q = max(wildcard_q, q)
+    if msgpack_q <= 0:
+        return False
+    if json_q:
+        return msgpack_q > json_q
+    return msgpack_q >= wildcard_q
+
+
+def unpack_body(body):
+    """
+    Decodes a MessagePack request body.
+
+    Parameters:
+    - body (bytes): The body.
+
+    Returns:
+    - object: The decoded value.
+
+    Raises:
+    - HTTPException: 400 if the body is not a single valid MessagePack
+      value, as FastAPI answers bodies it cannot parse.
+    """
+    try:
+        return msgpack.unpackb(body)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail="There was an error parsing the body") from e
+
+
+class MsgPackResponse(Response):
+    """
+    Represents a response rendered as MessagePack.
+    """
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content):
+        return msgpack.packb(content)
+
+
+class MsgPackRequest(Request):
+    """
+    Represents a request whose MessagePack body FastAPI decodes as if it
+    were JSON.
+
+    FastAPI only decodes bodies without a Content-Type or with a JSON one,
+    through Request.json. This request is built without its Content-Type
+    header and decodes its body with msgpack in json, so the decoded value
+    is validated against the endpoint's body model directly.
+    """
+
+    async def json(self):
+        if not hasattr(self, "_json"):
+            self._json = unpack_body(await self.body())
+        return self._json
+
+
+class MsgPackRoute(APIRoute):
+    """
+    Represents a route that accepts MessagePack request bodies and answers
+    in MessagePack when the Accept header prefers it.
+
+    Only values returned by the endpoint are encoded this way; responses
+    the endpoint builds itself are sent as they are.
+    """
+
+    def get_route_handler(self):
+        json_handler = super().get_route_handler()
+        response_class = self.response_class
+        self.response_class = MsgPackResponse
+        try:
+            msgpack_handler = super().get_route_handler()
+        finally:
+            self.response_class = response_class
+
+        async def handler(request):
+            if is_msgpack(request.headers.get("content-type")):
+                scope = dict(request.scope, headers=[
+                    (name, value) for name, value in request.scope["headers"]
+                    if name != b"content-type"])
+                request = MsgPackRequest(scope, request.receive)
+            if accepts_msgpack(request.headers.get("accept")):
+                return await msgpack_handler(request)
+            return await json_handler(request)
+
+        return handler
@@ -0,0 +1,337 @@
+"""
+This module scores archived receipts offline, with the same logic as the
+API but without a server, spreading the work across a pool of processes.
+
+Dependencies:
+- concurrent.futures: Provides the process pool.
+- models: Contains the Receipt model used to validate the input.
+- utils: Provides the scoring functions.
+
+Functions:
+- to_record(receipt): Validates a receipt and converts it to a
+  ReceiptRecord.
+- score_one(receipt, breakdown): Scores a single receipt.
+- score_receipts(receipts, processes, chunksize, breakdown, vectorized):
+  Scores an iterable of receipts on a process pool, yielding results in
+  input order.
+- read_receipts(file, input_format): Yields the raw receipts in a JSON or
+  JSON Lines file.
+- write_results(results, file, output_format): Writes results as JSON Lines
+  or CSV.
+- main(argv): Command line entry point.
+
+Usage:
+    python -m app.offline INPUT [-o OUTPUT] [--format jsonl|csv]
+                          [-j PROCESSES] [--chunk-size N] [--breakdown]
+                          [--vectorized]
+
+INPUT is a JSON Lines file with one receipt per line, a JSON file holding
+one receipt or an array of receipts, or "-" for JSON Lines on stdin. An
+array is parsed one receipt at a time, so it is never loaded whole.
+
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pydantic import ValidationError
+
+from db.records import ReceiptRecord
+from .models import Receipt
+from .utils import render_breakdown, score_record
+from .validation import format_validation_error
+from .vectorized import score_batch
+
+
+CSV_FIELDS = ["index", "points", "error", "breakdown"]
+
+
+def to_record(receipt):
+    """
+    Validates a receipt and converts it to an unscored ReceiptRecord.
+
+    Parameters:
+    - receipt (Receipt, dict, str or bytes): The receipt, as a model, a
+      dictionary or raw JSON.
+
+    Returns:
+    - ReceiptRecord or str: The record, or the validation error message.
+    """
+    try:
+        if isinstance(receipt, (str, bytes)):
+            receipt = Receipt.model_validate_json(receipt)
+        elif not isinstance(receipt, Receipt):
+            receipt = Receipt.model_validate(receipt)
+    except ValidationError as e:
+        return format_validation_error(e)
+    return ReceiptRecord.from_receipt(receipt)
+
+
+def score_one(receipt, breakdown=False):
+    """
+    Scores a single receipt.
+
+    Parameters:
+    - receipt (Receipt, dict, str or bytes): The receipt, as a model, a
+      dictionary or raw JSON.
+    - breakdown (bool): Whether to include the breakdown.
+
+    Returns:
+    - dict: The "points" (and "breakdown") of the receipt, or an "error"
+      if it is not a valid receipt.
+    """
+    record = to_record(receipt)
+    if isinstance(record, str):
+        return {"error": record}
+    score_record(record)
+    result = {"points": record.points}
+    if breakdown:
+        result["breakdown"] = render_breakdown(record)
+    return result
+
+
+def _score_chunk(chunk, breakdown, vectorized):
+    """
+    Scores a chunk of (index, receipt) pairs in a worker process.
+    """
+    if not vectorized:
+        return [{"index": index, **score_one(receipt, breakdown)}
+                for index, receipt in chunk]
+    results = [{"index": index} for index, _ in chunk]
+    records = []
+    for result, (_, receipt) in zip(results, chunk):
+        record = to_record(receipt)
+        if isinstance(record, str):
+            result["error"] = record
+        else:
+            records.append((result, record))
+    if records:
+        points = score_batch([record for _, record in records])
+        for (result, _), value in zip(records, points.tolist()):
+            result["points"] = value
+    return results
+
+
+def score_receipts(receipts, processes=None, chunksize=500,
+                   breakdown=False, vectorized=False):
+    """
+    Scores an iterable of receipts on a process pool.
+
+    The input is consumed lazily in chunks and only a few chunks per
+    process are in flight at once, so memory use does not grow with the
+    size of the input.
+
+    Parameters:
+    - receipts (iterable): The receipts, as accepted by score_one.
+    - processes (int): The number of worker processes. Defaults to the
+      number of CPUs; 1 scores in the calling process.
+    - chunksize (int): The number of receipts sent to a worker at once.
+    - breakdown (bool): Whether to include the breakdown.
+    - vectorized (bool): Whether to score each chunk with NumPy (see
+      app.vectorized). Ignored when the breakdown is requested.
+
+    Yields:
+    - dict: One result per receipt, in input order, with its zero-based
+      "index" and the fields returned by score_one.
+    """
+    processes = processes or os.cpu_count() or 1
+    vectorized = vectorized and not breakdown
+    numbered = enumerate(receipts)
+    chunks = iter(lambda: list(itertools.islice(numbered, chunksize)), [])
+
+    if processes == 1:
+        for chunk in chunks:
+            yield from _score_chunk(chunk, breakdown, vectorized)
+        return
+
+    with ProcessPoolExecutor(processes) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_score_chunk, chunk, breakdown,
+                                       vectorized))
+            if len(pending) >= processes * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _read_json(file, chunk_size=1 << 16):
+    """
+    Yields the elements of a JSON array, or a single JSON value, parsing
+    the file a chunk at a time so that only the element being parsed is
+    held in memory, not the whole array.
+
+    Raises:
+    - json.JSONDecodeError: If the file is not valid JSON.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+
+    def fill():
+        # Reads at least as much as is buffered, so that an element
+        # larger than a chunk is re-parsed a logarithmic number of times.
+        nonlocal buffer, position, eof
+        data = file.read(max(chunk_size, len(buffer) - position))
+        buffer = buffer[position:] + data
+        position = 0
+        eof = not data
+
+    def next_char():
+        # Skips whitespace and returns the next character, or "" at the
+        # end of the file.
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n":
+                position += 1
+            if position < len(buffer) or eof:
+                return buffer[position:position + 1]
+            fill()
+
+    def value():
+        nonlocal position
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # A number cut off at the end of the buffer goes on in the
+                # next chunk, so a value only ends at a delimiter.
+                if eof or (end < len(buffer)
+                           and buffer[end] in " \t\r\n,]"):
+                    position = end
+                    return item
+            fill()
+
+    if next_char() != "[":
+        item = value()
+        if next_char():
+            raise json.JSONDecodeError("Extra data", buffer, position)
+        yield item
+        return
+    position += 1
+    if next_char() == "]":
+        position += 1
+    else:
+        while True:
+            next_char()
+            yield value()
+            char = next_char()
+            position += 1
+            if char == "]":
+                break
+            if char != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter",
+                                           buffer, position - 1)
+    if next_char():
+        raise json.JSONDecodeError("Extra data", buffer, position)
+
+
+def read_receipts(file, input_format="jsonl"):
+    """
+    Yields the raw receipts in a JSON or JSON Lines file.
+
+    Parameters:
+    - file (file): The open input file.
+    - input_format (str): "jsonl" for one receipt per line, or "json" for
+      a single receipt or an array of receipts. Both are read lazily.
+
+    Yields:
+    - str or dict: Raw JSON lines (blank lines skipped) or parsed
+      receipts.
+    """
+    if input_format == "json":
+        yield from _read_json(file)
+        return
+    for line in file:
+        if line.strip():
+            yield line
+
+
+def write_results(results, file, output_format="jsonl"):
+    """
+    Writes results as JSON Lines or CSV.
+
+    Parameters:
+    - results (iterable): The results yielded by score_receipts.
+    - file (file): The open output file.
+    - output_format (str): "jsonl" or "csv". In CSV the breakdown is
+      joined with " | ".
+
+    Returns:
+    - int: The number of results written.
+    """
+    count = 0
+    if output_format == "csv":
+        writer = csv.DictWriter(file, CSV_FIELDS)
+        writer.writeheader()
+        for result in results:
+            if "breakdown" in result:
+                result = dict(result,
+                              breakdown=" | ".join(result["breakdown"]))
+            writer.writerow(result)
+            count += 1
+    else:
+        for result in results:
+            file.write(json.dumps(result) + "\n")
+            count += 1
+    return count
+
+
+def main(argv=None):
+    """
+    Command line entry point, see the module docstring.
+
+    Parameters:
+    - argv (list): The command line arguments. Defaults to sys.argv[1:].
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m app.offline",
+        description="Score archived receipts without a server.")
+    parser.add_argument("input", help="JSON Lines or JSON file, or -")
+    parser.add_argument("-o", "--output", default=None,
+                        help="output file (default: stdout)")
+    parser.add_argument("--format", choices=["jsonl", "csv"],
+                        default=None,
+                        help="output format (default: from the output "
+                             "file's suffix, else jsonl)")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+                        help="worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=500,
+                        help="receipts per worker task (default: 500)")
+    parser.add_argument("--breakdown", action="store_true",
+                        help="include the breakdown of every receipt")
+    parser.add_argument("--vectorized", action="store_true",
+                        help="score chunks with NumPy (points only)")
+    args = parser.parse_args(argv)
+
+    output_format = args.format or (
+        "csv" if args.output and args.output.endswith(".csv") else "jsonl")
+    input_format = "json" if args.input.endswith(".json") else "jsonl"
+
+    infile = sys.stdin if args.input == "-" else open(args.input)
+    outfile = (open(args.output, "w", newline="") if args.output
+               else sys.stdout)
+    try:
+        results = score_receipts(read_receipts(infile, input_format),
+                                 args.processes, args.chunk_size,
+                                 args.breakdown, args.vectorized)
+        write_results(results, outfile, output_format)
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+This module scores receipts in the background.
+
+POST /receipts/process normally scores and stores a receipt before it
+returns the ID. With RECEIPT_PIPELINE_ENABLED set, it instead puts the
+receipt on a bounded queue and returns at once, and a pool of worker
+threads drains the queue in micro-batches, scoring the receipts and
+writing them to the store with one put_many call per batch. Until then
+the receipt ID is pending. If scoring or storing a batch fails, its
+receipts are retried one at a time, and the IDs of those that fail again
+are kept as failed, so that a GET for them is answered with an error
+rather than 404.
+
+Pending IDs are only known to the process that accepted them, so with
+several worker processes a GET served by another process returns 404
+rather than 202 until the receipt is stored.
+
+Dependencies:
+- queue: The bounded queue between the handlers and the workers.
+- collections: Provides the OrderedDict of failed IDs.
+- config: Whether metrics are collected.
+- metrics: The queue wait histogram.
+
+Classes:
+- ScoringPipeline: The queue, the pending and failed IDs and the worker
+  threads.
+
+"""
+
+import logging
+import queue
+import threading
+import time
+
+from collections import OrderedDict
+
+from .config import settings
+from .metrics import PIPELINE_WAIT_SECONDS
+
+
+logger = logging.getLogger(__name__)
+
+
+class ScoringPipeline:
+    """
+    Scores and stores queued receipts on background threads.
+
+    Attributes:
+    - build (callable): Scores a Receipt into a ReceiptRecord.
+    - save (callable): Stores a {receipt_id: record} dictionary.
+    - batch_size (int): The most receipts a worker takes from the queue at
+      once.
+    - max_failed (int): The most failed IDs kept, the queue size. Older
+      ones are dropped first.
+    """
+
+    def __init__(self, build, save, maxsize=10000, workers=2,
+                 batch_size=64):
+        self.build = build
+        self.save = save
+        self.batch_size = batch_size
+        self.max_failed = maxsize
+        self._queue = queue.Queue(maxsize)
+        self._pending = set()
+        self._failed = OrderedDict()
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._run, name=f"scorer-{i}",
+                             daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, receipt_id, receipt):
+        """
+        Queues a receipt for scoring.
+
+        Parameters:
+        - receipt_id (str): The ID returned to the client.
+        - receipt (Receipt): The validated receipt.
+
+        Returns:
+        - bool: False if the queue is full and the receipt was not queued.
+        """
+        with self._lock:
+            self._pending.add(receipt_id)
+        try:
+            self._queue.put_nowait((receipt_id, receipt, time.monotonic()))
+        except queue.Full:
+            with self._lock:
+                self._pending.discard(receipt_id)
+            return False
+        return True
+
+    def is_pending(self, receipt_id):
+        """
+        Returns whether a receipt is queued or being scored.
+        """
+        return receipt_id in self._pending
+
+    def has_failed(self, receipt_id):
+        """
+        Returns whether a receipt could not be scored or stored.
+        """
+        return receipt_id in self._failed
+
+    def depth(self):
+        """
+        Returns the number of receipts waiting in the queue.
+        """
+        return self._queue.qsize()
+
+    def pending(self):
+        """
+        Returns the number of receipts queued or being scored.
+        """
+        return len(self._pending)
+
+    def _take(self):
+        """
+        Blocks for one queued item, then takes up to batch_size - 1 more
+        without waiting. A None item, which stops the worker, ends the
+        batch.
+        """
+        batch = [self._queue.get()]
+        while batch[-1] is not None and len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """
+        Scores and stores micro-batches until a None item is taken.
+        """
+        while True:
+            batch = self._take()
+            stop = batch[-1] is None
+            items = batch[:-1] if stop else batch
+            now = time.monotonic()
+            try:
+                if settings.metrics_enabled:
+                    for _, _, enqueued in items:
+                        PIPELINE_WAIT_SECONDS.observe(now - enqueued)
+                try:
+                    self._store(items)
+                except Exception:
+                    logger.exception("Failed to score %d queued receipts, "
+                                     "retrying them one at a time",
+                                     len(items))
+                    for item in items:
+                        self._retry(item)
+            finally:
+                with self._lock:
+                    self._pending.difference_update(
+                        item[0] for item in items)
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _store(self, items):
+        """
+        Scores (receipt_id, receipt, enqueued) items and stores them with
+        one save call.
+        """
+        entries = {receipt_id: self.build(receipt)
+                   for receipt_id, receipt, _ in items}
+        if entries:
+            self.save(entries)
+
+    def _retry(self, item):
+        """
+        Scores and stores one item of a failed batch, and records its ID
+        as failed if that fails too.
+        """
+        try:
+            self._store([item])
+        except Exception:
+            logger.exception("Failed to score queued receipt %s", item[0])
+            with self._lock:
+                self._failed[item[0]] = None
+                if len(self._failed) > self.max_failed:
+                    self._failed.popitem(last=False)
+
+    def close(self):
+        """
+        Scores every queued receipt, then stops the workers.
+        """
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
@@ -0,0 +1,217 @@
+"""
+This module profiles live requests on demand.
+
+A profiling session runs for a number of seconds and covers a fraction of
+the requests made to the handlers wrapped with Profiler.wrap. In "sample"
+mode a background thread samples the stacks of the threads running those
+requests every few milliseconds and writes them as collapsed stacks
+("frame;frame;frame count" lines, readable by flamegraph.pl, speedscope
+or inferno). In "cprofile" mode each covered request runs under cProfile
+and the merged statistics are written as a .prof file readable by pstats,
+snakeviz or flameprof.
+
+Profiling is off unless RECEIPT_PROFILING_ENABLED is set. When it is off,
+Profiler.wrap returns the handler unchanged, so it costs nothing.
+
+Dependencies:
+- cProfile, pstats: The deterministic profiler and its statistics.
+- sys: Provides the stacks of running threads.
+
+Classes:
+- Profiler: Wraps request handlers and runs profiling sessions.
+
+"""
+
+import cProfile
+import functools
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+
+
+MODES = ("sample", "cprofile")
+
+
+def _frame_name(code):
+    """
+    Formats a code object as a flame graph frame, e.g.
+    score_record (app/utils.py:83).
+    """
+    filename = code.co_filename
+    cwd = os.getcwd() + os.sep
+    if filename.startswith(cwd):
+        filename = filename[len(cwd):]
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class Profiler:
+    """
+    Wraps request handlers and runs profiling sessions over them.
+
+    Attributes:
+    - enabled (bool): Whether wrap instruments handlers at all.
+    - directory (str): Where profiles are written.
+    - interval (float): The stack sampling interval in seconds.
+    - session (dict or None): The running session, if any.
+    """
+
+    def __init__(self, enabled, directory, interval=0.005):
+        self.enabled = enabled
+        self.directory = directory
+        self.interval = interval
+        self.session = None
+        self._lock = threading.Lock()
+        self._threads = set()
+        self._wrapper_code = None
+
+    def wrap(self, func):
+        """
+        Wraps a synchronous request handler so that profiling sessions
+        cover it.
+
+        Parameters:
+        - func (callable): The handler.
+
+        Returns:
+        - callable: The wrapped handler, or func itself when profiling is
+          disabled.
+        """
+        if not self.enabled:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            session = self.session
+            if (session is None or time.monotonic() >= session["until"]
+                    or random.random() >= session["rate"]):
+                return func(*args, **kwargs)
+            if session["mode"] == "cprofile":
+                profile = cProfile.Profile()
+                try:
+                    return profile.runcall(func, *args, **kwargs)
+                finally:
+                    with self._lock:
+                        session["stats"].add(profile)
+                        session["requests"] += 1
+            ident = threading.get_ident()
+            self._threads.add(ident)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._threads.discard(ident)
+                with self._lock:
+                    session["requests"] += 1
+
+        self._wrapper_code = wrapper.__code__
+        return wrapper
+
+    def start(self, seconds, rate=1.0, mode="sample"):
+        """
+        Starts a profiling session.
+
+        Parameters:
+        - seconds (float): How long the session runs.
+        - rate (float): The fraction of requests it covers, in (0, 1].
+        - mode (str): "sample" or "cprofile".
+
+        Returns:
+        - str: The path the profile will be written to.
+
+        Raises:
+        - ValueError: If the parameters are invalid.
+        - RuntimeError: If profiling is disabled or a session is running.
+        """
+        if not self.enabled:
+            raise RuntimeError("Profiling is disabled.")
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}.")
+        if seconds <= 0:
+            raise ValueError("seconds must be positive.")
+        if not 0 < rate <= 1:
+            raise ValueError("rate must be in (0, 1].")
+        with self._lock:
+            if self.session is not None:
+                raise RuntimeError("A profiling session is already running.")
+            os.makedirs(self.directory, exist_ok=True)
+            suffix = "collapsed" if mode == "sample" else "prof"
+            # Milliseconds and the process ID keep sessions started in the
+            # same second, or by other workers sharing the directory, apart.
+            now = time.time()
+            name = (f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}"
+                    f"-{int(now % 1 * 1000):03d}-{os.getpid()}")
+            path = os.path.join(self.directory, f"{mode}-{name}.{suffix}")
+            self.session = {
+                "mode": mode,
+                "rate": rate,
+                "until": time.monotonic() + seconds,
+                "path": path,
+                "requests": 0,
+                "stacks": {},
+                "stats": pstats.Stats() if mode == "cprofile" else None,
+            }
+        threading.Thread(target=self._run, args=(self.session,),
+                         name="profiler", daemon=True).start()
+        return path
+
+    def status(self):
+        """
+        Describes the running session and the profiles written so far.
+
+        Returns:
+        - dict: The session (or None) and the profile file names.
+        """
+        session = self.session
+        running = None
+        if session is not None:
+            running = {
+                "mode": session["mode"],
+                "rate": session["rate"],
+                "remaining": max(0.0, session["until"] - time.monotonic()),
+                "requests": session["requests"],
+                "path": session["path"],
+            }
+        profiles = []
+        if os.path.isdir(self.directory):
+            profiles = sorted(os.listdir(self.directory))
+        return {"session": running, "profiles": profiles}
+
+    def _sample(self, stacks):
+        """
+        Adds the current stack of every thread running a covered request
+        to stacks, from the handler down.
+        """
+        frames = sys._current_frames()
+        for ident in list(self._threads):
+            frame = frames.get(ident)
+            names = []
+            while (frame is not None
+                   and frame.f_code is not self._wrapper_code):
+                names.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if names:
+                key = ";".join(reversed(names))
+                stacks[key] = stacks.get(key, 0) + 1
+
+    def _run(self, session):
+        """
+        Samples stacks, or waits, until the session ends, then writes the
+        profile.
+        """
+        while time.monotonic() < session["until"]:
+            if session["mode"] == "sample":
+                self._sample(session["stacks"])
+                time.sleep(self.interval)
+            else:
+                remaining = session["until"] - time.monotonic()
+                time.sleep(min(0.1, max(0.0, remaining)))
+        with self._lock:
+            if session["mode"] == "cprofile":
+                session["stats"].dump_stats(session["path"])
+            else:
+                with open(session["path"], "w") as file:
+                    for stack, count in sorted(session["stacks"].items()):
+                        file.write(f"{stack} {count}\n")
+            self.session = None
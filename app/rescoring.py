@@ -0,0 +1,183 @@
+"""
+This module re-scores stored receipts after the rule set changes.
+
+When a new rule set is activated, new receipts are scored with it right
+away, but the receipts already in the store keep the scores of the rule
+set that was active when they arrived. A Rescorer walks the store in
+chunks on a background thread, re-scores the records whose rule set
+version is not the active one and writes them back, so live requests only
+ever wait for one chunk. It is throttled to a number of records per
+second, can be paused and resumed where it stopped, and starts over from
+the beginning when yet another rule set is activated. Since every record
+carries the version that scored it, a job interrupted by a restart is
+resumed by starting it again: records it already re-scored are skipped.
+
+Dependencies:
+- threading: The background thread and its pause and wake-up events.
+
+Classes:
+- Rescorer: The background re-scoring job and its progress.
+
+"""
+
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class Rescorer:
+    """
+    Re-scores stale records in the store on a background thread.
+
+    Attributes:
+    - chunks (callable): Called with the chunk size, returns an iterator
+      over lists of (receipt_id, record) pairs covering the store.
+    - rescore (callable): Returns a record re-scored with the active rule
+      set, or None if it is up to date.
+    - save (callable): Stores a {receipt_id: record} dictionary.
+    - chunk_size (int): The most records read and written at once.
+    - rate (float): The most records scanned per second. 0 disables the
+      throttle.
+    """
+
+    def __init__(self, chunks, rescore, save, chunk_size=500, rate=0.0):
+        self.chunks = chunks
+        self.rescore = rescore
+        self.save = save
+        self.chunk_size = chunk_size
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+        self._closed = False
+        self._thread = None
+        self._job = None
+
+    def start(self, version):
+        """
+        Starts re-scoring the store for a rule set version, abandoning the
+        current job, if any, at its next chunk.
+
+        Parameters:
+        - version (int): The version records are re-scored to.
+        """
+        with self._lock:
+            self._job = {"version": version, "state": "running",
+                         "scanned": 0, "rescored": 0, "errors": 0,
+                         "started": time.time(), "finished": None,
+                         "busy_seconds": 0.0}
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="rescorer", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def pause(self):
+        """
+        Pauses the job after its current chunk.
+        """
+        self._running.clear()
+
+    def resume(self):
+        """
+        Resumes a paused job where it stopped.
+        """
+        self._running.set()
+
+    def status(self):
+        """
+        Describes the current or last job.
+
+        Returns:
+        - dict or None: The rule set version, the state ("running",
+          "paused", "done" or "failed"), the records scanned, re-scored
+          and failed, the start and finish times, the time spent working
+          (excluding throttling and pauses) and the records scanned per
+          second of it; None if no job was started.
+        """
+        job = self._job
+        if job is None:
+            return None
+        status = dict(job)
+        if status["state"] == "running" and not self._running.is_set():
+            status["state"] = "paused"
+        busy = status["busy_seconds"]
+        status["records_per_second"] = (
+            status["scanned"] / busy if busy else 0.0)
+        return status
+
+    def close(self):
+        """
+        Stops the job after its current chunk and waits for the thread.
+        """
+        self._closed = True
+        self._running.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        """
+        Runs jobs as they are started until the rescorer is closed.
+        """
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._closed:
+                return
+            job = self._job
+            try:
+                finished = self._rescore_store(job)
+            except Exception:
+                logger.exception("Re-scoring for rule set version %d failed",
+                                 job["version"])
+                job["state"] = "failed"
+                job["finished"] = time.time()
+                continue
+            if finished:
+                job["state"] = "done"
+                job["finished"] = time.time()
+
+    def _rescore_store(self, job):
+        """
+        Walks the store chunk by chunk, re-scoring stale records.
+
+        Returns:
+        - bool: True if the whole store was walked, False if the job was
+          replaced or the rescorer closed first.
+        """
+        for chunk in self.chunks(self.chunk_size):
+            self._running.wait()
+            if job is not self._job or self._closed:
+                return False
+            start = time.perf_counter()
+            entries = {}
+            # Identical receipts share one record; re-score it once.
+            rescored = {}
+            for receipt_id, record in chunk:
+                new = rescored.get(id(record))
+                if new is None:
+                    try:
+                        new = self.rescore(record)
+                    except Exception:
+                        job["errors"] += 1
+                        continue
+                    if new is None:
+                        continue
+                    rescored[id(record)] = new
+                entries[receipt_id] = new
+            if entries:
+                self.save(entries)
+            elapsed = time.perf_counter() - start
+            job["scanned"] += len(chunk)
+            job["rescored"] += len(entries)
+            job["busy_seconds"] += elapsed
+            # Sleep off the time the chunk took less than the rate allows;
+            # without a rate, still let the handler threads run.
+            pause = len(chunk) / self.rate - elapsed if self.rate else 0
+            time.sleep(max(0.0, pause))
+        return True
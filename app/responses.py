@@ -0,0 +1,27 @@
+"""
+This module defines the custom response classes used by the API.
+
+Classes:
+- DuplexStreamingResponse (StreamingResponse): Streams a response while the
+  request body is still being read.
+
+"""
+
+from starlette.responses import StreamingResponse
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    Streams a response while the request body is still being read.
+
+    StreamingResponse listens for the client disconnecting by reading
+    messages from the request, which would swallow the body chunks that the
+    response's own iterator is reading. This class leaves every message to
+    the iterator; a disconnect surfaces there as
+    starlette.requests.ClientDisconnect instead.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
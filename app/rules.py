@@ -0,0 +1,541 @@
+"""
+This module defines the scoring rules as declarative, versioned rule sets.
+
+A rule set is a version number and a list of rules, each one of the rule
+kinds below with its parameters, e.g.
+
+    {"version": 2, "rules": [
+        {"kind": "retailer_characters", "points": 1},
+        {"kind": "round_total", "points": 50},
+        {"kind": "retailer_bonus", "retailer": "Target", "points": 100}]}
+
+RuleSet compiles such a configuration into a single scoring function with
+the parameters written in, so scoring a receipt parses nothing and calls
+nothing per rule. The rule numbers in a record's rule codes are the 1-based
+positions of the rules in the set that scored it, and the record's version
+says which set that was, so its breakdown is rendered by the same rules.
+
+The built-in rule set, version 1, holds the seven original rules. Another
+set can be loaded from a JSON file at startup or activated while the API
+runs. Every set activated in this process is kept, so that the records it
+scored can still be rendered.
+
+Dependencies:
+- pydantic: Validates rule set configurations.
+- db.records: Provides rule codes and money decoding.
+- metrics: Collects the per-rule timings and hit counts.
+
+Classes:
+- RetailerCharacters, RoundTotal, TotalMultiple, ItemPairs,
+  ItemDescription, OddDay, TimeWindow, RetailerBonus, DateRange
+  (BaseModel): The rule kinds.
+- RuleSetConfig (BaseModel): A rule set configuration.
+- RuleSet: A compiled rule set.
+
+Functions:
+- load_rule_set(path): Compiles the rule set in a JSON file.
+- get_rule_set(version): Returns the active rule set, or a known one by
+  version.
+- activate(rule_set): Makes a rule set the active one.
+
+Global Variables:
+- DEFAULT_RULES: The configuration of the built-in rule set.
+- DEFAULT_RULE_SET: The built-in rule set, compiled.
+
+"""
+
+import functools
+import math
+import threading
+import time
+
+from datetime import date
+from fractions import Fraction
+from typing import Annotated, List, Literal, Union
+
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+from db.records import RULE_BITS, split_rule_code
+from .metrics import rule_metrics
+from .models import Cents, format_cents
+
+
+@functools.lru_cache(maxsize=None)
+def _cents_ratio(multiplier):
+    """
+    Returns a price multiplier as an exact fraction of a price in cents,
+    e.g. 0.2 as (1, 500), so that points are computed with integer
+    arithmetic.
+    """
+    ratio = Fraction(str(multiplier))
+    return ratio.numerator, ratio.denominator * 100
+
+
+def _format_exact(value):
+    """
+    Formats a Fraction whose denominator divides a power of ten as a
+    decimal without rounding, e.g. 21/4 as 5.25.
+    """
+    places = 0
+    while 10 ** places % value.denominator:
+        places += 1
+    if not places:
+        return str(value.numerator)
+    digits = str(value.numerator * 10 ** places // value.denominator)
+    digits = digits.rjust(places + 1, "0")
+    return f"{digits[:-places]}.{digits[-places:]}"
+
+
+def _format_hour(hour):
+    """
+    Formats an hour of the day, e.g. 14 as 2:00pm, and 0 or 24 as
+    midnight.
+    """
+    if hour % 24 == 0:
+        return "midnight"
+    return f"{(hour - 1) % 12 + 1}:00{'am' if hour < 12 else 'pm'}"
+
+
+class RetailerCharacters(BaseModel):
+    """
+    Awards points for every alphanumeric character in the retailer name.
+    """
+    kind: Literal["retailer_characters"]
+    points: int = 1
+
+    def source(self, number, constants):
+        return [
+            "count = sum(char.isalnum() for char in record.retailer)",
+            f"points += count * {self.points}",
+            "if count > 0:",
+            f"    codes.append({number})",
+        ]
+
+    def describe(self, record, arg):
+        count = sum(char.isalnum() for char in record.retailer)
+        return (f"{count * self.points} points - retailer name has "
+                f"{count} characters")
+
+
+class RoundTotal(BaseModel):
+    """
+    Awards points if the total is a round dollar amount with no cents.
+    """
+    kind: Literal["round_total"]
+    points: int = 50
+
+    def source(self, number, constants):
+        return [
+            "if record.total % 100 == 0:",
+            f"    points += {self.points}",
+            f"    codes.append({number})",
+        ]
+
+    def describe(self, record, arg):
+        return f"{self.points} points - total is a round dollar amount"
+
+
+class TotalMultiple(BaseModel):
+    """
+    Awards points if the total is a multiple of an amount.
+    """
+    kind: Literal["total_multiple"]
+    points: int = 25
+    multiple: Cents = 25
+
+    @field_validator("multiple")
+    @classmethod
+    def check_multiple(cls, multiple):
+        if multiple <= 0:
+            raise ValueError("multiple must be positive")
+        return multiple
+
+    def source(self, number, constants):
+        return [
+            f"if record.total % {self.multiple} == 0:",
+            f"    points += {self.points}",
+            f"    codes.append({number})",
+        ]
+
+    def describe(self, record, arg):
+        return (f"{self.points} points - total is a multiple of "
+                f"{format_cents(self.multiple)}")
+
+
+class ItemPairs(BaseModel):
+    """
+    Awards points for every two items on the receipt.
+    """
+    kind: Literal["item_pairs"]
+    points: int = 5
+
+    def source(self, number, constants):
+        return [
+            "pairs = record.item_count // 2",
+            f"points += pairs * {self.points}",
+            "if pairs > 0:",
+            f"    codes.append({number})",
+        ]
+
+    def describe(self, record, arg):
+        pairs = record.item_count // 2
+        return (f"{pairs * self.points} points - {pairs * 2} items "
+                f"({pairs} pairs @ {self.points} points each)")
+
+
+class ItemDescription(BaseModel):
+    """
+    Awards, for every item whose trimmed description length is a multiple
+    of length_multiple, the item price multiplied by price_multiplier (a
+    finite number from 0 to 100) and rounded up to the nearest integer.
+    """
+    kind: Literal["item_description"]
+    length_multiple: int = Field(default=3, gt=0)
+    price_multiplier: float = Field(default=0.2, ge=0, le=100,
+                                    allow_inf_nan=False)
+
+    def item_points(self, price):
+        """
+        Calculates the points of an item price.
+
+        Parameters:
+        - price (int): The price in cents.
+
+        Returns:
+        - int: The points.
+        """
+        numerator, denominator = _cents_ratio(self.price_multiplier)
+        return -(-price * numerator // denominator)
+
+    def source(self, number, constants):
+        numerator, denominator = _cents_ratio(self.price_multiplier)
+        return [
+            "items = record.items",
+            "for index in range(record.item_count):",
+            f"    if len(items[2 * index].strip()) % "
+            f"{self.length_multiple} == 0:",
+            f"        points -= -items[2 * index + 1] * {numerator} "
+            f"// {denominator}",
+            f"        codes.append({number} | (index << {RULE_BITS}))",
+        ]
+
+    def describe(self, record, arg):
+        description, price = record.item(arg)
+        description = description.strip()
+        cents = record.items[2 * arg + 1]
+        points = self.item_points(cents)
+        multiplier = self.price_multiplier
+        product = round(price * multiplier, 2)
+        if math.ceil(product) != points:
+            # Two decimals would hide what was rounded up, e.g. 0.002.
+            numerator, denominator = _cents_ratio(multiplier)
+            product = _format_exact(Fraction(cents * numerator, denominator))
+        return (f'{points} points - "{description}" is {len(description)} '
+                f"characters (a multiple of {self.length_multiple})\n"
+                f"             item price of {price} * {multiplier} = "
+                f"{product}, rounded up is {points} points")
+
+
+class OddDay(BaseModel):
+    """
+    Awards points if the day in the purchase date is odd.
+    """
+    kind: Literal["odd_day"]
+    points: int = 6
+
+    def source(self, number, constants):
+        return [
+            "if (record.purchase_date.day % 2) != 0:",
+            f"    points += {self.points}",
+            f"    codes.append({number})",
+        ]
+
+    def describe(self, record, arg):
+        return f"{self.points} points - purchase day is odd"
+
+
+class TimeWindow(BaseModel):
+    """
+    Awards points if the time of purchase is after start_hour and before
+    end_hour, which must be later. As in the original rule, purchases on
+    the hour do not count.
+    """
+    kind: Literal["time_window"]
+    points: int = 10
+    start_hour: int = Field(default=14, ge=0, le=23)
+    end_hour: int = Field(default=16, ge=1, le=24)
+
+    @model_validator(mode="after")
+    def check_hours(self):
+        if self.start_hour >= self.end_hour:
+            raise ValueError("start_hour must be before end_hour")
+        return self
+
+    def source(self, number, constants):
+        return [
+            "purchase_time = record.purchase_time",
+            f"if ({self.start_hour} <= purchase_time.hour < {self.end_hour}"
+            " and purchase_time.minute != 0):",
+            f"    points += {self.points}",
+            f"    codes.append({number})",
+        ]
+
+    def describe(self, record, arg):
+        purchase_time = record.purchase_time.strftime("%-I:%M%p")
+        return (f"{self.points} points - {purchase_time} is between "
+                f"{_format_hour(self.start_hour)} and "
+                f"{_format_hour(self.end_hour)}")
+
+
+class RetailerBonus(BaseModel):
+    """
+    Awards points if the retailer name matches, ignoring case and
+    surrounding whitespace.
+    """
+    kind: Literal["retailer_bonus"]
+    retailer: str
+    points: int
+
+    def source(self, number, constants):
+        retailer = f"retailer_{number}"
+        constants[retailer] = self.retailer.strip().casefold()
+        return [
+            f"if record.retailer.strip().casefold() == {retailer}:",
+            f"    points += {self.points}",
+            f"    codes.append({number})",
+        ]
+
+    def describe(self, record, arg):
+        return f"{self.points} points - retailer is {self.retailer}"
+
+
+class DateRange(BaseModel):
+    """
+    Awards points if the purchase date is between start and end, inclusive.
+    """
+    kind: Literal["date_range"]
+    start: date
+    end: date
+    points: int
+
+    def source(self, number, constants):
+        start, end = f"start_{number}", f"end_{number}"
+        constants[start], constants[end] = self.start, self.end
+        return [
+            f"if {start} <= record.purchase_date <= {end}:",
+            f"    points += {self.points}",
+            f"    codes.append({number})",
+        ]
+
+    def describe(self, record, arg):
+        return (f"{self.points} points - purchased between "
+                f"{self.start.isoformat()} and {self.end.isoformat()}")
+
+
+Rule = Annotated[Union[RetailerCharacters, RoundTotal, TotalMultiple,
+                       ItemPairs, ItemDescription, OddDay, TimeWindow,
+                       RetailerBonus, DateRange],
+                 Field(discriminator="kind")]
+
+
+class RuleSetConfig(BaseModel):
+    """
+    Represents a rule set configuration.
+
+    Attributes:
+    - version (int): The version, recorded with every score.
+    - rules (list): The rules, at most 2 ** RULE_BITS - 1 of them.
+    """
+    version: int = Field(ge=1)
+    rules: List[Rule] = Field(min_length=1,
+                              max_length=(1 << RULE_BITS) - 1)
+
+
+DEFAULT_RULES = {"version": 1, "rules": [
+    {"kind": "retailer_characters"},
+    {"kind": "round_total"},
+    {"kind": "total_multiple"},
+    {"kind": "item_pairs"},
+    {"kind": "item_description"},
+    {"kind": "odd_day"},
+    {"kind": "time_window"},
+]}
+
+
+class RuleSet:
+    """
+    Represents a compiled rule set.
+
+    Like the dataclass and namedtuple constructors, the scoring function is
+    generated as Python source: the code of every rule, with its parameters
+    written in as literals, one after the other in a single function. The
+    built-in rule set thus runs the same code as a hand-written scorer, and
+    a second variant takes a clock reading after every rule for
+    rule_metrics.
+
+    Attributes:
+    - config (RuleSetConfig): The configuration it was compiled from.
+    - version (int): The version of the configuration.
+    - activated (float): When it was made the active set (time.time()).
+    - source (str): The generated source of the scoring functions.
+    """
+
+    def __init__(self, config):
+        if not isinstance(config, RuleSetConfig):
+            config = RuleSetConfig.model_validate(config)
+        self.config = config
+        self.version = config.version
+        self.activated = None
+        constants = {}
+        rules = [rule.source(number, constants)
+                 for number, rule in enumerate(config.rules, 1)]
+        self.source = "\n".join(
+            self._function("score", rules, timed=False)
+            + self._function("score_timed", rules, timed=True))
+        code = compile(self.source, f"<rule set {self.version}>", "exec")
+        exec(code, constants)
+        self._score = constants["score"]
+        self._score_timed = constants["score_timed"]
+
+    @staticmethod
+    def _function(name, rules, timed):
+        """
+        Returns the source lines of a scoring function running the given
+        rule sources in order. It returns the points and the error message,
+        if a rule raised.
+        """
+        lines = [f"def {name}(record, codes, marks, clock):",
+                 "    points = 0",
+                 "    try:"]
+        for rule in rules:
+            lines.extend("        " + line for line in rule)
+            if timed:
+                lines.append("        marks.append(clock())")
+        lines += ["    except Exception as e:",
+                  "        return points, str(e)",
+                  "    return points, None",
+                  ""]
+        return lines
+
+    def score(self, record):
+        """
+        Calculates the points of a record and records which rules fired.
+
+        The record's points, rules, error and version attributes are
+        overwritten. If a rule raises, scoring stops there, the rules that
+        already fired are kept and the error message is stored. Unless
+        metrics are disabled, the time spent in each rule and the rules that
+        fired are recorded in rule_metrics.
+
+        Parameters:
+        - record (ReceiptRecord): The record to score.
+
+        Returns:
+        - ReceiptRecord: The same record, scored.
+        """
+        codes = []
+        if rule_metrics.enabled:
+            clock = time.perf_counter_ns
+            marks = [clock()]
+            points, error = self._score_timed(record, codes, marks, clock)
+            rule_metrics.observe(marks, codes)
+        else:
+            points, error = self._score(record, codes, None, None)
+        record.points = points
+        record.rules = tuple(codes)
+        record.error = error
+        record.version = self.version
+        return record
+
+    def render(self, record):
+        """
+        Renders the breakdown of a record scored by this rule set.
+
+        Parameters:
+        - record (ReceiptRecord): The scored record.
+
+        Returns:
+        - list: One string per rule that fired, followed by the error
+          message if scoring stopped early.
+        """
+        rules = self.config.rules
+        breakdown = [rules[number - 1].describe(record, arg)
+                     for number, arg in map(split_rule_code, record.rules)]
+        if record.error is not None:
+            breakdown.append(f"Error: {record.error}")
+        return breakdown
+
+    @property
+    def is_default(self):
+        """
+        Whether the rules are those of the built-in rule set, whatever the
+        version.
+        """
+        return self.config.rules == DEFAULT_RULE_SET.config.rules
+
+
+def load_rule_set(path):
+    """
+    Compiles the rule set in a JSON file.
+
+    Parameters:
+    - path (str): The file, holding a RuleSetConfig.
+
+    Returns:
+    - RuleSet: The compiled rule set.
+
+    Raises:
+    - OSError: If the file cannot be read.
+    - pydantic.ValidationError: If it is not a valid rule set.
+    """
+    with open(path, "rb") as file:
+        return RuleSet(RuleSetConfig.model_validate_json(file.read()))
+
+
+_lock = threading.Lock()
+_active = None
+_known = {}
+
+
+def get_rule_set(version=None):
+    """
+    Returns the active rule set, or a known one by version.
+
+    Parameters:
+    - version (int or None): The version, or None for the active set.
+
+    Returns:
+    - RuleSet or None: The rule set, or None if no set with that version
+      was activated in this process.
+    """
+    if version is None:
+        return _active
+    return _known.get(version)
+
+
+def activate(rule_set):
+    """
+    Makes a rule set the active one. New receipts are scored with it from
+    then on.
+
+    Parameters:
+    - rule_set (RuleSet): The rule set.
+
+    Raises:
+    - ValueError: If another rule set with the same version is known.
+    """
+    global _active
+    with _lock:
+        known = _known.get(rule_set.version)
+        if known is not None and known is not rule_set \
+                and known.config != rule_set.config:
+            raise ValueError(
+                f"A different rule set with version {rule_set.version} "
+                "is already loaded.")
+        _known[rule_set.version] = rule_set
+        rule_set.activated = time.time()
+        _active = rule_set
+
+
+DEFAULT_RULE_SET = RuleSet(DEFAULT_RULES)
+activate(DEFAULT_RULE_SET)
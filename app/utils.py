@@ -5,73 +5,248 @@ receipt IDs, calculating points, and performing time conversions.
 Dependencies:
 - math: Provides mathematical functions.
 - uuid: Generates and manipulates UUIDs.
+- os, threading: Provide the random bits and the lock behind time-ordered
+  IDs.
+- hashlib: Provides the BLAKE2 hash behind entity tags.
 - datetime: Provides classes for manipulating dates and times.
+- db.records: Provides the compact ReceiptRecord the scorer works on.
+- rules: Provides the compiled rule sets.
 
 Functions:
-- generate_receipt_id(): Generates a receipt ID and returns it.
+- generate_receipt_id(time_ordered): Generates a receipt ID and returns it.
+- receipt_id_bound(when): Returns the ID bound that time-ordered IDs
+  generated from a datetime on sort after.
+- receipt_id_time(id): Returns when a time-ordered receipt ID was
+  generated.
 - decode_receipt_id(id, dict): Decodes a receipt ID using a dictionary and
-  returns the corresponding receipt object.
-- convert_time(time): Converts a time string to a formatted time string.
+  returns the corresponding receipt record.
+- convert_time(time): Converts a time, or a time string, to a formatted
+  time string.
+- score_record(record, rule_set): Calculates the points of a receipt
+  record with a rule set and records which rules fired.
+- render_breakdown(record): Renders the breakdown of a scored record as
+  a list of strings, with the rule set that scored it.
+- compute_etag(record): Computes the entity tag of a scored record's
+  points response.
+- score_receipt(receipt): Calculates the points and breakdown for a single
+  receipt object.
 - calculate_points(id, uuid_dict): Calculates the points and breakdown for
   a given receipt ID using a dictionary of receipts.
 
 """
 
 
+import hashlib
 import math
+import os
+import threading
+import time
 import uuid
 
-from datetime import datetime
+from datetime import datetime, timezone
+from db.records import ReceiptRecord
+from .rules import get_rule_set
 
 
-def generate_receipt_id():
+_id_lock = threading.Lock()
+_last_id = [0, 0]
+
+
+def generate_receipt_id(time_ordered=False):
     """
     Generates a receipt ID and returns it.
 
+    A time-ordered ID is a version 7 UUID: the Unix time in milliseconds,
+    a 12-bit counter that keeps the IDs generated by this process within
+    one millisecond in order, and 62 random bits. Its text sorts in the
+    order the IDs were generated.
+
+    Parameters:
+    - time_ordered (bool): Whether to generate a version 7 UUID instead of
+      a random version 4 UUID.
+
     Returns:
     - str: The generated receipt ID.
     """
-    return str(uuid.uuid4())
+    if not time_ordered:
+        return str(uuid.uuid4())
+    millis = time.time_ns() // 1000000
+    with _id_lock:
+        if millis <= _last_id[0]:
+            millis, counter = _last_id[0], _last_id[1] + 1
+            if counter > 0xFFF:
+                millis, counter = millis + 1, 0
+        else:
+            counter = 0
+        _last_id[0], _last_id[1] = millis, counter
+    random_bits = int.from_bytes(os.urandom(8), "big") >> 2
+    value = ((millis << 80) | (0x7 << 76) | (counter << 64)
+             | (0b10 << 62) | random_bits)
+    digits = f"{value:032x}"
+    return (f"{digits[:8]}-{digits[8:12]}-{digits[12:16]}-"
+            f"{digits[16:20]}-{digits[20:]}")
+
+
+def receipt_id_bound(when):
+    """
+    Returns the ID bound that time-ordered IDs generated from a datetime on
+    sort after, and those generated before it sort before.
+
+    Parameters:
+    - when (datetime): The time. A naive datetime is taken as UTC.
+
+    Returns:
+    - str: The first 13 characters of such IDs.
+    """
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    millis = max(0, math.floor(when.timestamp() * 1000))
+    digits = f"{min(millis, 0xFFFFFFFFFFFF):012x}"
+    return f"{digits[:8]}-{digits[8:]}"
+
+
+def receipt_id_time(receipt_id):
+    """
+    Returns when a time-ordered receipt ID was generated.
+
+    Parameters:
+    - receipt_id (str): The receipt ID.
+
+    Returns:
+    - datetime or None: The UTC time, or None if the ID is not a version 7
+      UUID.
+    """
+    try:
+        parsed = uuid.UUID(receipt_id)
+    except ValueError:
+        return None
+    if parsed.version != 7:
+        return None
+    return datetime.fromtimestamp((parsed.int >> 80) / 1000, timezone.utc)
 
 
 def decode_receipt_id(receipt_id, receipt_dict):
     """
     Decodes a receipt ID using a dictionary and returns the corresponding
-    receipt object.
+    receipt record.
 
     Parameters:
     - receipt_id (str): The receipt ID to decode.
     - receipt_dict (dict): The dictionary containing receipt IDs and their
-      corresponding Receipt objects.
+      corresponding ReceiptRecord objects.
 
     Returns:
-    - Receipt or None: The decoded receipt object if the ID exists
+    - ReceiptRecord or None: The decoded receipt record if the ID exists
       in the dictionary, or None otherwise.
     """
-    try:
-        return receipt_dict[receipt_id][0]
-    except KeyError:
-        return None
+    return receipt_dict.get(receipt_id)
 
 
 def convert_time(time_str):
     """
-    Converts a time string to a formatted time string.
+    Converts a time, or a time string, to a formatted time string.
 
     Parameters:
-    - time_str (str): The time string to convert.
+    - time_str (time or str): The time to convert, as parsed by the Receipt
+      model or as an "HH:MM" string.
 
     Returns:
     - str: The formatted time string.
     """
     try:
-        time_obj = datetime.strptime(time_str, "%H:%M")
+        if isinstance(time_str, str):
+            time_obj = datetime.strptime(time_str, "%H:%M")
+        else:
+            time_obj = time_str
         formatted_time = time_obj.strftime("%-I:%M%p")
         return formatted_time
     except ValueError:
         return "Invalid time format"
 
 
+def score_record(record, rule_set=None):
+    """
+    Calculates the points of a receipt record and records which rules fired.
+
+    The record's points, rules, error and version attributes are
+    overwritten. Money is in integer cents and the date and time are
+    already parsed, so no rule parses strings. If a rule raises, scoring
+    stops there, the rules that already fired are kept and the error
+    message is stored.
+    Unless metrics are disabled, the time spent in each rule and the rules
+    that fired are recorded in rule_metrics.
+
+    Parameters:
+    - record (ReceiptRecord): The record to score.
+    - rule_set (RuleSet): The rules to score it with. Defaults to the
+      active rule set.
+
+    Returns:
+    - ReceiptRecord: The same record, scored.
+    """
+    if rule_set is None:
+        rule_set = get_rule_set()
+    return rule_set.score(record)
+
+
+def render_breakdown(record):
+    """
+    Renders the breakdown of a scored record as a list of strings, with
+    the rule set that scored it.
+
+    Parameters:
+    - record (ReceiptRecord): The scored record.
+
+    Returns:
+    - list: One string per rule that fired, followed by the error message
+      if scoring stopped early.
+
+    Raises:
+    - LookupError: If the rule set that scored the record is not loaded.
+    """
+    rule_set = get_rule_set(record.version)
+    if rule_set is None:
+        raise LookupError(f"Rule set version {record.version} is not "
+                          "loaded.")
+    return rule_set.render(record)
+
+
+def compute_etag(record):
+    """
+    Computes the entity tag of a scored record's points response.
+
+    Everything else the response is rendered from is fixed for a receipt
+    ID, so the tag only covers the score: the points, the rules that fired,
+    the error and the rule set version.
+
+    Parameters:
+    - record (ReceiptRecord): The scored record.
+
+    Returns:
+    - int: A 64-bit tag.
+    """
+    digest = hashlib.blake2b(
+        repr((record.points, record.rules, record.error,
+              record.version)).encode(),
+        digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def score_receipt(receipt):
+    """
+    Calculates the points and breakdown for a single receipt object.
+
+    Parameters:
+    - receipt (Receipt): The receipt to score.
+
+    Returns:
+    - tuple: A tuple containing the calculated points (int)
+      and breakdown (list of str).
+    """
+    record = score_record(ReceiptRecord.from_receipt(receipt))
+    return record.points, render_breakdown(record)
+
+
 def calculate_points(id, uuid_dict):
     """
     Calculates the points and breakdown for a given receipt ID using
@@ -80,84 +255,16 @@ def calculate_points(id, uuid_dict):
     Parameters:
     - id (str): The receipt ID for which to calculate the points.
     - uuid_dict (dict): The dictionary containing receipt IDs and
-      their corresponding Receipt objects.
+      their corresponding ReceiptRecord objects.
 
     Returns:
     - tuple: A tuple containing the calculated points (int)
       and breakdown (list of str).
     """
-    points = 0
-    breakdown = []
-
-    try:
-        receipt = decode_receipt_id(id, uuid_dict)
-
-        if receipt:
-            retailer_name = receipt.retailer
-            purchase_date = receipt.purchaseDate
-            purchase_time = receipt.purchaseTime
-            total = float(receipt.total)
-            items = receipt.items
-
-            # Rule 1: 1 point for every alphanumeric character in retailer name
-            alphanumeric_count = sum(char.isalnum() for char in retailer_name)
-            points += alphanumeric_count
-            if alphanumeric_count > 0:
-                breakdown.append(f"{alphanumeric_count} points - retailer name has {alphanumeric_count} characters")
-
-            # Rule 2: 50 points if total is a round dollar amount with no cents
-            if total.is_integer():
-                points += 50
-                breakdown.append("50 points - total is a round dollar amount")
-
-            # Rule 3: 25 points if the total is a multiple of 0.25
-            if total % 0.25 == 0:
-                points += 25
-                breakdown.append("25 points - total is a multiple of 0.25")
-
-            # Rule 4: 5 points for every two items on the receipt
-            item_count = len(items)
-            points += ((item_count // 2) * 5)
-            if item_count > 1:
-                if item_count % 2 == 0:
-                    counted_items = item_count
-                else:
-                    counted_items = item_count - 1
-                breakdown.append(f"{((item_count // 2) * 5)} points - {counted_items} items ({item_count // 2} pairs @ 5 points each)")
-
-            # Rule 5: If the trimmed length of
-            # the item description is a multiple of 3,
-            # multiply the price by 0.2 and round up to the nearest integer.
-            # The result is the number of points earned
-            for item in items:
-                description = item.shortDescription
-                price = float(item.price)
-                trimmed_length = len(description.strip())
-
-                if trimmed_length % 3 == 0:
-                    item_points = int(math.ceil((price * 0.2)))
-                    points += item_points
-                    breakdown.append(f'{item_points} points - "{description.strip()}" is {trimmed_length} characters (a multiple of 3)\n'
-                                     f"             item price of {price} * 0.2 = {round(price * 0.2, 2)}, rounded up is {item_points} points")
-
-            # Rule 6: 6 points if the day in the purchase date is odd
-            _, _, purchase_day = map(int, purchase_date.split('-'))
-            if (purchase_day % 2) != 0:
-                points += 6
-                breakdown.append("6 points - purchase day is odd")
-
-            # Rule 7: 10 points if time of purchase is
-            # after 2:00pm and before 4:00pm
-            purchase_hour, purchase_min = map(int, purchase_time.split(':'))
-            if 14 <= purchase_hour < 16 and purchase_min != 0:
-                points += 10
-                time = convert_time(purchase_time)
-                breakdown.append(f"10 points - {time} is between 2:00pm and 4:00pm")
-
-        else:
-            raise ValueError("No receipt!!")
+    record = decode_receipt_id(id, uuid_dict)
 
-    except Exception as e:
-        breakdown.append(f"Error: {str(e)}")
+    if not record:
+        return 0, ["Error: No receipt!!"]
 
-    return points, breakdown
+    score_record(record)
+    return record.points, render_breakdown(record)
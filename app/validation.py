@@ -1,9 +1,28 @@
 """
 This module provides functions for validating date, time, and receipt data.
 
+Dates, times and money are checked with the same pydantic-core validators
+as the Receipt model, so a value accepted here is accepted by the API.
+
 """
 
-from datetime import datetime
+from pydantic import TypeAdapter, ValidationError
+
+from .models import Cents, IsoDate, IsoTime, Receipt
+
+
+_date = TypeAdapter(IsoDate)
+_time = TypeAdapter(IsoTime)
+_money = TypeAdapter(Cents)
+_receipt = TypeAdapter(Receipt)
+
+
+def _is_valid(adapter, value):
+    try:
+        adapter.validate_python(value)
+        return True
+    except ValidationError:
+        return False
 
 
 def validate_date(date_str):
@@ -16,18 +35,7 @@ def validate_date(date_str):
     Returns:
         bool: True if the date is valid, False otherwise.
     """
-    try:
-        date_str = datetime.strptime(date_str, "%Y-%m-%d")
-        year, month, day = map(int, date_str.split('-'))
-        if year > 9999 or year < 1:
-            return False
-        if month > 12 or month < 1:
-            return False
-        if day > 31 or day < 1:
-            return False
-        return True
-    except ValueError:
-        return False
+    return _is_valid(_date, date_str)
 
 
 def validate_time(time_str):
@@ -40,16 +48,20 @@ def validate_time(time_str):
     Returns:
         bool: True if the time is valid, False otherwise.
     """
-    try:
-        time_str = datetime.strptime(time_str, "%H:%M")
-        hour, minute = map(int, time_str.split(':'))
-        if hour > 23 or hour < 1:
-            return False
-        if minute > 59 or minute < 1:
-            return False
-        return True
-    except ValueError:
-        return False
+    return _is_valid(_time, time_str)
+
+
+def validate_money(money_str):
+    """
+    Validates the money string in the format "D.CC", e.g. "6.49".
+
+    Args:
+        money_str (str): The money string to validate.
+
+    Returns:
+        bool: True if the amount is valid, False otherwise.
+    """
+    return _is_valid(_money, money_str)
 
 
 def validate_receipt_data(receipt_data):
@@ -73,4 +85,25 @@ def validate_receipt_data(receipt_data):
         if not item.get('shortDescription') or not item.get('price'):
             return False
 
-    return True
+    return _is_valid(_receipt, receipt_data)
+
+
+def format_validation_error(error):
+    """
+    Formats a Pydantic ValidationError as a single readable message.
+
+    Args:
+        error (pydantic.ValidationError): The error raised while validating
+            a receipt.
+
+    Returns:
+        str: The failing field locations and messages joined by "; ".
+    """
+    messages = []
+    for err in error.errors():
+        location = ".".join(str(part) for part in err["loc"])
+        if location:
+            messages.append(f"{location}: {err['msg']}")
+        else:
+            messages.append(err["msg"])
+    return "; ".join(messages)
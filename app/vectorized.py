@@ -0,0 +1,206 @@
+"""
+This module scores batches of receipts column-wise with NumPy.
+
+The receipts are turned into columns (totals and prices in integer cents,
+item counts, flattened item arrays, day, hour and minute) and all seven
+rules are computed for the whole batch in one pass. The results are
+identical to score_record; records whose amounts do not fit in int64
+are scored with score_record instead.
+
+NumPy is an optional dependency: install it with `pip install numpy` to
+use this module.
+
+Classes:
+- ReceiptColumns: The column-wise representation of a batch of receipts.
+
+Functions:
+- to_columns(records): Converts ReceiptRecords to columns.
+- score_columns(columns): Computes the points of every receipt in a batch.
+- score_batch(records): Computes the points of a list of ReceiptRecords.
+
+Global Variables:
+- MAX_CENTS: The largest amount, in cents, the columns can hold.
+
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .rules import get_rule_set
+from .utils import score_record
+
+
+# The largest amount, in cents, that the int64 columns hold. A record
+# whose total or summed item prices exceed it is scored one by one.
+MAX_CENTS = 2 ** 63 - 1
+
+
+class ReceiptColumns:
+    """
+    Represents a batch of receipts as columns.
+
+    Attributes:
+    - alnum (ndarray): The number of alphanumeric characters in each
+      retailer name.
+    - total (ndarray): Each total in cents.
+    - item_count (ndarray): The number of items on each receipt.
+    - day, hour, minute (ndarray): The purchase day, hour and minute.
+    - item_receipt (ndarray): For every item, the row of its receipt.
+    - item_price (ndarray): For every item, its price in cents.
+    - item_length (ndarray): For every item, the trimmed length of its
+      description.
+    """
+    __slots__ = ("alnum", "total", "item_count", "day", "hour", "minute",
+                 "item_receipt", "item_price", "item_length")
+
+    def __init__(self, **columns):
+        for name in self.__slots__:
+            setattr(self, name, columns[name])
+
+    def __len__(self):
+        return len(self.total)
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("Vectorized scoring requires NumPy. "
+                          "Install it with `pip install numpy`.")
+
+
+def to_columns(records):
+    """
+    Converts ReceiptRecords to columns.
+
+    Parameters:
+    - records (list): The ReceiptRecords to convert.
+
+    Returns:
+    - tuple: The ReceiptColumns of the regular records and the positions,
+      in records, of the records that could not be represented (to be
+      scored one by one).
+    """
+    _require_numpy()
+    # Retailer names repeat across receipts, so their alphanumeric counts
+    # are computed once per distinct name.
+    alnum_counts = {}
+    alnum, total, item_count, day, hour, minute = [], [], [], [], [], []
+    item_receipt, item_price, item_length = [], [], []
+    irregular = []
+
+    for position, record in enumerate(records):
+        prices = record.items[1::2]
+        purchase_date = record.purchase_date
+        purchase_time = record.purchase_time
+        if record.total > MAX_CENTS or sum(prices) > MAX_CENTS:
+            irregular.append(position)
+            continue
+
+        row = len(total)
+        retailer = record.retailer
+        count = alnum_counts.get(retailer)
+        if count is None:
+            count = alnum_counts[retailer] = sum(
+                char.isalnum() for char in retailer)
+        alnum.append(count)
+        total.append(record.total)
+        item_count.append(len(prices))
+        day.append(purchase_date.day)
+        hour.append(purchase_time.hour)
+        minute.append(purchase_time.minute)
+        item_receipt.extend([row] * len(prices))
+        item_price.extend(prices)
+        item_length.extend(len(description.strip())
+                           for description in record.items[0::2])
+
+    columns = ReceiptColumns(
+        alnum=np.array(alnum, dtype=np.int64),
+        total=np.array(total, dtype=np.int64),
+        item_count=np.array(item_count, dtype=np.int64),
+        day=np.array(day, dtype=np.int64),
+        hour=np.array(hour, dtype=np.int64),
+        minute=np.array(minute, dtype=np.int64),
+        item_receipt=np.array(item_receipt, dtype=np.int64),
+        item_price=np.array(item_price, dtype=np.int64),
+        item_length=np.array(item_length, dtype=np.int64))
+    return columns, irregular
+
+
+def score_columns(columns):
+    """
+    Computes the points of every receipt in a batch.
+
+    Parameters:
+    - columns (ReceiptColumns): The batch.
+
+    Returns:
+    - ndarray: The points of each receipt, as int64.
+    """
+    _require_numpy()
+    # Rule 1: 1 point for every alphanumeric character in retailer name
+    points = columns.alnum.copy()
+    # Rule 2: 50 points if total is a round dollar amount with no cents
+    points += 50 * (columns.total % 100 == 0)
+    # Rule 3: 25 points if the total is a multiple of 0.25
+    points += 25 * (columns.total % 25 == 0)
+    # Rule 4: 5 points for every two items on the receipt
+    points += 5 * (columns.item_count // 2)
+    # Rule 5: ceil(price * 0.2) points for every item whose trimmed
+    # description length is a multiple of 3, i.e. ceil(cents / 500).
+    # The sum stays in int64: bincount would sum in float64 and round
+    # large amounts.
+    item_points = np.where(columns.item_length % 3 == 0,
+                           -(-columns.item_price // 500), 0)
+    np.add.at(points, columns.item_receipt, item_points)
+    # Rule 6: 6 points if the day in the purchase date is odd
+    points += 6 * (columns.day % 2 != 0)
+    # Rule 7: 10 points if time of purchase is
+    # after 2:00pm and before 4:00pm
+    points += 10 * ((columns.hour >= 14) & (columns.hour < 16)
+                    & (columns.minute != 0))
+    return points
+
+
+def score_batch(records):
+    """
+    Computes the points of a list of ReceiptRecords.
+
+    The records are not modified; records the columns cannot represent
+    are scored one by one with score_record on a copy. The columns compute
+    the built-in rules, so when the active rule set has other rules every
+    record is scored that way.
+
+    Parameters:
+    - records (list): The ReceiptRecords to score.
+
+    Returns:
+    - ndarray: The points of each record, in order, as int64, or as
+      Python ints (dtype object) if a record scores more than int64 holds.
+    """
+    if not get_rule_set().is_default:
+        _require_numpy()
+        return _points_array([score_record(record.copy()).points
+                              for record in records])
+    columns, irregular = to_columns(records)
+    points = np.empty(len(records), dtype=np.int64)
+    regular = np.ones(len(records), dtype=bool)
+    regular[irregular] = False
+    points[regular] = score_columns(columns)
+    if irregular:
+        scores = []
+        for position in irregular:
+            record = records[position]
+            copy = type(record)(*record.__getstate__())
+            scores.append(score_record(copy).points)
+        if max(scores) > MAX_CENTS:
+            points = points.astype(object)
+        points[irregular] = scores
+    return points
+
+
+def _points_array(points):
+    try:
+        return np.array(points, dtype=np.int64)
+    except OverflowError:
+        return np.array(points, dtype=object)
@@ -0,0 +1,7 @@
+"""
+Benchmarks for the Receipt Processor system.
+
+Each module in this package can be run directly, e.g.
+`python -m bench.batch`, from the project root.
+
+"""
@@ -0,0 +1,69 @@
+"""
+This script compares the throughput of the single-receipt endpoint
+(POST /receipts/process) with the batch endpoint
+(POST /receipts/process/batch).
+
+Usage:
+    python -m bench.batch [--count N] [--batch-size N]
+
+"""
+
+import argparse
+import time
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from bench.common import make_receipts, rate
+from db import db
+
+
+def bench_single(client, receipts):
+    """
+    Posts every receipt through the single-receipt endpoint.
+
+    Returns:
+    - float: The elapsed time in seconds.
+    """
+    start = time.perf_counter()
+    for receipt in receipts:
+        client.post("/receipts/process", json=receipt).raise_for_status()
+    return time.perf_counter() - start
+
+
+def bench_batch(client, receipts, batch_size):
+    """
+    Posts the receipts through the batch endpoint in chunks of batch_size.
+
+    Returns:
+    - float: The elapsed time in seconds.
+    """
+    start = time.perf_counter()
+    for i in range(0, len(receipts), batch_size):
+        res = client.post("/receipts/process/batch",
+                          json=receipts[i:i + batch_size])
+        res.raise_for_status()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args()
+
+    receipts = make_receipts(args.count)
+    client = TestClient(app)
+
+    db.uuid_dict.clear()
+    single = bench_single(client, receipts)
+    db.uuid_dict.clear()
+    batch = bench_batch(client, receipts, args.batch_size)
+
+    print(f"single: {rate(args.count, single)}")
+    print(f"batch ({args.batch_size}/request): {rate(args.count, batch)}")
+    print(f"speedup: {single / batch:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+This script measures the score cache on a replay-heavy workload.
+
+The workload replays the example/ receipts, a pool of synthetic receipts
+and, optionally, the receipts in a JSON Lines file, drawing most requests
+from a small set of popular receipts as POS retries do.
+
+Usage:
+    python -m bench.cache [--requests N] [--unique N] [--replay FILE]
+
+"""
+
+import argparse
+import json
+import random
+import time
+
+from app import main as api
+from app.cache import ScoreCache
+from app.models import Receipt
+from bench.common import load_examples, make_receipts, rate
+
+
+def make_workload(requests, unique, replay=None, seed=0):
+    """
+    Builds the list of receipts to post, with repeats.
+
+    Parameters:
+    - requests (int): The number of receipts to post.
+    - unique (int): The number of distinct synthetic receipts.
+    - replay (str): An optional JSON Lines file of extra receipts.
+    - seed (int): The random seed.
+
+    Returns:
+    - list: The receipt dictionaries, in posting order.
+    """
+    pool = load_examples() + make_receipts(unique, seed)
+    if replay:
+        with open(replay) as f:
+            pool += [json.loads(line) for line in f if line.strip()]
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(pool))]
+    return rng.choices(pool, weights=weights, k=requests)
+
+
+def run(workload, cache):
+    """
+    Validates, scores and stores every receipt through get_receipt_id.
+
+    Returns:
+    - float: The elapsed time in seconds.
+    """
+    api.score_cache = cache
+    start = time.perf_counter()
+    for data in workload:
+        api.get_receipt_id(Receipt.model_validate(data))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--unique", type=int, default=2000)
+    parser.add_argument("--cache-size", type=int, default=1000)
+    parser.add_argument("--replay", default=None)
+    args = parser.parse_args()
+
+    workload = make_workload(args.requests, args.unique, args.replay)
+    uncached = run(workload, ScoreCache(0))
+    cache = ScoreCache(args.cache_size)
+    cached = run(workload, cache)
+
+    print(f"without cache: {rate(len(workload), uncached)}")
+    print(f"with cache: {rate(len(workload), cached)}")
+    stats = cache.stats()
+    print(f"hits: {stats['hits']}, misses: {stats['misses']}, "
+          f"evictions: {stats['evictions']}, "
+          f"hit rate: {stats['hits'] / len(workload):.1%}")
+
+
+if __name__ == "__main__":
+    main()
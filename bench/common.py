@@ -0,0 +1,119 @@
+"""
+This module contains helpers shared by the benchmark scripts.
+
+Functions:
+- load_examples(): Loads the receipts in the example/ directory.
+- make_receipts(count, seed): Generates synthetic receipt dictionaries based
+  on the example receipts.
+- rate(count, seconds): Formats a throughput figure.
+- serve(port, workers, **env): Runs the API under uvicorn for the duration
+  of a with block.
+
+"""
+
+import contextlib
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+
+import httpx
+
+
+EXAMPLE_DIR = Path(__file__).resolve().parent.parent / "example"
+
+
+def load_examples():
+    """
+    Loads the receipts in the example/ directory.
+
+    Returns:
+    - list: The example receipts as dictionaries.
+    """
+    return [json.loads(p.read_text())
+            for p in sorted(EXAMPLE_DIR.glob("*.json"))]
+
+
+def make_receipts(count, seed=0):
+    """
+    Generates synthetic receipt dictionaries based on the example receipts.
+
+    The retailer, date, time, total and item prices are varied so that every
+    scoring rule is exercised.
+
+    Parameters:
+    - count (int): The number of receipts to generate.
+    - seed (int): The random seed.
+
+    Returns:
+    - list: The generated receipts as dictionaries.
+    """
+    rng = random.Random(seed)
+    examples = load_examples()
+    receipts = []
+    for i in range(count):
+        base = examples[i % len(examples)]
+        items = [dict(item, price=f"{rng.randint(1, 5000) / 100:.2f}")
+                 for item in base["items"]]
+        receipts.append({
+            "retailer": f"{base['retailer']} {rng.randint(0, 999)}",
+            "purchaseDate": f"2023-{rng.randint(1, 12):02d}-"
+                            f"{rng.randint(1, 28):02d}",
+            "purchaseTime": f"{rng.randint(0, 23):02d}:"
+                            f"{rng.randint(0, 59):02d}",
+            "total": f"{rng.randint(1, 40000) / 100:.2f}",
+            "items": items,
+        })
+    return receipts
+
+
+def rate(count, seconds):
+    """
+    Formats a throughput figure.
+
+    Parameters:
+    - count (int): The number of receipts processed.
+    - seconds (float): The elapsed time.
+
+    Returns:
+    - str: The throughput in receipts per second.
+    """
+    return f"{count / seconds:,.0f} receipts/sec"
+
+
+@contextlib.contextmanager
+def serve(port, workers=1, **env):
+    """
+    Runs the API under uvicorn for the duration of a with block.
+
+    Parameters:
+    - port (int): The port to listen on.
+    - workers (int): The number of uvicorn worker processes, passed in
+      WEB_CONCURRENCY so that the API can check its store supports them.
+    - **env: Extra environment variables, e.g. RECEIPT_STORE_URL.
+
+    Yields:
+    - subprocess.Popen: The uvicorn process, once it answers requests.
+    """
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app",
+         "--port", str(port), "--log-level", "warning"],
+        env=dict(os.environ, WEB_CONCURRENCY=str(workers), **env))
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                httpx.get(f"http://127.0.0.1:{port}/receipts/x/points")
+                break
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("The server did not start.")
+                time.sleep(0.2)
+        yield server
+    finally:
+        server.terminate()
+        server.wait()
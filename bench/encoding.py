@@ -0,0 +1,133 @@
+"""
+This script compares JSON and MessagePack bodies on the receipt endpoints.
+
+For POST /receipts/process and GET /receipts/{id}/points it reports the
+mean size of the request and response bodies, and the CPU time per request
+through the ASGI app (no HTTP client or server), once with JSON bodies and
+once with MessagePack ones (Content-Type and Accept application/msgpack).
+The CPU time covers the whole request: routing, decoding, validation,
+scoring, storage and encoding. Every format is timed over several rounds
+of fresh receipts, going first in every other round, and the fastest
+round is kept. JSON bodies are sent without spaces.
+
+The default and the fast I/O (RECEIPT_FAST_IO) modes each run in their own
+process, since the mode is read at import.
+
+Usage:
+    python -m bench.encoding [--requests N] [--rounds N]
+
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import msgpack
+
+from bench.common import make_receipts
+from bench.fastio import call
+
+
+MSGPACK = b"application/msgpack"
+FORMATS = {
+    "JSON": (b"application/json",
+             lambda data: json.dumps(data, separators=(",", ":")).encode(),
+             json.loads),
+    "MessagePack": (MSGPACK, msgpack.packb, msgpack.unpackb),
+}
+
+
+async def measure(app, requests, rounds):
+    """
+    Posts and reads receipts in every format.
+
+    Returns:
+    - dict: For every format, the mean body sizes in bytes and the least
+      CPU time per request of any round, in microseconds.
+    """
+    results = {name: {"post_cpu": float("inf"), "get_cpu": float("inf")}
+               for name in FORMATS}
+    for round in range(rounds):
+        receipts = make_receipts(requests, seed=round)
+        names = list(FORMATS)
+        if round % 2:
+            names.reverse()
+        for name in names:
+            media_type, encode, decode = FORMATS[name]
+            bodies = [encode(data) for data in receipts]
+            headers = [(b"accept", media_type)]
+            responses = []
+            start = time.process_time()
+            for body in bodies:
+                responses.append(await call(
+                    app, "POST", "/receipts/process", body, headers,
+                    content_type=media_type))
+            post_cpu = time.process_time() - start
+
+            ids = [decode(response)["id"] for response in responses]
+            points = []
+            start = time.process_time()
+            for id in ids:
+                points.append(await call(
+                    app, "GET", f"/receipts/{id}/points", b"", headers))
+            get_cpu = time.process_time() - start
+            decode(points[0])
+
+            result = results[name]
+            result["post_cpu"] = min(result["post_cpu"],
+                                     post_cpu / requests * 1e6)
+            result["get_cpu"] = min(result["get_cpu"],
+                                    get_cpu / requests * 1e6)
+            result["post_request"] = statistics.mean(map(len, bodies))
+            result["post_response"] = statistics.mean(map(len, responses))
+            result["get_response"] = statistics.mean(map(len, points))
+    return results
+
+
+def worker(requests, rounds):
+    """
+    Measures the mode of this process and prints the results as JSON.
+    """
+    from app.main import app
+    from app.metrics import rule_metrics
+
+    rule_metrics.enabled = False
+    print(json.dumps(asyncio.run(measure(app, requests, rounds))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=4)
+    parser.add_argument("--worker", action="store_true",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.requests, args.rounds)
+        return
+
+    for fast in ("0", "1"):
+        output = subprocess.run(
+            [sys.executable, "-m", "bench.encoding", "--worker",
+             "--requests", str(args.requests),
+             "--rounds", str(args.rounds)],
+            env=dict(os.environ, RECEIPT_FAST_IO=fast),
+            check=True, capture_output=True, text=True).stdout
+        results = json.loads(output)
+        print("fast I/O" if fast == "1" else "default")
+        print(f"  {'':12s} {'POST body':>10s} {'POST resp':>10s} "
+              f"{'GET resp':>10s} {'POST CPU':>10s} {'GET CPU':>10s}")
+        for name, result in results.items():
+            print(f"  {name:12s} {result['post_request']:8.0f} B "
+                  f"{result['post_response']:8.0f} B "
+                  f"{result['get_response']:8.0f} B "
+                  f"{result['post_cpu']:7.1f} us {result['get_cpu']:7.1f} us")
+
+
+if __name__ == "__main__":
+    main()
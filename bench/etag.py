@@ -0,0 +1,76 @@
+"""
+This script measures repeat reads of GET /receipts/{id}/points with and
+without conditional requests.
+
+Clients that keep the ETag of a response and send it back in If-None-Match
+get 304 Not Modified with no body. For a workload reading every receipt
+several times it reports the time per request through the ASGI app and
+the response body bytes transferred, with unconditional and with
+conditional repeat reads.
+
+Usage:
+    python -m bench.etag [--receipts N] [--reads N]
+
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from app.main import app
+from app.metrics import rule_metrics
+from bench.common import make_receipts
+from bench.fastio import call
+
+
+async def read(ids, reads, conditional):
+    """
+    Reads every receipt reads times, keeping the first ETag of each when
+    conditional is set.
+
+    Returns:
+    - tuple: The seconds taken and the body bytes received.
+    """
+    etags = {}
+    received = 0
+    start = time.perf_counter()
+    for _ in range(reads):
+        for id in ids:
+            headers = ()
+            if id in etags:
+                headers = ((b"if-none-match", etags[id]),)
+            status, response_headers, body = await call(
+                app, "GET", f"/receipts/{id}/points", headers=headers,
+                response=True)
+            if conditional and status == 200:
+                etags[id] = response_headers[b"etag"]
+            received += len(body)
+    return time.perf_counter() - start, received
+
+
+async def run(receipts, reads):
+    ids = []
+    for data in make_receipts(receipts):
+        body = await call(app, "POST", "/receipts/process",
+                          json.dumps(data).encode())
+        ids.append(json.loads(body)["id"])
+    requests = receipts * reads
+    for conditional in (False, True):
+        elapsed, received = await read(ids, reads, conditional)
+        print(f"{'If-None-Match' if conditional else 'unconditional':14s}"
+              f"{elapsed / requests * 1e6:8.1f} us/request, "
+              f"{received / requests:6.1f} body bytes/request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--receipts", type=int, default=1000)
+    parser.add_argument("--reads", type=int, default=10)
+    args = parser.parse_args()
+    rule_metrics.enabled = False
+    asyncio.run(run(args.receipts, args.reads))
+
+
+if __name__ == "__main__":
+    main()
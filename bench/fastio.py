@@ -0,0 +1,175 @@
+"""
+This script compares the default and the fast I/O (RECEIPT_FAST_IO) modes.
+
+For POST /receipts/process and GET /receipts/{id}/points it reports the
+time per request through the ASGI app (no HTTP client or server), and the
+share of that time spent parsing request bodies and serializing responses,
+measured with cProfile:
+
+- parsing: json.loads/orjson.loads and the validation of the body
+  (FastAPI's request_body_to_args, or Receipt.model_validate).
+- serializing: jsonable_encoder (serialize_response), response rendering
+  (json.dumps/orjson.dumps) and breakdown rendering, including the
+  breakdown and response serialized at POST time in the fast mode.
+
+Each mode runs in its own process, since the mode is read at import.
+
+Usage:
+    python -m bench.fastio [--requests N]
+
+"""
+
+import argparse
+import asyncio
+import cProfile
+import json
+import os
+import pstats
+import subprocess
+import sys
+import time
+
+from bench.common import make_receipts
+
+
+PARSE = [("json/__init__.py", "loads"),
+         ("~", "<built-in method orjson.loads>"),
+         ("fastapi/dependencies/utils.py", "request_body_to_args"),
+         ("pydantic/main.py", "model_validate")]
+
+SERIALIZE = [("fastapi/routing.py", "serialize_response"),
+             ("starlette/responses.py", "render"),
+             ("fastapi/responses.py", "render"),
+             ("app/utils.py", "render_breakdown")]
+
+
+async def call(app, method, path, body=b"", headers=(), response=False,
+               content_type=b"application/json"):
+    """
+    Sends one request straight to an ASGI app.
+
+    Parameters:
+    - headers (iterable): Extra (name, value) byte string pairs.
+    - response (bool): Whether to return the status and headers as well.
+    - content_type (bytes): The Content-Type header of the body.
+
+    Returns:
+    - bytes: The response body, or a (status, headers, body) tuple.
+    """
+    scope = {"type": "http", "asgi": {"version": "3.0"},
+             "http_version": "1.1", "method": method, "scheme": "http",
+             "path": path, "raw_path": path.encode(), "query_string": b"",
+             "root_path": "", "client": ("127.0.0.1", 1),
+             "server": ("bench", 80),
+             "headers": [(b"content-type", content_type),
+                         (b"content-length", str(len(body)).encode()),
+                         *headers]}
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    chunks = []
+    start = {}
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            start.update(message)
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    if response:
+        return start["status"], dict(start["headers"]), b"".join(chunks)
+    return b"".join(chunks)
+
+
+def seconds(stats, functions):
+    """
+    Sums the cumulative time of the matching functions in a profile.
+    Time spent in orjson.dumps when called by new_record (pre-serializing
+    the points response) is added to the serialization functions.
+    """
+    total = 0.0
+    for (filename, _, name), (_, _, _, cumulative, callers) in \
+            stats.stats.items():
+        if any(filename.endswith(suffix) and name == match
+               for suffix, match in functions):
+            total += cumulative
+        if functions is SERIALIZE and name == "<built-in method orjson.dumps>":
+            total += sum(timing[3] for caller, timing in callers.items()
+                         if caller[2] == "new_record")
+    return total
+
+
+def worker(requests):
+    """
+    Measures the mode of this process and prints the results as JSON.
+    """
+    from app.main import app
+    from app.metrics import rule_metrics
+
+    rule_metrics.enabled = False
+    bodies = [json.dumps(data).encode() for data in make_receipts(requests)]
+    loop = asyncio.new_event_loop()
+
+    async def posts():
+        return [json.loads(await call(app, "POST", "/receipts/process",
+                                      body))["id"] for body in bodies]
+
+    async def gets(ids):
+        for id in ids:
+            await call(app, "GET", f"/receipts/{id}/points")
+
+    results = {}
+    for name, run in (("post", posts), ("get", None)):
+        start = time.perf_counter()
+        if run is not None:
+            ids = loop.run_until_complete(run())
+        else:
+            loop.run_until_complete(gets(ids))
+        elapsed = time.perf_counter() - start
+
+        profile = cProfile.Profile()
+        profile.enable()
+        if run is not None:
+            loop.run_until_complete(run())
+        else:
+            loop.run_until_complete(gets(ids))
+        profile.disable()
+        stats = pstats.Stats(profile)
+        results[name] = {
+            "us": elapsed / requests * 1e6,
+            "parse": seconds(stats, PARSE) / stats.total_tt,
+            "serialize": seconds(stats, SERIALIZE) / stats.total_tt,
+        }
+    print(json.dumps(results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--worker", action="store_true",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.requests)
+        return
+
+    for fast in ("0", "1"):
+        output = subprocess.run(
+            [sys.executable, "-m", "bench.fastio", "--worker",
+             "--requests", str(args.requests)],
+            env=dict(os.environ, RECEIPT_FAST_IO=fast),
+            check=True, capture_output=True, text=True).stdout
+        results = json.loads(output)
+        print("fast I/O" if fast == "1" else "default")
+        for name, result in results.items():
+            print(f"  {name.upper():4s} {result['us']:6.1f} us/request, "
+                  f"parsing {result['parse']:.0%}, "
+                  f"serializing {result['serialize']:.0%}")
+
+
+if __name__ == "__main__":
+    main()
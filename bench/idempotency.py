@@ -0,0 +1,70 @@
+"""
+This script replays a retry storm against POST /receipts/process with and
+without Idempotency-Key headers.
+
+Every receipt is posted several times, as by a client retrying after
+timeouts. Without a key each attempt is stored as a new receipt; with one,
+the retries get the first ID back. It reports the time per request through
+the ASGI app, the receipts stored and the receipts scored (calls to
+build_record, whether or not the score cache answered them) for both.
+
+Usage:
+    python -m bench.idempotency [--receipts N] [--attempts N]
+
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from app.main import app
+from app.metrics import SCORE_SECONDS, rule_metrics
+from bench.common import make_receipts
+from bench.fastio import call
+from db import db
+
+
+async def storm(bodies, attempts, keyed):
+    """
+    Posts every body attempts times.
+
+    Returns:
+    - tuple: The seconds taken, the receipts stored and the receipts
+      scored.
+    """
+    stored = len(db.store)
+    scored = SCORE_SECONDS.count()
+    start = time.perf_counter()
+    for attempt in range(attempts):
+        for i, body in enumerate(bodies):
+            headers = ()
+            if keyed:
+                headers = ((b"idempotency-key", f"storm-{i}".encode()),)
+            await call(app, "POST", "/receipts/process", body, headers)
+    elapsed = time.perf_counter() - start
+    return (elapsed, len(db.store) - stored,
+            SCORE_SECONDS.count() - scored)
+
+
+async def run(receipts, attempts):
+    bodies = [json.dumps(data).encode() for data in make_receipts(receipts)]
+    requests = receipts * attempts
+    for keyed in (False, True):
+        elapsed, stored, scored = await storm(bodies, attempts, keyed)
+        print(f"{'Idempotency-Key' if keyed else 'no key':16s}"
+              f"{elapsed / requests * 1e6:8.1f} us/request, "
+              f"{stored} stored, {scored} scored")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--receipts", type=int, default=2000)
+    parser.add_argument("--attempts", type=int, default=3)
+    args = parser.parse_args()
+    rule_metrics.enabled = False
+    asyncio.run(run(args.receipts, args.attempts))
+
+
+if __name__ == "__main__":
+    main()
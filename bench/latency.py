@@ -0,0 +1,62 @@
+"""
+This script compares the latency of scoring with and without rendering the
+breakdown text, and of the GET /receipts/{id}/points handler with and
+without the breakdown (?fields=points). Handlers are called directly so
+that HTTP overhead does not hide the difference.
+
+Usage:
+    python -m bench.latency [--count N]
+
+"""
+
+import argparse
+import time
+
+from app.main import get_points, get_receipt_id
+from app.models import Receipt
+from app.utils import render_breakdown, score_record
+from bench.common import make_receipts
+from db.records import ReceiptRecord
+
+
+def per_call(func, args_list):
+    """
+    Calls func once per argument and returns the mean time in microseconds.
+    """
+    start = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    return (time.perf_counter() - start) / len(args_list) * 1e6
+
+
+def score_eagerly(receipt):
+    record = score_record(ReceiptRecord.from_receipt(receipt))
+    render_breakdown(record)
+    return record
+
+
+def score_lazily(receipt):
+    return score_record(ReceiptRecord.from_receipt(receipt))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=5000)
+    args = parser.parse_args()
+
+    receipts = [(Receipt.model_validate(data),)
+                for data in make_receipts(args.count)]
+    print(f"POST scoring, eager breakdown: "
+          f"{per_call(score_eagerly, receipts):.1f} us")
+    print(f"POST scoring, lazy breakdown: "
+          f"{per_call(score_lazily, receipts):.1f} us")
+
+    ids = [get_receipt_id(receipt)["id"] for receipt, in receipts]
+    full = [(id, None) for id in ids]
+    points_only = [(id, "points") for id in ids]
+    print(f"GET full response: {per_call(get_points, full):.1f} us")
+    print(f"GET ?fields=points: {per_call(get_points, points_only):.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+This script compares listing the receipts of a time window through the
+ordered ID index (DictStore.scan, as GET /receipts does) with a full scan
+of the receipt dictionary.
+
+It stores --count receipts with time-ordered IDs, then lists windows
+holding 0.01%, 0.1%, 1% and 10% of them, in pages of 1000 for the index
+and in one pass over every ID, filtered and sorted, for the full scan.
+Each timing is the best of three runs.
+
+Usage:
+    python -m bench.listing [--count N]
+
+"""
+
+import argparse
+import time
+
+from app.utils import generate_receipt_id, receipt_id_bound, receipt_id_time
+from bench.store import make_entries
+from db.stores import DictStore
+
+
+def paged(store, after, before, page=1000):
+    """
+    Lists a window a page at a time, as a client following next_cursor.
+    """
+    ids = []
+    while True:
+        entries = store.scan(after, before, page)
+        ids.extend(receipt_id for receipt_id, _ in entries)
+        if len(entries) < page:
+            return ids
+        after = entries[-1][0]
+
+
+def full_scan(store, after, before):
+    """
+    Lists a window by filtering every stored ID, then sorting them.
+    """
+    return sorted(receipt_id for receipt_id in store.uuid_dict
+                  if after < receipt_id < before)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=2000000)
+    args = parser.parse_args()
+
+    entry = make_entries(1)[0]
+    store = DictStore()
+    start = time.perf_counter()
+    for _ in range(args.count):
+        store.put(generate_receipt_id(True), entry)
+    print(f"stored {args.count} receipts in "
+          f"{time.perf_counter() - start:.1f} s")
+
+    ids = store._ordered
+    for share in (0.0001, 0.001, 0.01, 0.1):
+        first = int(len(ids) * 0.4)
+        last = first + int(len(ids) * share)
+        after = receipt_id_bound(receipt_id_time(ids[first]))
+        before = receipt_id_bound(receipt_id_time(ids[last]))
+        timings = []
+        for list_window in (paged, full_scan):
+            best = float("inf")
+            for _ in range(3):
+                start = time.perf_counter()
+                found = list_window(store, after, before)
+                best = min(best, time.perf_counter() - start)
+            timings.append(best)
+        print(f"{share:7.2%} window ({len(found):7d} receipts): "
+              f"index {timings[0] * 1000:8.2f} ms, "
+              f"full scan {timings[1] * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+This script reports the memory used per stored receipt by the original
+entry format, [Receipt, (points, breakdown)], and by ReceiptRecord.
+
+Usage:
+    python -m bench.memory [--count N]
+
+"""
+
+import argparse
+import tracemalloc
+
+from app.models import Receipt
+from app.utils import score_receipt, score_record
+from bench.common import make_receipts
+from db.records import ReceiptRecord
+
+
+def measure(build, receipts):
+    """
+    Builds one stored entry per receipt and measures the memory they use.
+
+    Parameters:
+    - build (callable): Builds the stored entry for a receipt dictionary.
+    - receipts (list): The receipt dictionaries.
+
+    Returns:
+    - float: The number of bytes per stored receipt.
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = {i: build(data) for i, data in enumerate(receipts)}
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(store)
+
+
+def build_list_entry(data):
+    receipt = Receipt.model_validate(data)
+    return [receipt, score_receipt(receipt)]
+
+
+def build_record(data):
+    return score_record(ReceiptRecord.from_receipt(
+        Receipt.model_validate(data)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=50000)
+    args = parser.parse_args()
+
+    receipts = make_receipts(args.count)
+    before = measure(build_list_entry, receipts)
+    after = measure(build_record, receipts)
+    print(f"[receipt, (points, breakdown)]: {before:,.0f} bytes/receipt")
+    print(f"ReceiptRecord: {after:,.0f} bytes/receipt")
+    print(f"reduction: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
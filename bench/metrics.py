@@ -0,0 +1,53 @@
+"""
+This script measures the overhead of metrics collection by load-testing
+the API under uvicorn with RECEIPT_METRICS_ENABLED off and on.
+
+Usage:
+    python -m bench.metrics [--concurrency N] [--duration SECONDS]
+
+"""
+
+import argparse
+import asyncio
+
+import httpx
+
+from bench.common import make_receipts, serve
+from bench.workers import drive
+
+
+def run(enabled, concurrency, duration, port):
+    """
+    Starts uvicorn with metrics enabled or disabled and load-tests it.
+
+    Returns:
+    - float: The receipts per second.
+    """
+    async def main():
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}",
+                                     limits=limits) as client:
+            return await drive(client, make_receipts(1000),
+                               concurrency, duration)
+
+    with serve(port, RECEIPT_METRICS_ENABLED="1" if enabled else "0"):
+        done, _ = asyncio.run(main())
+    return done / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    off = run(False, args.concurrency, args.duration, args.port)
+    on = run(True, args.concurrency, args.duration, args.port)
+    print(f"metrics off: {off:,.0f} receipts/sec")
+    print(f"metrics on:  {on:,.0f} receipts/sec "
+          f"({(off - on) / off:+.1%} overhead)")
+
+
+if __name__ == "__main__":
+    main()
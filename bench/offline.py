@@ -0,0 +1,43 @@
+"""
+This script measures how offline scoring (app.offline) scales with the
+number of worker processes.
+
+Usage:
+    python -m bench.offline [--count N] [--processes 1 2 4 8]
+
+"""
+
+import argparse
+import json
+import os
+import time
+
+from app.offline import score_receipts
+from bench.common import make_receipts, rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=200000)
+    parser.add_argument("--processes", type=int, nargs="+",
+                        default=[1, 2, 4, 8])
+    parser.add_argument("--chunk-size", type=int, default=500)
+    args = parser.parse_args()
+
+    pool = [json.dumps(receipt) for receipt in make_receipts(5000)]
+    lines = [pool[i % len(pool)] for i in range(args.count)]
+
+    print(f"{os.cpu_count()} CPUs available")
+    baseline = None
+    for processes in args.processes:
+        start = time.perf_counter()
+        for _ in score_receipts(lines, processes, args.chunk_size):
+            pass
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{processes} process(es): {rate(args.count, elapsed)}, "
+              f"speedup {baseline / elapsed:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+This script overloads POST /receipts/process with increasing numbers of
+concurrent clients, with and without admission control, and prints the
+latency curve of accepted requests and the share of requests shed.
+
+Without a cap every request is accepted and waits its turn, so latency
+grows with concurrency. With RECEIPT_ADMISSION_MAX_IN_FLIGHT, requests
+over the cap get an immediate 503 and the accepted ones keep a bounded
+p99.
+
+Usage:
+    python -m bench.overload [--levels 8 32 128 256] [--max-in-flight N]
+                             [--duration SECONDS]
+
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from bench.common import make_receipts, serve
+
+
+async def drive(port, concurrency, duration):
+    """
+    Posts receipts from concurrency clients for duration seconds.
+
+    Returns:
+    - dict: The p50/p99 latency in milliseconds of accepted requests, the
+      accepted requests per second and the fraction rejected.
+    """
+    receipts = make_receipts(1000)
+    accepted = []
+    rejected = 0
+    deadline = time.monotonic() + duration
+
+    async def worker(client, offset):
+        nonlocal rejected
+        i = offset
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            res = await client.post("/receipts/process",
+                                    json=receipts[i % len(receipts)])
+            if res.status_code == 200:
+                accepted.append(time.perf_counter() - start)
+            elif res.status_code in (429, 503):
+                rejected += 1
+            else:
+                res.raise_for_status()
+            i += concurrency
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}",
+                                 limits=limits, timeout=60) as client:
+        await asyncio.gather(*(worker(client, i)
+                               for i in range(concurrency)))
+    cuts = statistics.quantiles(accepted, n=100)
+    return {"p50_ms": cuts[49] * 1e3, "p99_ms": cuts[98] * 1e3,
+            "rps": len(accepted) / duration,
+            "rejected": rejected / (rejected + len(accepted))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--levels", type=int, nargs="+",
+                        default=[8, 32, 128, 256])
+    parser.add_argument("--max-in-flight", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    for cap in (0, args.max_in_flight):
+        print(f"max in flight: {cap or 'unlimited'}")
+        with serve(args.port, RECEIPT_ADMISSION_MAX_IN_FLIGHT=str(cap)):
+            for concurrency in args.levels:
+                result = asyncio.run(
+                    drive(args.port, concurrency, args.duration))
+                print(f"  {concurrency:4d} clients: "
+                      f"p50 {result['p50_ms']:7.2f} ms, "
+                      f"p99 {result['p99_ms']:7.2f} ms, "
+                      f"{result['rps']:6,.0f} accepted/sec, "
+                      f"{result['rejected']:.0%} rejected")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+This script compares POST /receipts/process latency when receipts are
+scored before the ID is returned and when they are queued for background
+scoring (RECEIPT_PIPELINE_ENABLED), and how long the queued receipts take
+to become readable.
+
+Usage:
+    python -m bench.pipeline [--requests N] [--concurrency N]
+
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from bench.common import make_receipts, serve
+from bench.suite import load
+
+
+async def drive(port, requests, concurrency):
+    """
+    Posts receipts, then waits until the last one can be read.
+
+    Returns:
+    - tuple: The POST load results and the seconds between the last POST
+      and its receipt becoming readable.
+    """
+    receipts = make_receipts(1000)
+    ids = []
+
+    async def post(client, i):
+        res = await client.post("/receipts/process",
+                                json=receipts[i % len(receipts)])
+        ids.append(res.json()["id"])
+        return res
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}",
+                                 limits=limits) as client:
+        results = await load(client, post, requests, concurrency)
+        start = time.perf_counter()
+        while (await client.get(f"/receipts/{ids[-1]}/points")
+               ).status_code == 202:
+            await asyncio.sleep(0.001)
+        return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    for enabled in (False, True):
+        with serve(args.port,
+                   RECEIPT_PIPELINE_ENABLED="1" if enabled else "0"):
+            results, lag = asyncio.run(
+                drive(args.port, args.requests, args.concurrency))
+        label = "queued" if enabled else "inline"
+        print(f"{label}: p50 {results['p50_ms']:.2f} ms, "
+              f"p99 {results['p99_ms']:.2f} ms, "
+              f"{results['rps']:,.0f} POSTs/sec, "
+              f"scored {lag * 1e3:.1f} ms after the last POST")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+This script measures the background re-scoring job started when the rule
+set changes.
+
+It stores --count receipts scored by the built-in rules, activates a rule
+set with different points, and runs a Rescorer over the store, first
+unthrottled and then at --rate records per second. For each run it
+reports the job's throughput (records scanned per second of work and of
+wall time) and the time per live scoring call made meanwhile on the main
+thread, against the same calls with no job running.
+
+Usage:
+    python -m bench.rescore [--count N] [--rate N] [--chunk-size N]
+
+"""
+
+import argparse
+import time
+
+from app.metrics import rule_metrics
+from app.models import Receipt
+from app.rescoring import Rescorer
+from app.rules import DEFAULT_RULES, RuleSet, activate, get_rule_set
+from app.utils import generate_receipt_id, score_record
+from bench.common import make_receipts
+from db.records import ReceiptRecord
+from db.stores import DictStore
+
+
+def rescore(record):
+    """
+    Re-scores a copy of a record with the active rule set, as the API
+    does.
+    """
+    rule_set = get_rule_set()
+    if record.version == rule_set.version:
+        return None
+    return score_record(record.copy(), rule_set)
+
+
+def live_scoring(records, until):
+    """
+    Scores records on this thread until until() is true.
+
+    Returns:
+    - float: The microseconds per scoring call.
+    """
+    calls = 0
+    start = time.perf_counter()
+    while not until():
+        score_record(records[calls % len(records)].copy())
+        calls += 1
+    return (time.perf_counter() - start) / max(calls, 1) * 1e6
+
+
+def run(store, version, rate, chunk_size, records):
+    """
+    Runs one re-scoring job to the end while scoring live records.
+    """
+    rescorer = Rescorer(store.chunks, rescore, store.put_many,
+                        chunk_size=chunk_size, rate=rate)
+    activate(RuleSet({**DEFAULT_RULES, "version": version,
+                      "rules": [{"kind": "round_total", "points": 100},
+                                *DEFAULT_RULES["rules"][2:]]}))
+    rescorer.start(version)
+    live = live_scoring(records,
+                        lambda: rescorer.status()["state"] != "running")
+    status = rescorer.status()
+    rescorer.close()
+    wall = status["finished"] - status["started"]
+    label = f"rate {rate:.0f}/s" if rate else "unthrottled"
+    print(f"{label:16s} {status['rescored']} re-scored, "
+          f"{status['records_per_second']:9.0f} records/s of work, "
+          f"{status['scanned'] / wall:9.0f} records/s wall, "
+          f"live scoring {live:5.1f} us/call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=200000)
+    parser.add_argument("--rate", type=float, default=20000)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    args = parser.parse_args()
+    rule_metrics.enabled = False
+
+    records = [ReceiptRecord.from_receipt(Receipt.model_validate(data))
+               for data in make_receipts(1000)]
+    store = DictStore()
+    for i in range(args.count):
+        store.put(generate_receipt_id(),
+                  score_record(records[i % len(records)].copy()))
+
+    deadline = time.perf_counter() + 1
+    idle = live_scoring(records, lambda: time.perf_counter() > deadline)
+    print(f"{'no job':16s} live scoring {idle:5.1f} us/call")
+    run(store, 2, 0, args.chunk_size, records)
+    run(store, 3, args.rate, args.chunk_size, records)
+
+
+if __name__ == "__main__":
+    main()
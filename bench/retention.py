@@ -0,0 +1,144 @@
+"""
+This script measures the retention policy of the in-memory store and its
+compressed cold tier.
+
+It stores --receipts receipts through POST /receipts/process, once with
+no retention and once keeping only --memory-entries of them in memory and
+moving the rest to a cold tier (RECEIPT_RETENTION_MAX_ENTRIES and
+RECEIPT_RETENTION_COLD_PATH). For each it reports the POST latency, which
+includes the incremental eviction, the resident memory of the process,
+and the p50/p95/p99 latency of GET /receipts/{id}/points for receipts read
+from memory (hot) and from the cold tier (cold), through the ASGI app.
+It also reports the size of the cold tier per receipt.
+
+Each configuration runs in its own process, since the settings are read
+at import.
+
+Usage:
+    python -m bench.retention [--receipts N] [--memory-entries N]
+        [--reads N]
+
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.common import make_receipts
+from bench.fastio import call
+
+
+def percentiles(seconds):
+    """
+    Returns the p50, p95 and p99 of a list of durations, in microseconds.
+    """
+    cuts = statistics.quantiles(seconds, n=100)
+    return {"p50": cuts[49] * 1e6, "p95": cuts[94] * 1e6,
+            "p99": cuts[98] * 1e6}
+
+
+async def measure(app, store, receipts, reads):
+    """
+    Stores the receipts, then reads a sample of the hot and cold ones.
+
+    Returns:
+    - dict: The POST and GET latency percentiles.
+    """
+    ids = []
+    posts = []
+    for data in make_receipts(receipts):
+        body = json.dumps(data).encode()
+        start = time.perf_counter()
+        response = await call(app, "POST", "/receipts/process", body)
+        posts.append(time.perf_counter() - start)
+        ids.append(json.loads(response)["id"])
+    store.flush()
+
+    results = {"post": percentiles(posts)}
+    hot = [id for id in ids if id in store.uuid_dict]
+    cold = [id for id in ids if id not in store.uuid_dict]
+    rng = random.Random(0)
+    for name, tier in (("hot", hot), ("cold", cold)):
+        if not tier:
+            continue
+        gets = []
+        for id in rng.choices(tier, k=reads):
+            start = time.perf_counter()
+            await call(app, "GET", f"/receipts/{id}/points")
+            gets.append(time.perf_counter() - start)
+        results[name] = percentiles(gets)
+    if cold:
+        path = os.environ["RECEIPT_RETENTION_COLD_PATH"]
+        results["cold_bytes"] = os.path.getsize(path) / len(cold)
+    return results
+
+
+def worker(receipts, reads):
+    """
+    Measures the configuration of this process and prints the results as
+    JSON.
+    """
+    from app.main import app
+    from app.metrics import process_memory_bytes, rule_metrics
+    from db import db
+
+    rule_metrics.enabled = False
+    # One event loop run for every request, so that the handler threads
+    # and their SQLite connections are reused, as under a server.
+    results = asyncio.run(measure(app, db.store, receipts, reads))
+    results["rss"] = process_memory_bytes() / 2 ** 20
+    print(json.dumps(results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--receipts", type=int, default=100000)
+    parser.add_argument("--memory-entries", type=int, default=10000)
+    parser.add_argument("--reads", type=int, default=5000)
+    parser.add_argument("--worker", action="store_true",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.receipts, args.reads)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        configurations = [
+            ("no retention", {}),
+            (f"{args.memory_entries} in memory, rest cold", {
+                "RECEIPT_RETENTION_MAX_ENTRIES": str(args.memory_entries),
+                "RECEIPT_RETENTION_COLD_PATH":
+                    os.path.join(directory, "cold.db"),
+            }),
+        ]
+        for name, env in configurations:
+            output = subprocess.run(
+                [sys.executable, "-m", "bench.retention", "--worker",
+                 "--receipts", str(args.receipts),
+                 "--reads", str(args.reads)],
+                env=dict(os.environ, **env),
+                check=True, capture_output=True, text=True).stdout
+            results = json.loads(output)
+            line = f"{name}: RSS {results['rss']:.0f} MiB"
+            if "cold_bytes" in results:
+                line += (f", cold tier {results['cold_bytes']:.0f} "
+                         f"bytes/receipt")
+            print(line)
+            for label, key in (("POST", "post"), ("GET hot", "hot"),
+                               ("GET cold", "cold")):
+                if key in results:
+                    cuts = results[key]
+                    print(f"  {label:8s} p50 {cuts['p50']:7.1f} us, "
+                          f"p95 {cuts['p95']:7.1f} us, "
+                          f"p99 {cuts['p99']:7.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+This script measures snapshots of the in-memory store (RECEIPT_SNAPSHOT_PATH).
+
+For each receipt count it fills a store, writes a snapshot and reports the
+time taken and the file size. It then starts the API in a new process with
+the snapshot, as a restarted pod would, and reports:
+
+- startup: the time to import the API, which opens the snapshot.
+- first request: the time until the first GET /receipts/{id}/points is
+  answered, from the start of the import.
+- loaded: the time until every receipt is loaded into the dictionary.
+- GET during load: the mean time per GET while the load runs.
+
+It also estimates the time a restart would take if every receipt were
+validated and scored again instead, from the rate of doing so for 10000
+receipts. The records share a pool of distinct receipts while the store is
+filled, but the restarted process builds one record per receipt, so the
+largest counts need several GB of memory.
+
+Usage:
+    python -m bench.snapshot [--counts N [N ...]] [--path FILE]
+
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from app.models import Receipt
+from app.utils import generate_receipt_id
+from bench.common import make_receipts
+from bench.fastio import call
+from db.snapshot import write_snapshot
+from db.stores import DictStore
+
+
+def worker(path, ids):
+    """
+    Restarts the API on a snapshot in this process and prints the timings
+    as JSON.
+    """
+    start = time.perf_counter()
+    from app.main import app
+    from db import db
+
+    startup = time.perf_counter() - start
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(call(app, "GET", f"/receipts/{ids[0]}/points"))
+    first = time.perf_counter() - start
+    requests = 0
+    request_seconds = 0.0
+    while not db.store.wait_loaded(0):
+        request_start = time.perf_counter()
+        loop.run_until_complete(
+            call(app, "GET", f"/receipts/{ids[requests % len(ids)]}/points"))
+        request_seconds += time.perf_counter() - request_start
+        requests += 1
+        # Leave the loader most of the time, as a lightly loaded pod would.
+        time.sleep(0.01)
+    loaded = time.perf_counter() - start
+    print(json.dumps({"startup": startup, "first": first, "loaded": loaded,
+                      "get_us": request_seconds / max(requests, 1) * 1e6,
+                      "requests": requests}))
+
+
+def replay_seconds(receipts, count):
+    """
+    Estimates the time to validate and score count receipts again.
+    """
+    from app.main import new_record
+
+    start = time.perf_counter()
+    for data in receipts:
+        new_record(Receipt.model_validate(data))
+    return (time.perf_counter() - start) / len(receipts) * count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--counts", type=int, nargs="+",
+                        default=[1000000, 5000000, 10000000])
+    parser.add_argument("--path", default="bench_snapshot.snap")
+    parser.add_argument("--worker", action="store_true",
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--ids", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.path, json.loads(args.ids))
+        return
+
+    from app.main import new_record
+    from app.metrics import rule_metrics
+
+    rule_metrics.enabled = False
+    receipts = make_receipts(10000)
+    records = [new_record(Receipt.model_validate(data))
+               for data in receipts[:1000]]
+    for count in args.counts:
+        store = DictStore()
+        for i in range(count):
+            store.put(generate_receipt_id(), records[i % len(records)])
+        ids = random.Random(0).sample(list(store.uuid_dict), 1000)
+        result = write_snapshot(args.path, store)
+        del store
+        print(f"{count} receipts: snapshot written in "
+              f"{result['seconds']:.1f} s, {result['bytes'] / 2 ** 20:.0f} "
+              f"MiB ({result['bytes'] / count:.0f} bytes/receipt)")
+
+        output = subprocess.run(
+            [sys.executable, "-m", "bench.snapshot", "--worker",
+             "--path", args.path, "--ids", json.dumps(ids)],
+            env=dict(os.environ, RECEIPT_SNAPSHOT_PATH=args.path,
+                     RECEIPT_SNAPSHOT_INTERVAL="0"),
+            check=True, capture_output=True, text=True).stdout
+        timings = json.loads(output)
+        print(f"  startup {timings['startup']:.2f} s, first request "
+              f"{timings['first']:.2f} s, loaded {timings['loaded']:.1f} s, "
+              f"GET during load {timings['get_us']:.0f} us "
+              f"({timings['requests']} requests)")
+        print(f"  replaying instead: ~"
+              f"{replay_seconds(receipts, count):.0f} s (estimated)")
+    os.remove(args.path)
+
+
+if __name__ == "__main__":
+    main()
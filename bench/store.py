@@ -0,0 +1,91 @@
+"""
+This script measures write throughput, point-lookup throughput and
+recovery time of the receipt store backends.
+
+Usage:
+    python -m bench.store [--count N] [--path FILE]
+
+Run with --count 1000000 and --count 10000000 for the full-size figures.
+
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from app.models import Receipt
+from app.utils import generate_receipt_id, score_record
+from bench.common import make_receipts, rate
+from db.records import ReceiptRecord
+from db.stores import DictStore, SQLiteStore
+
+
+def make_entries(pool_size=1000):
+    """
+    Builds a pool of scored records that the benchmark cycles through.
+    """
+    return [score_record(ReceiptRecord.from_receipt(
+                Receipt.model_validate(data)))
+            for data in make_receipts(pool_size)]
+
+
+def bench_writes(store, entries, count):
+    """
+    Writes count entries one at a time, as the API does.
+
+    Returns:
+    - tuple: The written receipt IDs and the elapsed time in seconds.
+    """
+    ids = []
+    start = time.perf_counter()
+    for i in range(count):
+        receipt_id = generate_receipt_id()
+        store.put(receipt_id, entries[i % len(entries)])
+        ids.append(receipt_id)
+    store.flush()
+    return ids, time.perf_counter() - start
+
+
+def bench_lookups(store, ids, lookups=100000):
+    """
+    Looks up random stored IDs.
+
+    Returns:
+    - float: The elapsed time in seconds.
+    """
+    sample = random.Random(0).choices(ids, k=lookups)
+    start = time.perf_counter()
+    for receipt_id in sample:
+        store.get(receipt_id)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--path", default=None,
+                        help="SQLite database file (default: a temp file)")
+    args = parser.parse_args()
+
+    entries = make_entries()
+    path = args.path or os.path.join(tempfile.mkdtemp(), "receipts.db")
+
+    for name, store in (("dict", DictStore()), ("sqlite", SQLiteStore(path))):
+        ids, elapsed = bench_writes(store, entries, args.count)
+        print(f"{name} writes: {rate(args.count, elapsed)}")
+        elapsed = bench_lookups(store, ids)
+        print(f"{name} lookups: {rate(100000, elapsed)}")
+        store.close()
+
+    start = time.perf_counter()
+    store = SQLiteStore(path)
+    store.get(ids[-1])
+    print(f"sqlite recovery: {time.perf_counter() - start:.3f}s "
+          f"to first lookup after reopening {args.count:,} receipts")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
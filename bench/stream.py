@@ -0,0 +1,114 @@
+"""
+This script measures the throughput and server memory of the NDJSON
+streaming endpoint (POST /receipts/process/stream) against a uvicorn
+server, uploading a generated stream without building it in memory.
+
+The upload runs in its own thread while the results are read, since a
+client that only reads the response after sending the whole body stalls
+once the socket buffers fill up.
+
+Usage:
+    python -m bench.stream [--count N [N ...]]
+
+The server's peak RSS should stay flat as the stream grows.
+
+"""
+
+import argparse
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from bench.common import make_receipts, rate, serve
+
+
+def ndjson(count, pool):
+    """
+    Yields count NDJSON receipt lines cycled from pool, 1000 per chunk.
+    """
+    lines = [json.dumps(receipt).encode() + b"\n" for receipt in pool]
+    for start in range(0, count, 1000):
+        yield b"".join(lines[i % len(lines)]
+                       for i in range(start, min(start + 1000, count)))
+
+
+def upload(sock, port, chunks):
+    """
+    Sends a chunked POST /receipts/process/stream request on sock.
+    """
+    sock.sendall(b"POST /receipts/process/stream HTTP/1.1\r\n"
+                 b"Host: 127.0.0.1:%d\r\n"
+                 b"Content-Type: application/x-ndjson\r\n"
+                 b"Transfer-Encoding: chunked\r\n\r\n" % port)
+    for chunk in chunks:
+        sock.sendall(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+    sock.sendall(b"0\r\n\r\n")
+
+
+def count_results(reader):
+    """
+    Reads a chunked NDJSON response and counts its result lines.
+    """
+    while reader.readline() not in (b"\r\n", b""):
+        pass
+    received = 0
+    while True:
+        size = int(reader.readline().split(b";")[0], 16)
+        if size == 0:
+            return received
+        received += reader.read(size).count(b"\n")
+        reader.readline()
+
+
+def stream(port, chunks):
+    """
+    Uploads the chunks while counting the result lines as they arrive.
+
+    Returns:
+    - int: The number of result lines received.
+    """
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sender = threading.Thread(target=upload, args=(sock, port, chunks))
+        sender.start()
+        received = count_results(sock.makefile("rb"))
+        sender.join()
+    return received
+
+
+def peak_rss(pid):
+    """
+    Returns the peak resident set size of a process in MiB (Linux only).
+    """
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, nargs="+",
+                        default=[10000, 100000])
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    pool = make_receipts(1000)
+    for count in args.count:
+        # A fresh server per run, with the score cache off and an SQLite
+        # store, so that the RSS reflects streaming rather than storage.
+        path = os.path.join(tempfile.mkdtemp(), "receipts.db")
+        with serve(args.port, RECEIPT_SCORE_CACHE_SIZE="0",
+                   RECEIPT_STORE_URL=f"sqlite:///{path}") as server:
+            start = time.perf_counter()
+            received = stream(args.port, ndjson(count, pool))
+            elapsed = time.perf_counter() - start
+            print(f"{count:,} lines: {rate(received, elapsed)}, "
+                  f"server peak RSS {peak_rss(server.pid):.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()
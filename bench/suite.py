@@ -0,0 +1,240 @@
+"""
+This script runs the benchmark suite: microbenchmarks of the scoring hot
+path and an in-process load test of the API. Results are written to a
+JSON file that later runs can be compared against.
+
+Microbenchmarks (mean time per call, in microseconds):
+- calculate_points, score_record, render_breakdown
+- validate_date, validate_time, convert_time
+- Receipt.model_validate, receipt_key
+- ingest: parsing a receipt from JSON, building its record and scoring it,
+  i.e. the CPU work of a POST apart from HTTP handling
+
+Load test, for POST /receipts/process and GET /receipts/{id}/points at
+each concurrency level: p50/p95/p99 latency in milliseconds and requests
+per second, using httpx against app.main:app in the same process. Every
+POST sends a receipt not sent before, so with the score cache on (the
+default) each one is a miss and is scored; the report's "load_receipts"
+entry records this and the cache size.
+
+Usage:
+    python -m bench.suite [--output FILE] [--compare BASELINE]
+                          [--tolerance FRACTION] [--requests N]
+                          [--concurrency 1 8 32]
+
+With --compare, the run fails if any latency rises, or any throughput
+falls, by more than the tolerance (default 0.2, i.e. 20%).
+
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import time
+
+import httpx
+
+from app.cache import receipt_key
+from app.config import settings
+from app.main import app
+from app.models import Receipt
+from app.utils import (calculate_points, convert_time, render_breakdown,
+                       score_record)
+from app.validation import validate_date, validate_time
+from bench.common import load_examples, make_receipts
+from db.records import ReceiptRecord
+
+
+def micro(func, args_list, repeat=5):
+    """
+    Times func over args_list and returns the best mean time per call, in
+    microseconds, over several repeats.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for args in args_list:
+            func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best / len(args_list) * 1e6
+
+
+def run_micro(count):
+    """
+    Runs the microbenchmarks.
+
+    Returns:
+    - dict: The time per call of each benchmark, in microseconds.
+    """
+    receipts = load_examples() + make_receipts(count)
+    models = [Receipt.model_validate(data) for data in receipts]
+    records = [score_record(ReceiptRecord.from_receipt(receipt))
+               for receipt in models]
+    uuid_dict = {str(i): record for i, record in enumerate(records)}
+    raw = [json.dumps(data).encode() for data in receipts]
+
+    def ingest(body):
+        receipt = Receipt.model_validate_json(body)
+        return score_record(ReceiptRecord.from_receipt(receipt))
+
+    return {
+        "calculate_points_us": micro(
+            calculate_points, [(id, uuid_dict) for id in uuid_dict]),
+        "score_record_us": micro(score_record, [(r,) for r in records]),
+        "render_breakdown_us": micro(render_breakdown,
+                                     [(r,) for r in records]),
+        "validate_date_us": micro(
+            validate_date, [(data["purchaseDate"],) for data in receipts]),
+        "validate_time_us": micro(
+            validate_time, [(data["purchaseTime"],) for data in receipts]),
+        "convert_time_us": micro(
+            convert_time, [(data["purchaseTime"],) for data in receipts]),
+        "receipt_validation_us": micro(
+            Receipt.model_validate, [(data,) for data in receipts]),
+        "receipt_key_us": micro(receipt_key, [(m,) for m in models]),
+        "ingest_us": micro(ingest, [(body,) for body in raw]),
+    }
+
+
+async def load(client, make_request, requests, concurrency):
+    """
+    Sends requests with a fixed number of concurrent clients.
+
+    Returns:
+    - dict: The p50/p95/p99 latency in milliseconds and the throughput.
+    """
+    latencies = []
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            start = time.perf_counter()
+            res = await make_request(client, i)
+            latencies.append(time.perf_counter() - start)
+            res.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    cuts = statistics.quantiles(latencies, n=100)
+    return {"p50_ms": cuts[49] * 1e3, "p95_ms": cuts[94] * 1e3,
+            "p99_ms": cuts[98] * 1e3, "rps": requests / elapsed}
+
+
+async def run_load(requests, levels):
+    """
+    Load-tests POST /receipts/process and GET /receipts/{id}/points.
+
+    Every POST, across all concurrency levels, sends a distinct receipt,
+    so the score cache cannot answer it and the results measure scoring
+    rather than the cache.
+
+    Returns:
+    - dict: The results of each endpoint at each concurrency level.
+    """
+    receipts = iter(make_receipts(requests * len(levels)))
+    ids = []
+
+    async def post(client, i):
+        res = await client.post("/receipts/process", json=next(receipts))
+        ids.append(res.json()["id"])
+        return res
+
+    async def get(client, i):
+        return await client.get(f"/receipts/{ids[i % len(ids)]}/points")
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport,
+                                 base_url="http://bench") as client:
+        for concurrency in levels:
+            results[f"post_c{concurrency}"] = await load(
+                client, post, requests, concurrency)
+            results[f"get_c{concurrency}"] = await load(
+                client, get, requests, concurrency)
+    return results
+
+
+def flatten(results):
+    """
+    Flattens the nested results into {"group.name.metric": value}.
+    """
+    flat = {}
+    for group in ("micro", "load"):
+        for name, value in results[group].items():
+            if isinstance(value, dict):
+                for metric, number in value.items():
+                    flat[f"{group}.{name}.{metric}"] = number
+            else:
+                flat[f"{group}.{name}"] = value
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares a run with a baseline run.
+
+    Returns:
+    - list: A message for every metric that regressed by more than the
+      tolerance. Throughput ("rps") regresses when it falls; every other
+      metric is a time and regresses when it rises.
+    """
+    regressions = []
+    current = flatten(results)
+    for key, old in flatten(baseline).items():
+        new = current.get(key)
+        if new is None or not old:
+            continue
+        change = (new - old) / old
+        if key.endswith("rps"):
+            change = -change
+        if change > tolerance:
+            regressions.append(f"{key}: {old:.3f} -> {new:.3f} "
+                               f"({change:+.0%} worse)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--micro-count", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+",
+                        default=[1, 8, 32])
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "micro": run_micro(args.micro_count),
+        "load": asyncio.run(run_load(args.requests, args.concurrency)),
+        "load_receipts": f"{args.requests * len(args.concurrency)} distinct "
+                         f"receipts, score cache size "
+                         f"{settings.score_cache_size}",
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    for key, value in flatten(results).items():
+        print(f"{key}: {value:,.3f}")
+    print(f"load_receipts: {results['load_receipts']}")
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"No regressions against {args.compare}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+This script compares the speed of the NumPy batch scorer (app.vectorized)
+with score_record. That both give the same points is checked by
+tests/test_vectorized.py.
+
+Usage:
+    python -m bench.vectorized [--sizes 10000 100000 1000000]
+
+"""
+
+import argparse
+import time
+
+from app.models import Receipt
+from app.utils import score_record
+from app.vectorized import score_columns, to_columns
+from bench.common import make_receipts, rate
+from db.records import ReceiptRecord
+
+
+def to_records(receipts):
+    return [ReceiptRecord.from_receipt(Receipt.model_validate(data))
+            for data in receipts]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    pool = to_records(make_receipts(10000))
+    for size in args.sizes:
+        records = [pool[i % len(pool)] for i in range(size)]
+        start = time.perf_counter()
+        columns, _ = to_columns(records)
+        converted = time.perf_counter()
+        score_columns(columns)
+        scored = time.perf_counter()
+        for record in records:
+            score_record(record)
+        scalar = time.perf_counter() - scored
+        vectorized = scored - start
+        print(f"{size:,} receipts: scalar {rate(size, scalar)}, "
+              f"vectorized {rate(size, vectorized)} "
+              f"(to_columns {converted - start:.3f}s, "
+              f"score_columns {scored - converted:.3f}s), "
+              f"speedup {scalar / vectorized:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
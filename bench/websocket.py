@@ -0,0 +1,135 @@
+"""
+This script compares the sustained throughput of one WebSocket connection
+to /receipts/ws with that of one keep-alive connection posting receipts to
+POST /receipts/process, against the API running under uvicorn.
+
+It runs three clients for --duration seconds each:
+
+- POST: one request at a time over a keep-alive connection.
+- WebSocket, window 1: one receipt frame at a time, waiting for its
+  acknowledgement, which isolates the cost of the protocol.
+- WebSocket, pipelined: as many frames in flight as the server's window
+  allows (RECEIPT_WS_WINDOW).
+
+For each it reports receipts per second and the server's CPU time per
+receipt, read from /proc, since the client runs on the same machine and
+takes part of its CPU. Bodies are encoded before the clock starts.
+
+Usage:
+    python -m bench.websocket [--duration SECONDS] [--port N]
+
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import httpx
+import websockets
+
+from bench.common import make_receipts, rate, serve
+
+
+def cpu_seconds(pid):
+    """
+    Returns the user and system CPU time of a process so far, in seconds.
+    """
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rpartition(")")[2].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def post(port, bodies, duration):
+    """
+    Posts receipts one at a time until duration seconds have passed.
+
+    Returns:
+    - int: The number of receipts stored.
+    """
+    headers = {"Content-Type": "application/json"}
+    limits = httpx.Limits(max_connections=1)
+    done = 0
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}",
+                                 limits=limits) as client:
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            res = await client.post("/receipts/process",
+                                    content=bodies[done % len(bodies)],
+                                    headers=headers)
+            res.raise_for_status()
+            done += 1
+    return done
+
+
+async def stream(port, bodies, duration, pipelined):
+    """
+    Sends receipt frames over one WebSocket connection until duration
+    seconds have passed, with one frame or a full window in flight, and
+    waits for the outstanding acknowledgements.
+
+    Returns:
+    - int: The number of receipts stored.
+    """
+    async with websockets.connect(
+            f"ws://127.0.0.1:{port}/receipts/ws") as websocket:
+        window = json.loads(await websocket.recv())["window"]
+        slots = asyncio.Semaphore(window if pipelined else 1)
+        sent = 0
+        done = 0
+        finished = False
+
+        async def receive():
+            nonlocal done
+            while True:
+                ack = json.loads(await websocket.recv())
+                if "error" in ack:
+                    raise RuntimeError(ack["error"])
+                done += 1
+                slots.release()
+                if finished and done == sent:
+                    return
+
+        receiving = asyncio.create_task(receive())
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            await slots.acquire()
+            await websocket.send(bodies[sent % len(bodies)])
+            sent += 1
+        finished = True
+        if done < sent:
+            await receiving
+        else:
+            receiving.cancel()
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=8123)
+    args = parser.parse_args()
+
+    bodies = [json.dumps(data) for data in make_receipts(1000)]
+    clients = [
+        ("POST", lambda: post(args.port, [body.encode() for body in bodies],
+                              args.duration)),
+        ("WebSocket, window 1",
+         lambda: stream(args.port, bodies, args.duration, False)),
+        ("WebSocket, pipelined",
+         lambda: stream(args.port, bodies, args.duration, True)),
+    ]
+    with serve(args.port) as server:
+        for name, client in clients:
+            cpu = cpu_seconds(server.pid)
+            start = time.perf_counter()
+            done = asyncio.run(client())
+            elapsed = time.perf_counter() - start
+            cpu = cpu_seconds(server.pid) - cpu
+            print(f"{name:22s} {rate(done, elapsed):>22s}, "
+                  f"server CPU {cpu / done * 1e6:6.1f} us/receipt")
+
+
+if __name__ == "__main__":
+    main()
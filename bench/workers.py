@@ -0,0 +1,98 @@
+"""
+This script load-tests the API running under uvicorn with several worker
+processes sharing one SQLite store, and reports how throughput scales
+with the number of workers.
+
+Every POST is followed by a GET of the returned ID, which may be served by
+any worker, so the run also checks that receipts are visible across
+processes.
+
+Usage:
+    python -m bench.workers [--workers 1 2 4] [--concurrency N]
+                            [--duration SECONDS]
+
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+
+from bench.common import make_receipts, serve
+
+
+async def drive(client, receipts, concurrency, duration):
+    """
+    Posts receipts and reads their points back from concurrency tasks
+    until duration seconds have passed.
+
+    Returns:
+    - tuple: The number of receipts processed and the number of GETs that
+      did not find the receipt.
+    """
+    deadline = time.monotonic() + duration
+    done = 0
+    missing = 0
+
+    async def worker(offset):
+        nonlocal done, missing
+        i = offset
+        while time.monotonic() < deadline:
+            res = await client.post("/receipts/process",
+                                    json=receipts[i % len(receipts)])
+            res.raise_for_status()
+            res = await client.get(f"/receipts/{res.json()['id']}/points")
+            if res.status_code == 404:
+                missing += 1
+            done += 1
+            i += concurrency
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return done, missing
+
+
+def run(workers, concurrency, duration, port):
+    """
+    Starts uvicorn with the given number of workers and load-tests it.
+
+    Returns:
+    - tuple: The receipts per second and the number of missing receipts.
+    """
+    path = os.path.join(tempfile.mkdtemp(), "receipts.db")
+
+    async def main():
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}",
+                                     limits=limits) as client:
+            return await drive(client, make_receipts(1000),
+                               concurrency, duration)
+
+    with serve(port, workers,
+               RECEIPT_STORE_URL=f"sqlite:///{path}",
+               RECEIPT_STORE_SYNC_COMMIT="1"):
+        done, missing = asyncio.run(main())
+    return done / duration, missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs available")
+    for workers in args.workers:
+        throughput, missing = run(workers, args.concurrency,
+                                  args.duration, args.port)
+        print(f"{workers} worker(s): {throughput:,.0f} receipts/sec, "
+              f"{missing} GETs missed")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,13 @@ Receipt Processor system.
 Dependencies:
 - json: Provides functions for working with JSON data.
 - requests: Allows making HTTP requests to the FastAPI server.
+- httpx: Sends concurrent requests over pooled keep-alive connections in
+  bulk mode.
+- msgpack: Encodes requests and decodes responses with --msgpack.
 
 Functions:
+- receipt_body(data): Encodes a receipt as the body of a POST request.
+- response_data(res): Decodes a JSON or MessagePack response body.
 - process_receipt(data): Sends a POST request to the FastAPI server to
   process a receipt based on the provided data.
 - retrieve_points(receipt_id): Sends a GET request to the FastAPI server
@@ -19,20 +24,85 @@ Functions:
   enter receipt information.
 - process_receipt_cli(): Handles the process receipt functionality in the CLI.
 - retrieve_points_cli(): Handles the retrieve points functionality in the CLI.
-- main(): Main routine for the CLI program.
+- iter_receipts(paths): Yields the receipts found in JSON files, JSON Lines
+  files and directories of JSON files.
+- post_receipt(client, data, retries): Posts one receipt, retrying
+  transient failures.
+- bulk_process(paths, server, concurrency, retries, output): Submits
+  receipts concurrently and reports progress and throughput.
+- parse_args(argv): Parses the command line arguments.
+- main(argv): Main routine for the CLI program.
+
+Usage:
+- python3 cli.py [--server URL] [--msgpack]: Starts the interactive menu.
+- python3 cli.py bulk PATH [PATH ...] [--server URL] [--msgpack]
+  [--concurrency N] [--retries N] [--output FILE]: Submits every receipt
+  in the given files and directories without prompting, for scripts and
+  cron jobs.
+
+--msgpack sends receipts and asks for responses as MessagePack instead of
+JSON, which costs the server less to decode and encode.
 
 Note: The script assumes that the FastAPI server is running and accessible
-      at 'http://localhost:80'. Modify the server URL as needed.
+      at 'http://localhost:80'. Use --server to change the server URL.
 
 """
 
+import argparse
+import asyncio
 import json
 import os
-import pyfiglet
-import requests
+import sys
+import time
+import uuid
 
 from pathlib import Path
-from app.validation import *
+
+
+SERVER_URL = 'http://localhost:80'
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+USE_MSGPACK = False
+
+
+def receipt_body(data):
+    """
+    Encodes a receipt as the body of a POST request, in MessagePack when
+    USE_MSGPACK is set and in JSON otherwise.
+
+    Parameters:
+    - data (dict): The receipt data.
+
+    Returns:
+    - dict: The content and headers keyword arguments of the request.
+    """
+    if USE_MSGPACK:
+        import msgpack
+
+        return {"content": msgpack.packb(data),
+                "headers": {"Content-Type": MSGPACK_MEDIA_TYPE,
+                            "Accept": MSGPACK_MEDIA_TYPE}}
+    return {"content": json.dumps(data).encode(),
+            "headers": {"Content-Type": "application/json"}}
+
+
+def response_data(res):
+    """
+    Decodes a response body, which is MessagePack if the server answered
+    a --msgpack request with it and JSON otherwise (errors always are).
+
+    Parameters:
+    - res (requests.Response or httpx.Response): The response.
+
+    Returns:
+    - object: The decoded body.
+    """
+    content_type = res.headers.get('Content-Type', '')
+    if content_type.startswith(MSGPACK_MEDIA_TYPE):
+        import msgpack
+
+        return msgpack.unpackb(res.content)
+    return res.json()
 
 
 def process_receipt(data):
@@ -47,13 +117,14 @@ def process_receipt(data):
     - "Receipt processed." and the generated receipt ID if successful.
     - "Error processing receipt." otherwise.
     """
+    import requests
 
     try:
-        res = requests.post('http://localhost:80/receipts/process',
-                            json=data,
-                            headers={"Content-Type": "application/json"})
+        body = receipt_body(data)
+        res = requests.post(f'{SERVER_URL}/receipts/process',
+                            data=body["content"], headers=body["headers"])
         res.raise_for_status()
-        receipt_id = res.json()["id"]
+        receipt_id = response_data(res)["id"]
         print("\nReceipt processed.")
         print(f"ID: {receipt_id}")
         print("Please remember this ID for retrieving points.")
@@ -74,11 +145,16 @@ def retrieve_points(receipt_id):
     - The total points and breakdown if successful.
     - "Error retrieving points." otherwise.
     """
+    import requests
+
     try:
-        res = requests.get(f'http://localhost:80/receipts/{receipt_id}/points')
+        headers = {"Accept": MSGPACK_MEDIA_TYPE} if USE_MSGPACK else {}
+        res = requests.get(f'{SERVER_URL}/receipts/{receipt_id}/points',
+                           headers=headers)
         res.raise_for_status()
-        points = res.json()['points']
-        breakdown = res.json()['breakdown']
+        result = response_data(res)
+        points = result['points']
+        breakdown = result['breakdown']
         print(f'\nTotal Points: {points}')
         print("Breakdown:")
         for breakdown_item in breakdown:
@@ -124,6 +200,10 @@ def get_manual_receipt_data():
     """
     Prompts the user to manually enter receipt information.
     """
+    # Imported here since it loads pydantic, which only this prompt needs.
+    from app.validation import (validate_date, validate_money,
+                                validate_receipt_data, validate_time)
+
     print("\nEnter receipt information:")
     retailer = input('Retailer: ')
     valid_date = False
@@ -142,7 +222,13 @@ def get_manual_receipt_data():
         else:
             print("\nInvalid input. Please enter a valid time.")
 
-    total = input('Total: ')
+    valid_total = False
+    while not valid_total:
+        total = input('Total: ')
+        if validate_money(total):
+            valid_total = True
+        else:
+            print("\nInvalid input. Please enter an amount such as 6.49.")
 
     items = []
     try:
@@ -218,10 +304,222 @@ def retrieve_points_cli():
         print("\nInvalid choice. Please try again.")
 
 
-def main():
+def iter_receipts(paths):
+    """
+    Yields the receipts found in the given paths.
+
+    Parameters:
+    - paths (list): JSON files holding one receipt, JSON Lines files
+      (*.jsonl) holding one receipt per line, or directories whose *.json
+      and *.jsonl files are read.
+
+    Yields:
+    - tuple: The source of the receipt (file name, with the line number for
+      JSON Lines) and the receipt data, or the exception raised if the file
+      cannot be read or does not hold valid JSON.
+    """
+    for path in paths:
+        p = Path(os.path.expanduser(path))
+        if p.is_dir():
+            files = sorted(list(p.glob('*.json')) + list(p.glob('*.jsonl')))
+        else:
+            files = [p]
+        for file in files:
+            try:
+                if file.suffix != '.jsonl':
+                    yield str(file), json.loads(file.read_text())
+                    continue
+                with open(file) as f:
+                    for number, line in enumerate(f, 1):
+                        if not line.strip():
+                            continue
+                        try:
+                            yield f"{file}:{number}", json.loads(line)
+                        except json.JSONDecodeError as e:
+                            yield f"{file}:{number}", e
+            except (OSError, json.JSONDecodeError) as e:
+                yield str(file), e
+
+
+async def post_receipt(client, data, retries):
+    """
+    Posts one receipt, retrying connection errors and retryable status
+    codes with exponential backoff.
+
+    Every attempt carries the same Idempotency-Key, so a retry after the
+    server stored the receipt, e.g. after a timeout or a 502 from a proxy,
+    gets the original ID back instead of storing the receipt again.
+
+    Parameters:
+    - client (httpx.AsyncClient): The pooled client.
+    - data (dict): The receipt data.
+    - retries (int): The number of retries after the first attempt.
+
+    Returns:
+    - dict: {"id": ...} if the receipt was processed, {"error": ...}
+      otherwise.
+    """
+    import httpx
+
+    body = receipt_body(data)
+    body["headers"] = {**body["headers"],
+                       "Idempotency-Key": str(uuid.uuid4())}
+    for attempt in range(retries + 1):
+        delay = 0.1 * 2 ** attempt
+        try:
+            res = await client.post('/receipts/process', **body)
+        except httpx.TransportError as e:
+            error = f"{type(e).__name__}: {e}"
+        else:
+            if res.status_code == 200:
+                return {"id": response_data(res)["id"]}
+            error = f"HTTP {res.status_code}: {res.text}"
+            if res.status_code not in RETRY_STATUS_CODES:
+                break
+            retry_after = res.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                delay = int(retry_after)
+        if attempt < retries:
+            await asyncio.sleep(delay)
+    return {"error": error}
+
+
+async def bulk_process(paths, server, concurrency, retries, output):
+    """
+    Submits every receipt in the given paths with a bounded number of
+    concurrent requests over pooled keep-alive connections, printing
+    progress and throughput to stderr.
+
+    Parameters:
+    - paths (list): The files and directories to read, see iter_receipts.
+    - server (str): The server URL.
+    - concurrency (int): The number of requests in flight at once.
+    - retries (int): The number of retries for each receipt.
+    - output (file): Receives one JSON line per receipt with its source
+      and either its "id" or an "error".
+
+    Returns:
+    - tuple: The number of receipts processed and the number that failed.
+    """
+    import httpx
+
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    done = 0
+    failed = 0
+    start = time.perf_counter()
+
+    def report(end="\r"):
+        elapsed = time.perf_counter() - start
+        print(f"{done} processed, {failed} failed, "
+              f"{done / elapsed if elapsed else 0:,.0f} receipts/sec",
+              end=end, file=sys.stderr, flush=True)
+
+    async def worker(client):
+        nonlocal done, failed
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            source, data = item
+            if isinstance(data, Exception):
+                result = {"error": f"Cannot read receipt: {data}"}
+            else:
+                result = await post_receipt(client, data, retries)
+            if "error" in result:
+                failed += 1
+            else:
+                done += 1
+            output.write(json.dumps({"source": source, **result}) + "\n")
+
+    async def progress():
+        while True:
+            await asyncio.sleep(1)
+            report()
+
+    limits = httpx.Limits(max_connections=concurrency,
+                          max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=server, limits=limits,
+                                 timeout=30) as client:
+        workers = [asyncio.create_task(worker(client))
+                   for _ in range(concurrency)]
+        reporter = asyncio.create_task(progress())
+        try:
+            for item in iter_receipts(paths):
+                await queue.put(item)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            reporter.cancel()
+            for task in workers:
+                task.cancel()
+    report(end="\n")
+    return done, failed
+
+
+def parse_args(argv):
+    """
+    Parses the command line arguments.
+
+    Parameters:
+    - argv (list): The arguments, without the program name.
+
+    Returns:
+    - argparse.Namespace: The parsed arguments. command is None for the
+      interactive menu.
+    """
+    parser = argparse.ArgumentParser(
+        description="Receipt Processor command line interface.")
+    parser.add_argument('--server', default=SERVER_URL,
+                        help=f"server URL (default: {SERVER_URL})")
+    parser.add_argument('--msgpack', action='store_true',
+                        help="exchange MessagePack instead of JSON with "
+                             "the server")
+    subparsers = parser.add_subparsers(dest='command')
+    bulk = subparsers.add_parser(
+        'bulk', help="submit receipt files without prompting")
+    bulk.add_argument('paths', nargs='+',
+                      help="JSON files, JSON Lines files or directories")
+    bulk.add_argument('--server', default=argparse.SUPPRESS,
+                      help="server URL")
+    bulk.add_argument('--msgpack', action='store_true',
+                      default=argparse.SUPPRESS,
+                      help="exchange MessagePack instead of JSON")
+    bulk.add_argument('--concurrency', type=int, default=16,
+                      help="requests in flight at once (default: 16)")
+    bulk.add_argument('--retries', type=int, default=3,
+                      help="retries per receipt (default: 3)")
+    bulk.add_argument('--output', default=None,
+                      help="write the results as JSON Lines to this file "
+                           "(default: stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     """
     Main routine for the CLI program.
+
+    Parameters:
+    - argv (list): The command line arguments. Defaults to sys.argv[1:].
     """
+    global SERVER_URL, USE_MSGPACK
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    SERVER_URL = args.server.rstrip('/')
+    USE_MSGPACK = args.msgpack
+
+    if args.command == 'bulk':
+        output = open(args.output, 'w') if args.output else sys.stdout
+        try:
+            _, failed = asyncio.run(bulk_process(
+                args.paths, SERVER_URL, args.concurrency, args.retries,
+                output))
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        sys.exit(1 if failed else 0)
+
+    import pyfiglet
+
     f = pyfiglet.figlet_format("Receipt Processor", font="slant", width=20)
     print(f)
 
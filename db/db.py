@@ -1 +1,34 @@
-uuid_dict = {}
\ No newline at end of file
+"""
+This module holds the receipt store used by the API.
+
+Global Variables:
+- uuid_dict: The dictionary backing the default in-memory store.
+- store: The active receipt store. Defaults to a DictStore over uuid_dict.
+
+Functions:
+- configure(url, **options): Replaces the active store with one opened
+  from a URL.
+
+"""
+
+from db.stores import DictStore, open_store
+
+
+uuid_dict = {}
+store = DictStore(uuid_dict)
+
+
+def configure(url, **options):
+    """
+    Replaces the active store with one opened from a URL.
+
+    Parameters:
+    - url (str): The store URL, see db.stores.open_store.
+    - **options: Extra keyword arguments passed to the backend.
+
+    Returns:
+    - ReceiptStore: The new active store.
+    """
+    global store
+    store = open_store(url, uuid_dict, **options)
+    return store
@@ -0,0 +1,238 @@
+"""
+This module defines the compact record kept in the receipt store for every
+accepted receipt.
+
+Classes:
+- ReceiptRecord: A __slots__ record holding a receipt, its points and the
+  codes of the scoring rules that fired.
+
+Functions:
+- decode_money(value): Converts an amount in cents to dollars as a float.
+- intern_value(value): Returns a shared copy of an equal date or time.
+- pack_record(record): Returns a record's fields as a tuple of plain
+  values, for compact serialization.
+- unpack_record(values): Builds a record from pack_record's values.
+- rule_code(rule, arg): Packs a rule number and its argument into one int.
+- split_rule_code(code): Unpacks a rule code.
+
+"""
+
+import sys
+
+from datetime import date, time
+
+
+RULE_BITS = 5
+INTERN_LIMIT = 100000
+
+_interned = {}
+_ordinal_dates = {}
+_second_times = {}
+
+
+def decode_money(value):
+    """
+    Converts an amount in cents to dollars as a float.
+
+    Parameters:
+    - value (int): The amount in cents.
+
+    Returns:
+    - float: The amount.
+    """
+    return value / 100
+
+
+def intern_value(value):
+    """
+    Returns a shared copy of an equal date or time, like sys.intern does
+    for strings, so that receipts from the same day or minute share one
+    object. At most INTERN_LIMIT distinct values are shared.
+    """
+    shared = _interned.get(value)
+    if shared is not None:
+        return shared
+    if len(_interned) < INTERN_LIMIT:
+        _interned[value] = value
+    return value
+
+
+def pack_record(record):
+    """
+    Returns a record's fields as a tuple of plain values, which pickle
+    smaller and faster than the record: the date as its ordinal and the
+    time as seconds since midnight, when they are a plain date and time.
+    The serialized response (body) is left out, since it can be rendered
+    again.
+
+    Parameters:
+    - record (ReceiptRecord): The record.
+
+    Returns:
+    - tuple: The values, see unpack_record.
+    """
+    purchase_date = record.purchase_date
+    if type(purchase_date) is date:
+        purchase_date = purchase_date.toordinal()
+    purchase_time = record.purchase_time
+    if (type(purchase_time) is time and not purchase_time.microsecond
+            and purchase_time.tzinfo is None):
+        purchase_time = (purchase_time.hour * 3600
+                         + purchase_time.minute * 60 + purchase_time.second)
+    return (record.retailer, purchase_date, purchase_time, record.total,
+            record.items, record.points, record.rules, record.error,
+            record.etag, record.version)
+
+
+def unpack_record(values):
+    """
+    Builds a record from the values returned by pack_record. The retailer
+    name, date and time are shared as in records built from receipts.
+
+    Parameters:
+    - values (tuple): The values.
+
+    Returns:
+    - ReceiptRecord: The new record.
+    """
+    (retailer, purchase_date, purchase_time, total, items, points, rules,
+     error, etag, version) = values
+    if type(purchase_date) is int:
+        shared = _ordinal_dates.get(purchase_date)
+        if shared is None:
+            shared = intern_value(date.fromordinal(purchase_date))
+            if len(_ordinal_dates) < INTERN_LIMIT:
+                _ordinal_dates[purchase_date] = shared
+        purchase_date = shared
+    if type(purchase_time) is int:
+        shared = _second_times.get(purchase_time)
+        if shared is None:
+            shared = intern_value(time(purchase_time // 3600,
+                                       purchase_time // 60 % 60,
+                                       purchase_time % 60))
+            if len(_second_times) < INTERN_LIMIT:
+                _second_times[purchase_time] = shared
+        purchase_time = shared
+    return ReceiptRecord(sys.intern(retailer), purchase_date, purchase_time,
+                         total, items, points, rules, error, None, etag,
+                         version)
+
+
+def rule_code(rule, arg=0):
+    """
+    Packs a rule number (1 to 2 ** RULE_BITS - 1) and an optional argument,
+    such as an item index, into a single small int.
+    """
+    return rule | (arg << RULE_BITS)
+
+
+def split_rule_code(code):
+    """
+    Unpacks a rule code.
+
+    Returns:
+    - tuple: The rule number and its argument.
+    """
+    return code & ((1 << RULE_BITS) - 1), code >> RULE_BITS
+
+
+class ReceiptRecord:
+    """
+    Represents an accepted receipt and its score in compact form.
+
+    Retailer names, dates and times are interned so that receipts sharing
+    them share one object. Money is kept as integer cents and items as a
+    flat (description, price, description, price, ...) tuple.
+    The breakdown is not stored as text; rules lists the codes of the rules
+    that fired, from which the breakdown can be rendered again. Only in the
+    fast I/O mode is the full points response kept, already serialized, in
+    body. version is the version of the rule set that scored the record,
+    whose rule numbers the codes hold (see app.rules).
+
+    Attributes:
+    - retailer (str): The retailer name.
+    - purchase_date (date): The purchase date.
+    - purchase_time (time): The purchase time.
+    - total (int): The total in cents.
+    - items (tuple): The flattened item descriptions and prices.
+    - points (int): The points awarded.
+    - rules (tuple): The rule codes, see rule_code.
+    - error (str or None): The error that stopped scoring, if any.
+    - body (bytes or None): The serialized points response, if any.
+    - etag (int or None): The entity tag of the points response, computed
+      when the record is scored.
+    - version (int or None): The rule set version that scored the record.
+    """
+    __slots__ = ("retailer", "purchase_date", "purchase_time", "total",
+                 "items", "points", "rules", "error", "body", "etag",
+                 "version")
+
+    def __init__(self, retailer, purchase_date, purchase_time, total, items,
+                 points=0, rules=(), error=None, body=None, etag=None,
+                 version=None):
+        self.retailer = retailer
+        self.purchase_date = purchase_date
+        self.purchase_time = purchase_time
+        self.total = total
+        self.items = items
+        self.points = points
+        self.rules = rules
+        self.error = error
+        self.body = body
+        self.etag = etag
+        self.version = version
+
+    @classmethod
+    def from_receipt(cls, receipt, points=0, rules=(), error=None):
+        """
+        Builds a record from a Receipt model and its score.
+
+        Parameters:
+        - receipt (Receipt): The receipt.
+        - points (int): The points awarded.
+        - rules (iterable): The codes of the rules that fired.
+        - error (str or None): The error that stopped scoring, if any.
+
+        Returns:
+        - ReceiptRecord: The new record.
+        """
+        items = []
+        for item in receipt.items:
+            items.append(item.shortDescription)
+            items.append(item.price)
+        return cls(sys.intern(receipt.retailer),
+                   intern_value(receipt.purchaseDate),
+                   intern_value(receipt.purchaseTime),
+                   receipt.total,
+                   tuple(items),
+                   points,
+                   tuple(rules),
+                   error)
+
+    @property
+    def item_count(self):
+        """
+        The number of items on the receipt.
+        """
+        return len(self.items) // 2
+
+    def copy(self):
+        """
+        Returns an unscored copy of the record, sharing its fields.
+        """
+        return type(self)(self.retailer, self.purchase_date,
+                          self.purchase_time, self.total, self.items)
+
+    def item(self, index):
+        """
+        Returns the description and price (as a float) of an item.
+        """
+        return (self.items[2 * index],
+                decode_money(self.items[2 * index + 1]))
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
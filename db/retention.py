@@ -0,0 +1,168 @@
+"""
+This module decides which receipts the in-memory store evicts.
+
+A RetentionPolicy bounds the in-memory store by the age of its entries, by
+their number and by an estimate of the memory they use. Entries are
+evicted oldest first, in the order they entered memory, which is also the
+order their IDs were returned, so the receipts most likely to be read, the
+recent ones, stay in memory. Eviction is incremental: every call to
+DictStore.put_many evicts at most a few more entries than it adds, so the
+store converges on its limits without ever stopping to scan itself.
+Evicted entries are dropped, or spilled to a cold tier if the store has
+one (see DictStore.set_retention).
+
+Entries are grouped into generations of GENERATION_SECONDS by the time
+they were added, so the age of the oldest entries is known without keeping
+a timestamp per entry. Entries live between ttl and ttl plus
+GENERATION_SECONDS.
+
+Dependencies:
+- collections: Provides the deque of generations.
+
+Classes:
+- RetentionPolicy: The limits and the generations of entries they apply to.
+
+Functions:
+- entry_size(receipt_id, record): Estimates the memory used by a stored
+  entry.
+
+Global Variables:
+- GENERATION_SECONDS: The span of time a generation covers.
+
+"""
+
+import sys
+
+from collections import deque
+
+
+GENERATION_SECONDS = 1.0
+# The dictionary slot and the references from the generations and the
+# sorted ID list.
+ENTRY_OVERHEAD = 64
+
+
+def entry_size(receipt_id, record):
+    """
+    Estimates the memory used by a stored entry: its ID, its record, the
+    record's items, rule codes and serialized response, and the overhead
+    of storing it. Retailer names, dates and times are shared between
+    records and left out.
+
+    Parameters:
+    - receipt_id (str): The receipt ID.
+    - record (ReceiptRecord): The record.
+
+    Returns:
+    - int: The estimated number of bytes.
+    """
+    size = (ENTRY_OVERHEAD + sys.getsizeof(receipt_id)
+            + sys.getsizeof(record) + sys.getsizeof(record.items)
+            + sys.getsizeof(record.rules))
+    for value in record.items:
+        size += sys.getsizeof(value)
+    if record.body is not None:
+        size += sys.getsizeof(record.body)
+    return size
+
+
+class _Generation:
+    """
+    Represents the IDs added to the store within one generation, and how
+    many of them were evicted already.
+    """
+    __slots__ = ("started", "position", "receipt_ids")
+
+    def __init__(self, started):
+        self.started = started
+        self.position = 0
+        self.receipt_ids = []
+
+
+class RetentionPolicy:
+    """
+    Represents the limits on the entries kept in memory.
+
+    The memory budget is turned into a number of entries using the mean
+    estimated size of the entries added so far (see entry_size), so that
+    evicting an entry does not need its size.
+
+    Attributes:
+    - ttl (float): The seconds an entry is kept in memory. 0 for no limit.
+    - max_entries (int): The most entries kept. 0 for no limit.
+    - max_bytes (int): The estimated memory the entries may use. 0 for no
+      limit.
+    - step (int): How many more entries than it adds a put may evict.
+    """
+
+    def __init__(self, ttl=0.0, max_entries=0, max_bytes=0, step=8):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.step = step
+        self._generations = deque()
+        self._added = 0
+        self._added_bytes = 0
+
+    @property
+    def enabled(self):
+        return bool(self.ttl or self.max_entries or self.max_bytes)
+
+    def limit(self):
+        """
+        Returns the most entries kept, or 0 for no limit.
+        """
+        limit = self.max_entries
+        if self.max_bytes and self._added:
+            by_size = self.max_bytes * self._added // self._added_bytes
+            limit = min(limit, by_size) if limit else by_size
+        return limit
+
+    def add(self, receipt_id, entry, now):
+        """
+        Records that an entry was added to the store.
+
+        Parameters:
+        - receipt_id (str): The receipt ID.
+        - entry (ReceiptRecord): The entry.
+        - now (float): The time.monotonic() of the addition.
+        """
+        generations = self._generations
+        if (not generations
+                or now - generations[-1].started >= GENERATION_SECONDS):
+            generations.append(_Generation(now))
+        generations[-1].receipt_ids.append(receipt_id)
+        if self.max_bytes:
+            self._added += 1
+            self._added_bytes += entry_size(receipt_id, entry)
+
+    def victims(self, size, now, budget):
+        """
+        Picks the oldest entries to evict, while the store is over the
+        entry limit or they have expired.
+
+        Parameters:
+        - size (int): The number of entries in the store.
+        - now (float): The time.monotonic() now.
+        - budget (int): The most entries picked.
+
+        Returns:
+        - list: The picked receipt IDs, oldest first. They may include IDs
+          no longer in the store.
+        """
+        limit = self.limit()
+        expired = now - self.ttl - GENERATION_SECONDS
+        generations = self._generations
+        picked = []
+        while len(picked) < budget and generations:
+            generation = generations[0]
+            if not (limit and size - len(picked) > limit
+                    or self.ttl and generation.started <= expired):
+                break
+            if generation.position == len(generation.receipt_ids):
+                generations.popleft()
+                continue
+            picked.append(generation.receipt_ids[generation.position])
+            generation.receipt_ids[generation.position] = None
+            generation.position += 1
+        return picked
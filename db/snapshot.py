@@ -0,0 +1,351 @@
+"""
+This module writes and reads binary snapshots of the in-memory receipt
+store, so that a restarted process gets its receipts back without scoring
+them again.
+
+A snapshot file holds a header, the records, and a hash index from receipt
+ID to record:
+
+- The header (HEADER) holds a magic string, the format version, a byte
+  order check, the number of records, the number of index slots and where
+  the index starts.
+- Each record is a 4-byte length followed by a pickled tuple of the
+  receipt ID as 16 bytes and the values of db.records.pack_record.
+- The index is an open-addressing hash table of (key, offset) pairs of
+  unsigned 64-bit ints, where the key is the random low half of the
+  receipt ID and the offset is where the record starts (0 for an empty
+  slot). It is at most three quarters full.
+
+Snapshots are read through a memory map: opening one only reads the header,
+and looking up an ID reads one or two index slots and one record, so it can
+serve reads straight away while its records are loaded into the store in
+the background (see DictStore.load_snapshot). A snapshot is written to a
+temporary file that replaces the previous one once complete, so a crash
+while writing leaves the previous snapshot in place. The index is kept in
+native byte order, so a snapshot is read on the architecture it was
+written on.
+
+Dependencies:
+- mmap: Maps snapshot files into memory.
+- pickle: Serializes each record's values.
+
+Classes:
+- Snapshot: A read-only, memory-mapped snapshot file.
+- Snapshotter: Writes snapshots of a store periodically on a background
+  thread, and once more when closed.
+
+Functions:
+- write_snapshot(path, store, chunk_size): Writes a snapshot of every
+  entry in a store.
+
+Global Variables:
+- MAGIC: The first bytes of every snapshot file.
+- FORMAT_VERSION: The version of the file format written.
+
+"""
+
+import logging
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+
+from array import array
+from db.records import pack_record, unpack_record
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"RCPTSNAP"
+FORMAT_VERSION = 1
+BYTE_ORDER_CHECK = 0x01020304
+# Magic, format version, byte order check, records, index slots, index
+# offset; padded so that the records start 8-byte aligned.
+HEADER = struct.Struct("=8sIIQQQ")
+HEADER_SIZE = 64
+LENGTH = struct.Struct("=I")
+SLOT_WORDS = 2
+
+
+def _id_bytes(receipt_id):
+    """
+    Converts a receipt ID to the 16 bytes of its UUID.
+
+    Raises:
+    - ValueError: If the ID is not a UUID in canonical form.
+    """
+    if (len(receipt_id) != 36 or receipt_id[8] != "-"
+            or receipt_id[13] != "-" or receipt_id[18] != "-"
+            or receipt_id[23] != "-" or receipt_id.lower() != receipt_id):
+        raise ValueError(f"Not a canonical UUID: {receipt_id!r}")
+    return bytes.fromhex(receipt_id.replace("-", ""))
+
+
+def _id_text(raw):
+    """
+    Converts the 16 bytes of a UUID to its canonical text.
+    """
+    digits = raw.hex()
+    return (f"{digits[:8]}-{digits[8:12]}-{digits[12:16]}-"
+            f"{digits[16:20]}-{digits[20:]}")
+
+
+def _index_key(raw):
+    """
+    Returns the index key of a receipt ID's bytes: its low 64 bits, which
+    are random in both version 4 and version 7 UUIDs.
+    """
+    return int.from_bytes(raw[8:], "big")
+
+
+def write_snapshot(path, store, chunk_size=10000):
+    """
+    Writes a snapshot of every entry in a store.
+
+    The entries are read with store.chunks, so requests keep being served
+    while the snapshot is written; an entry added meanwhile may be left
+    out. The records are written as they are read, and the index is built
+    in memory and written after them.
+
+    Parameters:
+    - path (str): The snapshot file, replaced once the new one is complete.
+    - store (ReceiptStore): The store.
+    - chunk_size (int): The number of entries read at once.
+
+    Returns:
+    - dict: The number of entries written, the file size in bytes and the
+      seconds taken.
+
+    Raises:
+    - ValueError: If a receipt ID is not a UUID.
+    """
+    start = time.perf_counter()
+    keys = array("Q")
+    offsets = array("Q")
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(bytes(HEADER_SIZE))
+        offset = HEADER_SIZE
+        for chunk in store.chunks(chunk_size):
+            frames = []
+            for receipt_id, record in chunk:
+                raw = _id_bytes(receipt_id)
+                payload = pickle.dumps((raw, *pack_record(record)),
+                                       pickle.HIGHEST_PROTOCOL)
+                frames.append(LENGTH.pack(len(payload)))
+                frames.append(payload)
+                keys.append(_index_key(raw))
+                offsets.append(offset)
+                offset += LENGTH.size + len(payload)
+            file.write(b"".join(frames))
+
+        count = len(keys)
+        slots = count * 4 // 3 + 1
+        index = array("Q", bytes(8 * SLOT_WORDS * slots))
+        for key, record_offset in zip(keys, offsets):
+            slot = key % slots
+            while index[SLOT_WORDS * slot + 1]:
+                slot += 1
+                if slot == slots:
+                    slot = 0
+            index[SLOT_WORDS * slot] = key
+            index[SLOT_WORDS * slot + 1] = record_offset
+        index_offset = (offset + 7) & ~7
+        file.write(bytes(index_offset - offset))
+        index.tofile(file)
+        file.seek(0)
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, BYTE_ORDER_CHECK,
+                               count, slots, index_offset))
+        file.flush()
+        os.fsync(file.fileno())
+        size = index_offset + index.itemsize * len(index)
+    os.replace(temporary, path)
+    return {"entries": count, "bytes": size,
+            "seconds": time.perf_counter() - start}
+
+
+class Snapshot:
+    """
+    Represents a read-only snapshot file, mapped into memory.
+
+    Records are only read when they are looked up or iterated over.
+
+    Attributes:
+    - path (str): The snapshot file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER_SIZE:
+            raise ValueError(f"Not a receipt snapshot: {path}")
+        (magic, version, order, self._count, self._slots,
+         self._index_offset) = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"Not a receipt snapshot: {path}")
+        if version != FORMAT_VERSION or order != BYTE_ORDER_CHECK:
+            raise ValueError(f"Unsupported receipt snapshot format or byte "
+                             f"order: {path}")
+        if (len(self._map) != self._index_offset
+                + 8 * SLOT_WORDS * self._slots):
+            raise ValueError(f"Truncated receipt snapshot: {path}")
+        self._view = memoryview(self._map)
+        self._index = self._view[self._index_offset:].cast("Q")
+
+    def __len__(self):
+        return self._count
+
+    def get(self, receipt_id):
+        """
+        Looks up the record for a receipt ID.
+
+        Parameters:
+        - receipt_id (str): The receipt ID.
+
+        Returns:
+        - ReceiptRecord or None: A new record, or None if the ID is not in
+          the snapshot.
+        """
+        try:
+            raw = _id_bytes(receipt_id)
+        except ValueError:
+            return None
+        key = _index_key(raw)
+        index = self._index
+        slots = self._slots
+        slot = key % slots
+        while True:
+            offset = index[SLOT_WORDS * slot + 1]
+            if not offset:
+                return None
+            if index[SLOT_WORDS * slot] == key:
+                values = self._read(offset)[0]
+                if values[0] == raw:
+                    return self._record(values)
+            slot += 1
+            if slot == slots:
+                slot = 0
+
+    def chunks(self, size):
+        """
+        Yields every record in the order they were written, in lists of up
+        to size (receipt_id, record) pairs.
+        """
+        read = self._read
+        record = self._record
+        offset = HEADER_SIZE
+        chunk = []
+        while True:
+            values, offset = read(offset)
+            if values is None:
+                break
+            chunk.append((_id_text(values[0]), record(values)))
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def close(self):
+        """
+        Unmaps the file. The snapshot must not be used afterwards.
+        """
+        self._index.release()
+        self._view.release()
+        self._map.close()
+
+    def _read(self, offset):
+        """
+        Reads the record at an offset.
+
+        Returns:
+        - tuple: The record's values, or None past the last record (where
+          the zero padding before the index reads as a length of 0), and
+          the offset of the next record.
+        """
+        if offset + LENGTH.size > self._index_offset:
+            return None, offset
+        length = LENGTH.unpack_from(self._map, offset)[0]
+        if not length:
+            return None, offset
+        start = offset + LENGTH.size
+        return pickle.loads(self._view[start:start + length]), start + length
+
+    def _record(self, values):
+        """
+        Builds a ReceiptRecord from a snapshot record's values.
+        """
+        return unpack_record(values[1:])
+
+
+class Snapshotter:
+    """
+    Writes snapshots of a store to a file, every interval seconds on a
+    background thread and once more when closed.
+
+    A store still loading a snapshot is waited for, since a snapshot
+    written meanwhile would lack the entries not loaded yet; one whose
+    load failed is never snapshotted, so that the file it was loaded from
+    is kept.
+
+    Attributes:
+    - store (DictStore): The store.
+    - path (str): The snapshot file.
+    - interval (float): The seconds between snapshots. 0 only writes one
+      when the snapshotter is closed.
+    - last (dict or None): The result of the last write_snapshot, with the
+      time it finished, or None before the first snapshot.
+    """
+
+    def __init__(self, store, path, interval=300.0):
+        self.store = store
+        self.path = path
+        self.interval = interval
+        self.last = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+        if interval > 0:
+            self._thread = threading.Thread(target=self._write_periodically,
+                                            name="snapshotter", daemon=True)
+            self._thread.start()
+
+    def write(self):
+        """
+        Writes a snapshot of the store now, unless another write is running,
+        in which case that one is waited for instead.
+
+        Returns:
+        - dict: The result of write_snapshot.
+
+        Raises:
+        - RuntimeError: If the store failed to load its snapshot.
+        """
+        with self._lock:
+            self.store.wait_loaded()
+            if self.store.load_error is not None:
+                raise RuntimeError("The store did not load its snapshot; "
+                                   "not replacing it.")
+            result = write_snapshot(self.path, self.store)
+            result["finished"] = time.time()
+            self.last = result
+            return result
+
+    def close(self):
+        """
+        Stops the background thread and writes a final snapshot.
+        """
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write()
+
+    def _write_periodically(self):
+        while not self._closed.wait(self.interval):
+            try:
+                self.write()
+            except Exception:
+                logger.exception("Writing the receipt snapshot failed")
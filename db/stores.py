@@ -0,0 +1,657 @@
+"""
+This module defines the pluggable receipt store backends.
+
+A store maps a receipt ID to its entry, a db.records.ReceiptRecord holding
+the receipt and its score. Time-ordered (version 7 UUID) receipt IDs sort
+in the order they were generated, and every store can scan them in ID
+order, which lists the receipts created in a time window without looking
+at the others. The in-memory store can be warm-started from a snapshot
+(see db.snapshot), and bounded by a retention policy that spills old
+receipts to a compressed SQLite store (see db.retention).
+
+Classes:
+- ReceiptStore: The interface every backend implements.
+- DictStore: Keeps entries in a plain dictionary (the default).
+- SQLiteStore: Keeps entries in an SQLite database in WAL mode, with
+  group-committed writes, optionally compressed.
+
+Functions:
+- is_time_ordered(receipt_id): Returns whether a receipt ID is a version 7
+  UUID.
+- open_store(url, uuid_dict, **options): Creates a store from a URL such as
+  "memory" or "sqlite:///path/to/receipts.db".
+
+"""
+
+import bisect
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+
+from db.records import pack_record, unpack_record
+
+
+logger = logging.getLogger(__name__)
+
+# Dead IDs at the front of DictStore's sorted ID list are trimmed in batches
+# of at least this many, to amortize moving the rest of the list.
+TRIM_BATCH = 4096
+# A compressed entry is a format byte, then the pickled pack_record values,
+# raw or deflated with a preset dictionary made of the first entries
+# written, which holds the pickle framing, field values and strings most
+# entries share.
+RAW_ENTRY = 0
+DEFLATED_ENTRY = 1
+ZDICT_ENTRIES = 32
+ZDICT_SIZE = 4096
+
+
+def is_time_ordered(receipt_id):
+    """
+    Returns whether a receipt ID is a version 7 UUID, whose text sorts in
+    the order the IDs were generated.
+    """
+    return len(receipt_id) == 36 and receipt_id[14] == "7"
+
+
+class ReceiptStore:
+    """
+    The interface implemented by every receipt store backend.
+    """
+
+    def get(self, receipt_id):
+        """
+        Returns the entry for a receipt ID, or None if it is unknown.
+        """
+        raise NotImplementedError
+
+    def put(self, receipt_id, entry):
+        """
+        Stores the entry for a receipt ID.
+        """
+        raise NotImplementedError
+
+    def put_many(self, entries):
+        """
+        Stores several entries given as a {receipt_id: entry} dictionary.
+        """
+        for receipt_id, entry in entries.items():
+            self.put(receipt_id, entry)
+
+    def __contains__(self, receipt_id):
+        return self.get(receipt_id) is not None
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def scan(self, after, before, limit):
+        """
+        Returns the entries with time-ordered IDs between two bounds, in ID
+        order.
+
+        Parameters:
+        - after (str): Only IDs greater than this are returned.
+        - before (str): Only IDs less than this are returned.
+        - limit (int): The most entries returned.
+
+        Returns:
+        - list: (receipt_id, entry) tuples.
+        """
+        raise NotImplementedError
+
+    def chunks(self, size):
+        """
+        Yields every stored entry, in lists of up to size (receipt_id,
+        entry) pairs. Entries added while it runs may be left out.
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """
+        Makes every accepted write durable.
+        """
+
+    def close(self):
+        """
+        Flushes pending writes and releases the backend's resources.
+        """
+        self.flush()
+
+
+class DictStore(ReceiptStore):
+    """
+    Keeps entries in a plain dictionary, db.uuid_dict by default.
+    Nothing survives a restart, except through a snapshot or a cold store.
+
+    The time-ordered IDs are also kept in a sorted list for scan(). New IDs
+    are almost always the greatest so far and are appended; the others are
+    inserted in place. Entries must be added through put or put_many for
+    the list to stay in step with the dictionary.
+
+    While a snapshot is being loaded (see load_snapshot), IDs missing from
+    the dictionary are looked up in the snapshot, scan() and chunks() wait
+    for the load to finish, and the length counts the entries still to be
+    loaded.
+
+    With a retention policy (see set_retention), every put evicts the
+    entries over the policy's limits, a few at a time, and moves them to
+    the cold store if there is one. IDs missing from the dictionary are
+    then looked up in the cold store, and scan() and the length cover both.
+    chunks() only covers the dictionary.
+
+    Attributes:
+    - load_error (Exception or None): Why loading the snapshot failed, if
+      it did.
+    - retention (RetentionPolicy or None): The retention policy.
+    - cold (ReceiptStore or None): The store evicted entries are moved to.
+    - evicted (int): The number of entries evicted.
+    """
+
+    def __init__(self, uuid_dict=None):
+        self.uuid_dict = {} if uuid_dict is None else uuid_dict
+        self._ordered = sorted(receipt_id for receipt_id in self.uuid_dict
+                               if is_time_ordered(receipt_id))
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._unloaded = 0
+        self._loaded = threading.Event()
+        self._loaded.set()
+        self.load_error = None
+        self.retention = None
+        self.cold = None
+        self.evicted = 0
+        self._cold_entries = 0
+        self._dead = 0
+
+    def get(self, receipt_id):
+        entry = self.uuid_dict.get(receipt_id)
+        if entry is None:
+            snapshot = self._snapshot
+            if snapshot is not None:
+                entry = snapshot.get(receipt_id)
+            if entry is None and self.cold is not None:
+                entry = self.cold.get(receipt_id)
+        return entry
+
+    def put(self, receipt_id, entry):
+        self.put_many({receipt_id: entry})
+
+    def put_many(self, entries):
+        retention = self.retention
+        now = time.monotonic()
+        with self._lock:
+            ordered = self._ordered
+            for receipt_id, entry in entries.items():
+                if receipt_id in self.uuid_dict:
+                    continue
+                if is_time_ordered(receipt_id):
+                    if not ordered or receipt_id > ordered[-1]:
+                        ordered.append(receipt_id)
+                    else:
+                        bisect.insort(ordered, receipt_id)
+                if retention is not None:
+                    retention.add(receipt_id, entry, now)
+            self.uuid_dict.update(entries)
+            if retention is not None:
+                self._evict(now, len(entries) + retention.step)
+
+    def set_retention(self, retention, cold=None):
+        """
+        Bounds the entries kept in the dictionary. The entries already
+        stored count as added now.
+
+        Parameters:
+        - retention (db.retention.RetentionPolicy): The limits.
+        - cold (ReceiptStore): The store evicted entries are moved to, e.g.
+          a compressed SQLiteStore, or None to drop them. Its writes should
+          be committed in the background, since they are queued while the
+          store is locked.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for receipt_id, entry in self.uuid_dict.items():
+                retention.add(receipt_id, entry, now)
+            self.retention = retention
+            if cold is not None:
+                self._cold_entries = len(cold)
+            self.cold = cold
+
+    def _evict(self, now, budget):
+        """
+        Evicts up to budget entries picked by the retention policy, moving
+        them to the cold store first so that they stay readable. Called
+        with the lock held.
+        """
+        victims = {}
+        for receipt_id in self.retention.victims(len(self.uuid_dict), now,
+                                                 budget):
+            entry = self.uuid_dict.get(receipt_id)
+            if entry is not None:
+                victims[receipt_id] = entry
+        if not victims:
+            return
+        if self.cold is not None:
+            self.cold.put_many(victims)
+            self._cold_entries += len(victims)
+        for receipt_id in victims:
+            del self.uuid_dict[receipt_id]
+            if is_time_ordered(receipt_id):
+                self._dead += 1
+        self.evicted += len(victims)
+        # Evicted IDs are mostly the oldest, at the front of the sorted
+        # list, where they are trimmed once enough have piled up.
+        ordered = self._ordered
+        if self._dead >= max(TRIM_BATCH, len(ordered) >> 6):
+            dead = 0
+            while dead < len(ordered) and ordered[dead] not in self.uuid_dict:
+                dead += 1
+            del ordered[:dead]
+            self._dead -= dead
+
+    def load_snapshot(self, snapshot, chunk_size=200):
+        """
+        Starts loading the entries of a snapshot on a background thread.
+        The store serves reads from the snapshot straight away. Entries
+        stored meanwhile are kept over those in the snapshot.
+
+        Parameters:
+        - snapshot (db.snapshot.Snapshot): The snapshot.
+        - chunk_size (int): The number of entries added at once.
+        """
+        self._loaded.clear()
+        self._unloaded = len(snapshot)
+        self._snapshot = snapshot
+        threading.Thread(target=self._load, args=(snapshot, chunk_size),
+                         name="snapshot-loader", daemon=True).start()
+
+    def wait_loaded(self, timeout=None):
+        """
+        Waits until no snapshot is being loaded.
+
+        Returns:
+        - bool: False if the timeout expired first.
+        """
+        return self._loaded.wait(timeout)
+
+    def _load(self, snapshot, chunk_size):
+        """
+        Adds the entries of a snapshot to the dictionary, then merges their
+        time-ordered IDs into the sorted list. If a record cannot be read,
+        the rest stay readable through the snapshot.
+        """
+        ordered = []
+        try:
+            for chunk in snapshot.chunks(chunk_size):
+                retention = self.retention
+                now = time.monotonic()
+                with self._lock:
+                    for receipt_id, entry in chunk:
+                        if (self.uuid_dict.setdefault(receipt_id, entry)
+                                is not entry):
+                            continue
+                        if is_time_ordered(receipt_id):
+                            ordered.append(receipt_id)
+                        if retention is not None:
+                            retention.add(receipt_id, entry, now)
+                    self._unloaded -= len(chunk)
+                    if retention is not None:
+                        self._evict(now, len(chunk) + retention.step)
+                # Let request threads in between chunks.
+                time.sleep(0)
+        except Exception as e:
+            logger.exception("Loading the receipt snapshot %s failed",
+                             snapshot.path)
+            self.load_error = e
+        with self._lock:
+            # Both lists are mostly in order already, which the sort takes
+            # close to linear time over.
+            ordered += self._ordered
+            ordered.sort()
+            self._ordered = ordered
+            if self.load_error is None:
+                self._snapshot = None
+                self._unloaded = 0
+        self._loaded.set()
+
+    def chunks(self, size):
+        self._loaded.wait()
+        # The IDs are copied first, since the dictionary may grow meanwhile.
+        receipt_ids = list(self.uuid_dict)
+        for start in range(0, len(receipt_ids), size):
+            chunk = [(receipt_id, self.uuid_dict.get(receipt_id))
+                     for receipt_id in receipt_ids[start:start + size]]
+            yield [entry for entry in chunk if entry[1] is not None]
+
+    def scan(self, after, before, limit):
+        self._loaded.wait()
+        with self._lock:
+            ordered = self._ordered
+            start = bisect.bisect_right(ordered, after)
+            stop = bisect.bisect_left(ordered, before)
+            entries = []
+            for index in range(start, stop):
+                if len(entries) == limit:
+                    break
+                # Evicted IDs stay in the list until they are trimmed.
+                entry = self.uuid_dict.get(ordered[index])
+                if entry is not None:
+                    entries.append((ordered[index], entry))
+        if self.cold is None:
+            return entries
+        # Evicted entries may be stored again, so the dictionary's win.
+        merged = dict(self.cold.scan(after, before, limit))
+        merged.update(entries)
+        return sorted(merged.items())[:limit]
+
+    def __contains__(self, receipt_id):
+        return (receipt_id in self.uuid_dict
+                or (self._snapshot is not None or self.cold is not None)
+                and self.get(receipt_id) is not None)
+
+    def __len__(self):
+        """
+        Returns the number of entries. Entries still being loaded from a
+        snapshot and entries in the cold store are counted, the latter
+        approximately: an entry moved there twice counts twice.
+        """
+        return len(self.uuid_dict) + self._unloaded + self._cold_entries
+
+    def flush(self):
+        if self.cold is not None:
+            self.cold.flush()
+
+    def close(self):
+        if self.cold is not None:
+            self.cold.close()
+
+
+class SQLiteStore(ReceiptStore):
+    """
+    Keeps entries in an SQLite database in WAL mode.
+
+    Writes are buffered and committed as a group once batch_size entries
+    are pending or commit_interval seconds have passed, whichever comes
+    first. Pending entries are served from memory until they are committed.
+    On startup SQLite replays its write-ahead log, so recovery only costs
+    opening the file.
+
+    With sync_commit, put() only returns once its entry is committed, so
+    other processes sharing the database file (e.g. uvicorn workers) can
+    read it straight away. Writers that arrive while a commit is running
+    are grouped into the next one, so concurrent requests still share
+    commits.
+
+    With compress, entries are stored in about a third of the space, at
+    the cost of compressing them when they are committed and decompressing
+    them when they are read. The first ZDICT_ENTRIES entries committed
+    together train the compression dictionary; entries committed before
+    then are stored uncompressed.
+
+    Attributes:
+    - path (str): The database file.
+    - batch_size (int): The number of pending writes that triggers a commit.
+    - commit_interval (float): The longest time, in seconds, a write may stay
+      uncommitted.
+    - sync_commit (bool): Whether put() waits for its commit.
+    - compress (bool): Whether entries are compressed. They must be
+      ReceiptRecord objects, and the serialized response is not kept.
+    """
+
+    def __init__(self, path, batch_size=256, commit_interval=0.05,
+                 sync_commit=False, compress=False):
+        self.path = path
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self.sync_commit = sync_commit
+        self.compress = compress
+        self._zdict = None
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._committing = {}
+        self._generation = 1
+        self._committed = 0
+        self._local = threading.local()
+        self._readers = []
+        self._conn = self._connect()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS receipts ("
+                           "id TEXT PRIMARY KEY, entry BLOB NOT NULL"
+                           ") WITHOUT ROWID")
+        if compress:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta ("
+                               "name TEXT PRIMARY KEY, value BLOB NOT NULL"
+                               ") WITHOUT ROWID")
+            self._zdict = self._read_zdict(self._conn)
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically,
+                                         name="sqlite-store-flusher",
+                                         daemon=True)
+        self._flusher.start()
+
+    def get(self, receipt_id):
+        with self._cond:
+            entry = (self._pending.get(receipt_id)
+                     or self._committing.get(receipt_id))
+        if entry is not None:
+            return entry
+        row = self._reader().execute(
+            "SELECT entry FROM receipts WHERE id = ?",
+            (receipt_id,)).fetchone()
+        return None if row is None else self._loads(row[0])
+
+    def put(self, receipt_id, entry):
+        self.put_many({receipt_id: entry})
+
+    def put_many(self, entries):
+        with self._cond:
+            self._pending.update(entries)
+            if self.sync_commit or len(self._pending) >= self.batch_size:
+                self._commit(self._generation)
+
+    def __len__(self):
+        self.flush()
+        return self._reader().execute(
+            "SELECT COUNT(*) FROM receipts").fetchone()[0]
+
+    def scan(self, after, before, limit):
+        """
+        Reads a range of the primary key, which orders the table, after
+        committing the pending writes so that they are included.
+        """
+        self.flush()
+        rows = self._reader().execute(
+            "SELECT id, entry FROM receipts WHERE id > ? AND id < ? "
+            "AND substr(id, 15, 1) = '7' ORDER BY id LIMIT ?",
+            (after, before, limit)).fetchall()
+        return [(receipt_id, self._loads(entry))
+                for receipt_id, entry in rows]
+
+    def chunks(self, size):
+        """
+        Pages through the table in primary key order, one query per chunk,
+        so no read transaction stays open between chunks.
+        """
+        self.flush()
+        after = ""
+        while True:
+            rows = self._reader().execute(
+                "SELECT id, entry FROM receipts WHERE id > ? ORDER BY id "
+                "LIMIT ?", (after, size)).fetchall()
+            if not rows:
+                return
+            yield [(receipt_id, self._loads(entry))
+                   for receipt_id, entry in rows]
+            after = rows[-1][0]
+
+    def flush(self):
+        with self._cond:
+            self._commit(self._generation)
+
+    def close(self):
+        self._closed.set()
+        self._flusher.join()
+        self.flush()
+        with self._cond:
+            readers, self._readers = self._readers, []
+        for conn in readers:
+            conn.close()
+        self._conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30,
+                               check_same_thread=False,
+                               isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self):
+        """
+        Returns this thread's read connection, so that lookups never wait
+        for a commit. The connections are kept so that close() can close
+        them.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._cond:
+                self._readers.append(conn)
+        return conn
+
+    def _commit(self, generation):
+        """
+        Waits until every write of the given generation is committed,
+        committing the pending group itself if no other thread is. The
+        caller must hold the condition; it is released during the write.
+        """
+        while self._committed < generation:
+            if self._committing:
+                self._cond.wait()
+                continue
+            batch, self._pending = self._pending, {}
+            batch_generation = self._generation
+            self._generation += 1
+            if not batch:
+                self._committed = batch_generation
+                break
+            self._committing = batch
+            self._cond.release()
+            try:
+                self._write(batch)
+            except BaseException:
+                self._cond.acquire()
+                self._committing = {}
+                self._pending = {**batch, **self._pending}
+                self._cond.notify_all()
+                raise
+            self._cond.acquire()
+            self._committing = {}
+            self._committed = batch_generation
+            self._cond.notify_all()
+
+    def _read_zdict(self, conn):
+        """
+        Returns the compression dictionary stored in the database, or None.
+        """
+        row = conn.execute(
+            "SELECT value FROM meta WHERE name = 'zdict'").fetchone()
+        return None if row is None else row[0]
+
+    def _train_zdict(self, batch):
+        """
+        Returns the compression dictionary, storing one made of a batch of
+        entries first if the database has none and the batch is large
+        enough. Another process may have stored one meanwhile, so it is
+        read back in the same transaction.
+        """
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            zdict = self._read_zdict(self._conn)
+            if zdict is None and len(batch) >= ZDICT_ENTRIES:
+                sample = [pickle.dumps(pack_record(entry),
+                                       pickle.HIGHEST_PROTOCOL)
+                          for entry in list(batch.values())[:ZDICT_ENTRIES]]
+                zdict = b"".join(sample)[-ZDICT_SIZE:]
+                self._conn.execute(
+                    "INSERT INTO meta (name, value) VALUES ('zdict', ?)",
+                    (zdict,))
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+        return zdict
+
+    def _dumps(self, entry):
+        """
+        Serializes an entry, compressing it if enabled.
+        """
+        if not self.compress:
+            return pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+        data = pickle.dumps(pack_record(entry), pickle.HIGHEST_PROTOCOL)
+        if self._zdict is None:
+            return bytes((RAW_ENTRY,)) + data
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15,
+                                      zdict=self._zdict)
+        return (bytes((DEFLATED_ENTRY,)) + compressor.compress(data)
+                + compressor.flush())
+
+    def _loads(self, blob):
+        """
+        Deserializes an entry written by _dumps.
+        """
+        if not self.compress:
+            return pickle.loads(blob)
+        data = memoryview(blob)[1:]
+        if blob[0] == DEFLATED_ENTRY:
+            if self._zdict is None:
+                self._zdict = self._read_zdict(self._reader())
+            decompressor = zlib.decompressobj(-15, zdict=self._zdict)
+            data = decompressor.decompress(data) + decompressor.flush()
+        return unpack_record(pickle.loads(data))
+
+    def _write(self, batch):
+        """
+        Writes a group of entries in a single transaction.
+        """
+        if self.compress and self._zdict is None:
+            self._zdict = self._train_zdict(batch)
+        rows = [(receipt_id, self._dumps(entry))
+                for receipt_id, entry in batch.items()]
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO receipts (id, entry) VALUES (?, ?)",
+                rows)
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.commit_interval):
+            self.flush()
+
+
+def open_store(url, uuid_dict=None, **options):
+    """
+    Creates a receipt store from a URL.
+
+    Parameters:
+    - url (str): "memory" for a DictStore, or "sqlite:///path" for an
+      SQLiteStore at the given path.
+    - uuid_dict (dict): The dictionary backing a DictStore.
+    - **options: Extra keyword arguments passed to the SQLiteStore.
+
+    Returns:
+    - ReceiptStore: The new store.
+
+    Raises:
+    - ValueError: If the URL scheme is not supported.
+    """
+    if url == "memory":
+        return DictStore(uuid_dict)
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(url[len("sqlite:///"):], **options)
+    raise ValueError(f"Unsupported receipt store URL: {url}")
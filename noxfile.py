@@ -1,6 +1,6 @@
 """
 This script sets up a virtual environment, installs required packages,
-and performs linting using Flake8.
+performs linting using Flake8, runs the tests and the benchmark suite.
 
 """
 
@@ -53,6 +53,50 @@ def lint(session) -> None:
         session.error("Linting failed.")
 
 
+@nox.session(python=VERSION, reuse_venv=True)
+def tests(session) -> None:
+    """
+    Runs the test suite with pytest.
+
+    Args:
+        session (nox.Session): The Nox session object.
+
+    Raises:
+        nox.command.CommandFailed: If any test fails.
+    """
+    session_name = "tests"
+    activate_venv(session, session_name)
+    try:
+        session.run("pip3", "install", "-r", "requirements-test.txt")
+        session.run("python", "-m", "pytest", "tests", *session.posargs)
+    except nox.command.CommandFailed:
+        session.error("Tests failed.")
+
+
+@nox.session(python=VERSION, reuse_venv=True)
+def bench(session) -> None:
+    """
+    Runs the benchmark suite and writes the results to bench_results.json.
+
+    Extra arguments are passed to the suite, e.g.
+    `nox -s bench -- --compare baseline.json` fails the session if any
+    result regressed against a saved run.
+
+    Args:
+        session (nox.Session): The Nox session object.
+
+    Raises:
+        nox.command.CommandFailed: If the benchmarks fail or regress.
+    """
+    session_name = "bench"
+    activate_venv(session, session_name)
+    try:
+        session.run("pip3", "install", "-r", "requirements.txt")
+        session.run("python", "-m", "bench.suite", *session.posargs)
+    except nox.command.CommandFailed:
+        session.error("Benchmarks failed.")
+
+
 def activate_venv(session, session_name):
     """
     Activates the virtual environment based on the platform.
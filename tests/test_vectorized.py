@@ -0,0 +1,128 @@
+"""
+Checks that the NumPy batch scorer (app.vectorized) gives the same points
+as score_record, including amounts at and beyond the int64 columns.
+
+Run with `python -m pytest tests` or `nox -s tests`.
+
+"""
+
+import random
+import string
+
+import pytest
+
+from app.models import Receipt
+from app.utils import score_record
+from app.vectorized import MAX_CENTS, score_batch
+from db.records import ReceiptRecord
+
+
+pytest.importorskip("numpy")
+
+
+def random_money(rng):
+    """
+    Returns a money string, usually well formed.
+    """
+    roll = rng.random()
+    if roll < 0.02:
+        return rng.choice(["abc", "", "1.005", "1e3", "-1.00", "0.1", "nan"])
+    if roll < 0.04:
+        # Amounts around and beyond what the int64 columns hold.
+        cents = rng.choice([2 ** 53 + 1, 2 ** 63 - 1, 2 ** 63, 10 ** 20])
+    else:
+        cents = rng.choice([rng.randint(0, 100000),
+                            rng.randint(0, 400) * 25])
+    return f"{cents // 100}.{cents % 100:02d}"
+
+
+def random_receipt(rng):
+    """
+    Returns a random receipt dictionary, biased towards rule boundaries,
+    huge amounts and malformed fields.
+    """
+    alphabet = string.ascii_letters + string.digits + " &-'.é"
+    items = [{"shortDescription": "".join(rng.choice(alphabet)
+                                          for _ in range(rng.randint(0, 12))),
+              "price": random_money(rng)}
+             for _ in range(rng.randint(0, 7))]
+    date = f"2023-{rng.randint(1, 12):02d}-{rng.randint(1, 31):02d}"
+    if rng.random() < 0.02:
+        date = rng.choice(["2023-01", "x", "2023-01-0a"])
+    time_ = f"{rng.choice([13, 14, 15, 16, rng.randint(0, 23)]):02d}:" \
+            f"{rng.choice([0, 1, 59, rng.randint(0, 59)]):02d}"
+    if rng.random() < 0.02:
+        time_ = rng.choice(["14", "14:3x", "1430"])
+    return {"retailer": "".join(rng.choice(alphabet)
+                                for _ in range(rng.randint(0, 20))),
+            "purchaseDate": date,
+            "purchaseTime": time_,
+            "total": random_money(rng),
+            "items": items}
+
+
+def make_record(total, prices, description="abc"):
+    """
+    Returns a ReceiptRecord with the given total and item prices, in
+    cents.
+    """
+    return ReceiptRecord.from_receipt(Receipt.model_validate({
+        "retailer": "Target",
+        "purchaseDate": "2022-01-01",
+        "purchaseTime": "14:33",
+        "total": f"{total // 100}.{total % 100:02d}",
+        "items": [{"shortDescription": description,
+                   "price": f"{price // 100}.{price % 100:02d}"}
+                  for price in prices],
+    }))
+
+
+def check(records):
+    """
+    Asserts that both scorers give the same points. The batch is scored
+    first, since score_record overwrites the records' scores.
+    """
+    batch = score_batch(records).tolist()
+    assert batch == [score_record(record).points for record in records]
+
+
+AMOUNTS = [
+    0, 1, 25, 100, 499, 500, 501, 10 ** 12,
+    # Above 2 ** 53, where float64 no longer holds every integer.
+    9000000000000000001,
+    2 ** 53 + 1,
+    MAX_CENTS - 1, MAX_CENTS, MAX_CENTS + 1,
+    2 ** 64, 10 ** 30,
+]
+
+
+@pytest.mark.parametrize("cents", AMOUNTS)
+def test_boundary_amounts(cents):
+    check([make_record(cents, [cents]), make_record(100, [cents, 100]),
+           make_record(cents, [])])
+
+
+def test_large_item_points_are_exact():
+    # The item of 90000000000000000.01 scores 18000000000000001 points,
+    # which float64 rounds to 18000000000000000.
+    record = make_record(100, [9000000000000000001])
+    assert score_batch([record]).tolist() == [18000000000000098]
+    assert score_record(record).points == 18000000000000098
+
+
+def test_prices_summing_past_int64_are_scored_one_by_one():
+    prices = [MAX_CENTS // 2 + 1] * 3
+    check([make_record(100, [100]), make_record(100, prices),
+           make_record(MAX_CENTS + 1, [100]), make_record(100, [100])])
+
+
+def test_random_receipts_match_scalar():
+    rng = random.Random(0)
+    records = []
+    while len(records) < 2000:
+        try:
+            records.append(ReceiptRecord.from_receipt(
+                Receipt.model_validate(random_receipt(rng))))
+        except ValueError:
+            continue
+    check(records)